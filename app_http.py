@@ -3,48 +3,118 @@ Tushare MCP Server - Streamable HTTP Transport
 部署到 Smithery 的 HTTP MCP 服务器
 """
 import os
-import json
-from typing import List, Dict
+import asyncio
+import hmac
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
 
-import pandas as pd
-from fastmcp import FastMCP
+from fastmcp import Context, FastMCP
+from fastmcp.exceptions import ToolError
+from fastmcp.server.dependencies import get_http_request
+from fastmcp.tools.tool import ToolResult
 from starlette.requests import Request
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, Response
+
+from encoding import COLUMNS, RECORDS, SHAPES, dumps, frame_result, json_result, page_payload, page_result
+from frames import decode_cursor, encode_cursor, paginate, select_fields
+import memo
+from memo import memoize
+from metrics import CONTENT_TYPE, instrument, render
+from resilience import stale_age
+import service
+from service import BASIC_INFO_FIELDS, SEARCH_FIELDS
+import tracing
+from workers import STATELESS_HTTP, WORKERS
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from tenants import Tenant
 
 # ---------------------------
 # 1) 初始化 Tushare
 # ---------------------------
-TUSHARE_TOKEN = os.getenv("TUSHARE_TOKEN", "").strip()
+# 租户、缓存和查询逻辑都在 service 模块，与 stdio 入口（server.py）共用；
+# 请求可通过 X-Tushare-Token 请求头或会话配置携带自己的 token，
+# 未携带时使用 TUSHARE_TOKEN（环境变量或 ~/.tushare_mcp/.env）。
+# pandas 等较重的依赖在首次使用或后台预热时才导入，
+# 冷启动时可以先监听端口、响应 /health 和 tools/list。
+# 多 worker 时由各 worker 进程导入本模块后各自预热，
+# 以 python app_http.py 启动的主进程只负责管理 worker，不加载数据模块。
+if __name__ != "__main__" or WORKERS == 1:
+    service.start_warmup()
 
-try:
-    import tushare as ts
-    if TUSHARE_TOKEN:
-        ts.set_token(TUSHARE_TOKEN)
-        print(f"[init] Tushare token configured")
-    else:
-        print("[init] TUSHARE_TOKEN not set - tools will require configuration")
-    
-    pro = ts.pro_api()
-    
-    # 轻量级探针测试
-    if TUSHARE_TOKEN:
-        try:
-            pro.stock_basic(limit=1)
-            print("[init] Tushare API connection OK")
-        except Exception as e:
-            print(f"[init] Tushare API probe failed (non-blocking): {e}")
-except Exception as e:
-    print(f"[init] Tushare import failed: {e}")
-    pro = None
+
+def _request_token() -> Optional[str]:
+    """当前 HTTP 请求携带的 token，未携带或不在请求上下文中时为 None"""
+    from tenants import token_from_request
+    try:
+        request = get_http_request()
+    except RuntimeError:
+        return None
+    return token_from_request(request.headers, request.query_params)
+
+
+def current_tenant() -> Optional["Tenant"]:
+    """当前请求的租户，请求未携带 token 时为默认租户；携带的 token 未通过验证时抛出 tenants.InvalidToken"""
+    try:
+        return service.tenant(_request_token())
+    except service.TokenNotConfigured:
+        return None
+
+
+def _traceparent() -> Optional[str]:
+    """当前 HTTP 请求的 W3C traceparent 头，调用方已在追踪时沿用其 trace_id"""
+    try:
+        return get_http_request().headers.get("traceparent")
+    except RuntimeError:
+        return None
+
+
+tracing.set_parent_source(_traceparent)
+
+
+def _failure(message: str, e: Exception) -> Dict:
+    """工具内部异常的错误信息：异常类型和请求 ID（堆栈记录在追踪中）；错误结果不缓存"""
+    memo.no_store()
+    return {"error": f"{message}: {str(e)}", "error_type": type(e).__name__, "request_id": tracing.record_exception(e)}
+
+
+def _ensure_token() -> Tuple[Optional["Tenant"], Optional[Dict]]:
+    """验证 Token 是否可用，返回 (租户, 错误信息)"""
+    from tenants import InvalidToken
+    try:
+        tenant = current_tenant()
+    except InvalidToken as e:
+        return None, {"error": str(e)}
+    except Exception as e:
+        # 新 token 验证时上游暂时不可用，下次请求重新验证
+        return None, _failure("Token verification failed", e)
+    if tenant is None:
+        return None, {"error": "TUSHARE_TOKEN not configured"}
+    return tenant, None
+
+
+def _memo_scope() -> Optional[str]:
+    """工具输出缓存按租户隔离，未配置 token 或 token 未通过验证时不缓存"""
+    try:
+        tenant = current_tenant()
+    except Exception:
+        # token 无效或暂时无法验证，由工具本身返回错误
+        return None
+    return tenant.namespace if tenant is not None else None
 
 
-def _ensure_token():
-    """验证 Token 是否可用"""
-    if pro is None:
-        return False, {"error": "Tushare SDK not available"}
-    if not TUSHARE_TOKEN:
-        return False, {"error": "TUSHARE_TOKEN not configured"}
-    return True, None
+async def _aensure_token() -> Tuple[Optional["Tenant"], Optional[Dict]]:
+    """
+    异步工具使用：只有租户已在内存中时才直接在事件循环中取得；
+    预热尚未完成（等待导入）或新 token 需要访问上游验证时在线程池中执行，不阻塞事件循环
+    """
+    registry = service.loaded_registry()
+    if registry is None or not registry.cached(_request_token()):
+        return await run_blocking(_ensure_token)
+    return _ensure_token()
 
 
 # ---------------------------
@@ -52,6 +122,95 @@ def _ensure_token():
 # ---------------------------
 mcp = FastMCP("tushare-mcp")
 
+# 工具中的 Tushare SDK 调用是阻塞的，放到有界线程池执行，
+# 避免一次慢请求卡住事件循环（/health 和其他会话）
+WORKER_THREADS = int(os.getenv("TUSHARE_WORKER_THREADS", "16"))
+TOOL_TIMEOUT = float(os.getenv("TUSHARE_TOOL_TIMEOUT", "60"))
+_executor = ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix="tushare-tool")
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    在线程池中执行阻塞函数并等待结果
+
+    超过 TOOL_TIMEOUT 秒或客户端断开（任务被取消）时立即停止等待；
+    尚未开始执行的调用会被直接丢弃。
+    """
+    loop = asyncio.get_running_loop()
+    call = functools.partial(contextvars.copy_context().run, _profiled, func, *args, **kwargs)
+    try:
+        return await asyncio.wait_for(loop.run_in_executor(_executor, call), TOOL_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise ToolError(f"Tushare request timed out after {TOOL_TIMEOUT:g}s") from None
+
+
+def _profiled(func, *args, **kwargs):
+    """工作线程中执行，当前调用被抽中剖析时对这段执行做性能剖析（见 tracing.Profiler）"""
+    with tracing.profiler.run():
+        return func(*args, **kwargs)
+
+
+def offload(func):
+    """把同步工具函数包装为协程，通过 run_blocking 在线程池中执行"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_blocking(func, *args, **kwargs)
+    return wrapper
+
+
+# 游标分页的默认每页条数
+DEFAULT_PAGE_SIZE = int(os.getenv("TUSHARE_PAGE_SIZE", "200"))
+
+
+def _can_stream(ctx: Context) -> bool:
+    """客户端请求中带了 progressToken 才能接收进度通知"""
+    meta = ctx.request_context.meta if ctx.request_context else None
+    return meta is not None and meta.progressToken is not None
+
+
+async def paged_result(
+    ctx: Context,
+    fetch_page: Callable[[int, int], Tuple["pd.DataFrame", Optional[int]]],
+    query: Dict,
+    cursor: str,
+    page_size: int,
+    shape: str,
+    stream: bool,
+) -> ToolResult:
+    """
+    游标分页
+
+    参数:
+        fetch_page: 阻塞函数 (offset, size) -> (该页数据, 总条数或 None)
+        query: 查询条件，游标与之绑定
+        stream: 为 True 且客户端支持进度通知时，逐页以进度通知推送
+                （message 为该页 JSON），最终结果只包含统计信息
+    """
+    offset = decode_cursor(cursor, query) if cursor else 0
+    size = page_size if page_size and page_size > 0 else DEFAULT_PAGE_SIZE
+
+    if stream and _can_stream(ctx):
+        rows = pages = 0
+        age = None
+        while True:
+            df, total = await run_blocking(fetch_page, offset, size)
+            if df.empty:
+                break
+            age = stale_age(df) if age is None else age
+            offset += len(df)
+            rows += len(df)
+            pages += 1
+            next_cursor = encode_cursor(offset, query) if len(df) == size else None
+            await ctx.report_progress(rows, total, dumps(page_payload(df, shape, next_cursor, total)))
+            if next_cursor is None:
+                break
+        return json_result({"streamed": True, "pages": pages, "rows": rows}, age)
+
+    # 多取一条判断是否还有下一页
+    df, total = await run_blocking(fetch_page, offset, size + 1)
+    next_cursor = encode_cursor(offset + size, query) if len(df) > size else None
+    return page_result(df.iloc[:size], shape, next_cursor, total)
+
 
 # ---------------------------
 # 3) 添加自定义路由
@@ -59,15 +218,81 @@ mcp = FastMCP("tushare-mcp")
 @mcp.custom_route("/health", methods=["GET"])
 async def health_check(request: Request) -> JSONResponse:
     """健康检查端点"""
+    registry = service.loaded_registry()
     return JSONResponse({
         "status": "healthy",
         "service": "tushare-mcp",
         "version": "1.2.0",
-        "token_configured": bool(TUSHARE_TOKEN),
+        "token_configured": bool(service.default_token()),
+        "ready": service.warmup.ready,
+        "warmup": service.warmup.status(),
+        "tenants": len(registry) if registry is not None else 0,
+        "circuit": registry.default.client.breaker.state if registry is not None and registry.default else None,
+        "prefetch": service.prefetcher.status() if service.prefetcher is not None else None,
+        "memo": memo.status(),
+        "worker": {"pid": os.getpid(), "workers": WORKERS, "stateless_http": STATELESS_HTTP},
+        "tracing": tracing.exporter.status(),
         "mcp_endpoint": "/mcp"
     })
 
 
+@mcp.custom_route("/metrics", methods=["GET"])
+async def metrics_endpoint(request: Request) -> Response:
+    """Prometheus 指标"""
+    return Response(render(), media_type=CONTENT_TYPE)
+
+
+# 管理路由（/admin/*）的访问令牌，请求需带 Authorization: Bearer <令牌>；为空时不开放管理路由
+ADMIN_TOKEN = os.getenv("TUSHARE_ADMIN_TOKEN", "")
+
+
+def _admin_denied(request: Request) -> Optional[Response]:
+    """未配置 ADMIN_TOKEN 时返回 404，令牌不符时返回 401，通过时返回 None"""
+    if not ADMIN_TOKEN:
+        return JSONResponse({"error": "not found"}, status_code=404)
+    supplied = request.headers.get("authorization", "").removeprefix("Bearer ").strip()
+    if not hmac.compare_digest(supplied.encode(), ADMIN_TOKEN.encode()):
+        return JSONResponse({"error": "unauthorized"}, status_code=401)
+    return None
+
+
+@mcp.custom_route("/admin/profiler", methods=["GET", "POST"])
+async def profiler_admin(request: Request) -> Response:
+    """
+    采样性能剖析的开关
+
+    GET 返回当前配置和最近的剖析结果；
+    POST JSON {"sample": 0~1, "tools": [工具名, ...], "engine": "cprofile"|"pyinstrument"} 修改配置，
+    sample 为 0 时关闭，tools 为空时对所有工具采样；配置对所有 worker 生效。
+    """
+    denied = _admin_denied(request)
+    if denied is not None:
+        return denied
+    if request.method == "POST":
+        try:
+            body = await request.json()
+            config = tracing.profiler.configure(
+                float(body.get("sample", 0)), body.get("tools") or [], body.get("engine", "cprofile")
+            )
+        except Exception as e:
+            return JSONResponse({"error": str(e), "error_type": type(e).__name__}, status_code=400)
+    else:
+        config = tracing.profiler.config()
+    return JSONResponse({"config": config, "profiles": tracing.profiler.recent()})
+
+
+@mcp.custom_route("/admin/profiler/{profile_id}", methods=["GET"])
+async def profile_report(request: Request) -> Response:
+    """一次剖析的文本报告，profile_id 为请求 ID 或 /admin/profiler 列出的 id"""
+    denied = _admin_denied(request)
+    if denied is not None:
+        return denied
+    report = await asyncio.to_thread(tracing.profiler.report, request.path_params["profile_id"])
+    if report is None:
+        return JSONResponse({"error": "profile not found"}, status_code=404)
+    return Response(report, media_type="text/plain; charset=utf-8")
+
+
 @mcp.custom_route("/", methods=["GET"])
 async def root(request: Request) -> JSONResponse:
     """根路径信息"""
@@ -79,12 +304,20 @@ async def root(request: Request) -> JSONResponse:
         "endpoints": {
             "mcp": "/mcp",
             "health": "/health",
+            "metrics": "/metrics",
             "root": "/"
         },
         "tools": [
             "get_stock_basic_info",
             "search_stocks",
             "get_income_statement",
+            "get_income_statements_batch",
+            "get_balance_sheet",
+            "get_cash_flow",
+            "get_financial_indicators",
+            "get_fundamentals",
+            "get_daily_prices",
+            "screen_stocks",
             "check_token_status"
         ]
     })
@@ -94,12 +327,21 @@ async def root(request: Request) -> JSONResponse:
 # 4) MCP 工具定义
 # ---------------------------
 @mcp.tool()
-def get_stock_basic_info(
+@instrument
+async def get_stock_basic_info(
+    ctx: Context,
     ts_code: str = "", 
     name: str = "", 
     exchange: str = "", 
-    list_status: str = ""
-) -> List[Dict]:
+    list_status: str = "",
+    fields: str = "",
+    limit: int = 100,
+    offset: int = 0,
+    shape: str = RECORDS,
+    cursor: str = "",
+    page_size: int = 0,
+    stream: bool = False
+) -> ToolResult:
     """
     查询股票基础信息
     
@@ -108,114 +350,508 @@ def get_stock_basic_info(
         name: 股票名称（如：平安银行）- 模糊匹配
         exchange: 交易所代码 (SSE=上交所, SZSE=深交所)
         list_status: 上市状态 (L=上市, D=退市, P=暂停上市)
+        fields: 返回字段，逗号分隔（默认：ts_code,symbol,name,area,industry,market,list_date,fullname,enname,cnspell,list_status,exchange）
+        limit: 返回记录数上限（默认100，0表示不限）
+        offset: 跳过前若干条记录，用于翻页
+        shape: 输出形态，records=记录列表（默认），columns={"columns": [...], "data": [[...]]}
+        cursor: 游标分页，传入上一页返回的 next_cursor
+        page_size: 游标分页每页条数；设置 cursor/page_size/stream 任一项即进入游标分页，
+                   返回 {"data": ..., "next_cursor": ..., "total": ...}，此时忽略 limit/offset
+        stream: 逐页通过进度通知推送全部结果（需客户端支持进度通知）
     
     返回:
-        股票基础信息列表，包含代码、名称、行业、地区等信息
+        股票基础信息列表，包含代码、名称、行业、地区等信息；缺失值为 null
     """
-    ok, error = _ensure_token()
-    if not ok:
-        return [error]
+    tenant, error = await _aensure_token()
+    if tenant is None:
+        return json_result([error])
+    if shape not in SHAPES:
+        return json_result([{"error": f"shape must be one of {', '.join(SHAPES)}"}])
+    
+    def fetch_page(start: int, size: int):
+        df = service.stock_basic(tenant, ts_code, name, exchange, list_status)
+        return select_fields(paginate(df, size, start), fields, BASIC_INFO_FIELDS), len(df)
     
     try:
-        df = pro.stock_basic(
-            ts_code=ts_code or None,
-            name=name or None,
-            exchange=exchange or None,
-            list_status=list_status or None,
-            fields="ts_code,symbol,name,area,industry,market,list_date,fullname,enname,cnspell,list_status,exchange"
-        )
-        
-        if df is None or df.empty:
-            return []
+        if cursor or page_size or stream:
+            filters = {"tool": "get_stock_basic_info", "ts_code": ts_code, "name": name,
+                       "exchange": exchange, "list_status": list_status, "fields": fields}
+            return await paged_result(ctx, fetch_page, filters, cursor, page_size, shape, stream)
         
-        return json.loads(df.fillna("").to_json(orient="records"))
+        df, _ = await run_blocking(fetch_page, offset, limit)
+        return frame_result(df, shape)
+    except ToolError:
+        raise
     except Exception as e:
-        return [{"error": f"Query failed: {str(e)}"}]
+        return json_result([_failure("Query failed", e)])
 
 
 @mcp.tool()
-def search_stocks(keyword: str) -> List[Dict]:
+@instrument
+async def search_stocks(
+    ctx: Context,
+    keyword: str,
+    limit: int = 50,
+    offset: int = 0,
+    fields: str = "",
+    shape: str = RECORDS,
+    cursor: str = "",
+    page_size: int = 0,
+    stream: bool = False
+) -> ToolResult:
     """
     搜索股票
     
     参数:
-        keyword: 搜索关键词（可匹配代码、名称、行业、地区）
+        keyword: 搜索关键词（可匹配代码、名称、拼音首字母、行业、地区）
+        limit: 返回结果数量上限（默认50）
+        offset: 跳过前若干条结果，用于翻页
+        fields: 返回字段，逗号分隔（默认：ts_code,symbol,name,area,industry,market,list_date）
+        shape: 输出形态，records=记录列表（默认），columns={"columns": [...], "data": [[...]]}
+        cursor: 游标分页，传入上一页返回的 next_cursor
+        page_size: 游标分页每页条数；设置 cursor/page_size/stream 任一项即进入游标分页，
+                   返回 {"data": ..., "next_cursor": ..., "total": null}，此时忽略 limit/offset
+        stream: 逐页通过进度通知推送全部结果（需客户端支持进度通知）
     
     返回:
-        匹配的股票列表
+        匹配的股票列表，按匹配度排序（代码精确匹配 > 代码前缀 > 名称 > 行业/地区）
     """
-    ok, error = _ensure_token()
-    if not ok:
-        return [error]
+    tenant, error = await _aensure_token()
+    if tenant is None:
+        return json_result([error])
+    if shape not in SHAPES:
+        return json_result([{"error": f"shape must be one of {', '.join(SHAPES)}"}])
+    
+    def fetch_page(start: int, size: int):
+        results = service.search(tenant, keyword, limit=size, offset=start)
+        return select_fields(results, fields, SEARCH_FIELDS), None
     
     try:
-        df = pro.stock_basic(
-            fields="ts_code,symbol,name,area,industry,market,list_date"
-        )
-        
-        if df is None or df.empty:
-            return []
+        if cursor or page_size or stream:
+            filters = {"tool": "search_stocks", "keyword": keyword, "fields": fields}
+            return await paged_result(ctx, fetch_page, filters, cursor, page_size, shape, stream)
         
-        kw = (keyword or "").strip().lower()
-        if not kw:
-            return []
-        
-        # 多字段模糊搜索
-        mask = (
-            df["ts_code"].astype(str).str.lower().str.contains(kw, na=False)
-            | df["symbol"].astype(str).str.lower().str.contains(kw, na=False)
-            | df["name"].astype(str).str.lower().str.contains(kw, na=False)
-            | df["area"].astype(str).str.lower().str.contains(kw, na=False)
-            | df["industry"].astype(str).str.lower().str.contains(kw, na=False)
-            | df["market"].astype(str).str.lower().str.contains(kw, na=False)
-        )
-        
-        results = df[mask]
-        return json.loads(results.fillna("").to_json(orient="records"))
+        results, _ = await run_blocking(fetch_page, offset, limit)
+        return frame_result(results, shape)
+    except ToolError:
+        raise
     except Exception as e:
-        return [{"error": f"Search failed: {str(e)}"}]
+        return json_result([_failure("Search failed", e)])
 
 
 @mcp.tool()
+@instrument
+@offload
+@memoize(_memo_scope, "http")
 def get_income_statement(
     ts_code: str, 
     period: str = "", 
-    limit: int = 60
-) -> List[Dict]:
+    start_date: str = "",
+    end_date: str = "",
+    report_type: str = "1",
+    limit: int = 60,
+    offset: int = 0,
+    fields: str = "",
+    shape: str = RECORDS,
+    revisions: bool = False
+) -> ToolResult:
     """
     获取上市公司利润表数据
     
     参数:
         ts_code: 股票代码（必填，如：000001.SZ）
         period: 报告期（可选，格式：YYYYMMDD，如：20231231）
+        start_date: 公告开始日期（可选，格式：YYYYMMDD）
+        end_date: 公告结束日期（可选，格式：YYYYMMDD）
+        report_type: 报告类型（可选，默认1合并报表；2单季合并；6母公司报表等，与 Tushare income 接口一致）
         limit: 返回记录数量限制（默认60条）
+        offset: 跳过前若干条记录，用于翻页
+        fields: 返回字段，逗号分隔（可选，默认返回全部字段，如：end_date,total_revenue,n_income）
+        shape: 输出形态，records=记录列表（默认），columns={"columns": [...], "data": [[...]]}
+        revisions: 是否返回更正记录（可选，默认 false：每个报告期只返回最新更正的一条；
+                   true：返回同一报告期的全部披露，以 update_flag 区分，1 为最新）
     
     返回:
-        利润表数据列表，包含营收、利润、费用等财务指标
+        利润表数据列表，包含营收、利润、费用等财务指标，按报告期倒序；缺失值为 null
     """
-    ok, error = _ensure_token()
-    if not ok:
-        return [error]
+    tenant, error = _ensure_token()
+    if tenant is None:
+        return json_result([error])
+    if shape not in SHAPES:
+        return json_result([{"error": f"shape must be one of {', '.join(SHAPES)}"}])
     
     if not ts_code:
-        return [{"error": "ts_code is required"}]
+        return json_result([{"error": "ts_code is required"}])
     
     try:
-        df = pro.income(
-            ts_code=ts_code, 
-            period=period or None, 
-            limit=limit
-        )
-        
-        if df is None or df.empty:
-            return []
+        df = service.income_statement(tenant, ts_code, report_type, period, start_date, end_date, revisions)
+        keep = ("ts_code", "end_date", "update_flag") if revisions else ("ts_code", "end_date")
+        df = select_fields(paginate(df, limit, offset), fields, keep=keep)
         
-        return json.loads(df.fillna("").to_json(orient="records"))
+        return frame_result(df, shape)
     except Exception as e:
-        return [{"error": f"Query failed: {str(e)}"}]
+        return json_result([_failure("Query failed", e)])
 
 
 @mcp.tool()
+@instrument
+@offload
+@memoize(_memo_scope, "http")
+def get_income_statements_batch(
+    ts_codes: List[str],
+    period: str = "",
+    start_date: str = "",
+    end_date: str = "",
+    report_type: str = "1",
+    fields: str = "",
+    limit: int = 0,
+    offset: int = 0,
+    revisions: bool = False
+) -> ToolResult:
+    """
+    批量获取多只股票的利润表数据（横向对比）
+    
+    参数:
+        ts_codes: 股票代码列表（必填，如：["000001.SZ", "600000.SH"]）
+        period: 报告期（可选，格式：YYYYMMDD，如：20231231）
+        start_date: 公告开始日期（可选，格式：YYYYMMDD）
+        end_date: 公告结束日期（可选，格式：YYYYMMDD）
+        report_type: 报告类型（可选，默认1合并报表，同 get_income_statement）
+        fields: 返回字段，逗号分隔（可选，默认为营收、利润、每股收益等主要指标）
+        limit: 返回记录数上限（可选，默认0表示不限）
+        offset: 跳过前若干条记录，用于翻页
+        revisions: 是否返回更正记录（可选，默认 false，同 get_income_statement）
+    
+    返回:
+        列式结果 {"columns": [...], "data": [[...], ...], "errors": {股票代码: 错误信息}}
+    """
+    tenant, error = _ensure_token()
+    if tenant is None:
+        return json_result(error)
+    
+    if not ts_codes:
+        return json_result({"error": "ts_codes is required"})
+    
+    from statement_store import INCOME_SUMMARY_FIELDS
+    
+    try:
+        df, errors = service.income_statements(
+            tenant, ts_codes, report_type, period, start_date, end_date, fields, revisions
+        )
+        keep = ("ts_code", "end_date", "update_flag") if revisions else ("ts_code", "end_date")
+        df = select_fields(paginate(df, limit, offset), fields, INCOME_SUMMARY_FIELDS, keep=keep)
+        return frame_result(df, COLUMNS, errors=errors)
+    except Exception as e:
+        return json_result(_failure("Query failed", e))
+
+
+def _statement_result(
+    endpoint: str,
+    ts_code: str,
+    period: str,
+    start_date: str,
+    end_date: str,
+    report_type: str,
+    limit: int,
+    offset: int,
+    fields: str,
+    shape: str,
+) -> ToolResult:
+    """资产负债表、现金流量表和财务指标工具的公共部分"""
+    tenant, error = _ensure_token()
+    if tenant is None:
+        return json_result([error])
+    if shape not in SHAPES:
+        return json_result([{"error": f"shape must be one of {', '.join(SHAPES)}"}])
+
+    if not ts_code:
+        return json_result([{"error": "ts_code is required"}])
+
+    try:
+        df = service.statement(tenant, endpoint, ts_code, report_type, period, start_date, end_date)
+        df = select_fields(paginate(df, limit, offset), fields, keep=("ts_code", "end_date"))
+        return frame_result(df, shape)
+    except Exception as e:
+        return json_result([_failure("Query failed", e)])
+
+
+@mcp.tool()
+@instrument
+@offload
+@memoize(_memo_scope, "http")
+def get_balance_sheet(
+    ts_code: str,
+    period: str = "",
+    start_date: str = "",
+    end_date: str = "",
+    report_type: str = "1",
+    limit: int = 60,
+    offset: int = 0,
+    fields: str = "",
+    shape: str = RECORDS
+) -> ToolResult:
+    """
+    获取上市公司资产负债表数据
+
+    参数:
+        ts_code: 股票代码（必填，如：000001.SZ）
+        period: 报告期（可选，格式：YYYYMMDD，如：20231231）
+        start_date: 公告开始日期（可选，格式：YYYYMMDD）
+        end_date: 公告结束日期（可选，格式：YYYYMMDD）
+        report_type: 报告类型（可选，默认1合并报表，同 get_income_statement）
+        limit: 返回记录数量限制（默认60条）
+        offset: 跳过前若干条记录，用于翻页
+        fields: 返回字段，逗号分隔（可选，默认返回全部字段，如：end_date,total_assets,total_liab）
+        shape: 输出形态，records=记录列表（默认），columns={"columns": [...], "data": [[...]]}
+
+    返回:
+        资产负债表数据列表，每个报告期一条（更正后的最新数据），按报告期倒序；金额单位为元
+    """
+    return _statement_result(
+        "balancesheet", ts_code, period, start_date, end_date, report_type, limit, offset, fields, shape
+    )
+
+
+@mcp.tool()
+@instrument
+@offload
+@memoize(_memo_scope, "http")
+def get_cash_flow(
+    ts_code: str,
+    period: str = "",
+    start_date: str = "",
+    end_date: str = "",
+    report_type: str = "1",
+    limit: int = 60,
+    offset: int = 0,
+    fields: str = "",
+    shape: str = RECORDS
+) -> ToolResult:
+    """
+    获取上市公司现金流量表数据
+
+    参数:
+        ts_code: 股票代码（必填，如：000001.SZ）
+        period: 报告期（可选，格式：YYYYMMDD，如：20231231）
+        start_date: 公告开始日期（可选，格式：YYYYMMDD）
+        end_date: 公告结束日期（可选，格式：YYYYMMDD）
+        report_type: 报告类型（可选，默认1合并报表，同 get_income_statement）
+        limit: 返回记录数量限制（默认60条）
+        offset: 跳过前若干条记录，用于翻页
+        fields: 返回字段，逗号分隔（可选，默认返回全部字段，如：end_date,n_cashflow_act,c_pay_acq_const_fiolta）
+        shape: 输出形态，records=记录列表（默认），columns={"columns": [...], "data": [[...]]}
+
+    返回:
+        现金流量表数据列表，每个报告期一条（更正后的最新数据），按报告期倒序；金额为年初至报告期末累计，单位为元
+    """
+    return _statement_result(
+        "cashflow", ts_code, period, start_date, end_date, report_type, limit, offset, fields, shape
+    )
+
+
+@mcp.tool()
+@instrument
+@offload
+@memoize(_memo_scope, "http")
+def get_financial_indicators(
+    ts_code: str,
+    period: str = "",
+    start_date: str = "",
+    end_date: str = "",
+    limit: int = 60,
+    offset: int = 0,
+    fields: str = "",
+    shape: str = RECORDS
+) -> ToolResult:
+    """
+    获取上市公司财务指标数据（ROE、毛利率、资产负债率、周转率、增长率等）
+
+    参数:
+        ts_code: 股票代码（必填，如：000001.SZ）
+        period: 报告期（可选，格式：YYYYMMDD，如：20231231）
+        start_date: 公告开始日期（可选，格式：YYYYMMDD）
+        end_date: 公告结束日期（可选，格式：YYYYMMDD）
+        limit: 返回记录数量限制（默认60条）
+        offset: 跳过前若干条记录，用于翻页
+        fields: 返回字段，逗号分隔（可选，默认返回全部字段，如：end_date,roe,grossprofit_margin,debt_to_assets）
+        shape: 输出形态，records=记录列表（默认），columns={"columns": [...], "data": [[...]]}
+
+    返回:
+        财务指标数据列表，每个报告期一条，按报告期倒序；比率类指标单位为 %
+    """
+    return _statement_result(
+        "fina_indicator", ts_code, period, start_date, end_date, "1", limit, offset, fields, shape
+    )
+
+
+@mcp.tool()
+@instrument
+@offload
+@memoize(_memo_scope, "http")
+def get_fundamentals(
+    ts_code: str,
+    period: str = "",
+    start_date: str = "",
+    end_date: str = "",
+    report_type: str = "1",
+    limit: int = 20,
+    offset: int = 0,
+    fields: str = "",
+    shape: str = COLUMNS
+) -> ToolResult:
+    """
+    获取按报告期合并的利润表、资产负债表、现金流量表和财务指标，并附带派生指标
+
+    派生指标：roe_avg（平均归母净资产收益率）、roa_avg（平均总资产收益率）、gross_margin（毛利率）、
+    net_margin（净利润率）、debt_ratio（资产负债率）、fcf（自由现金流 = 经营现金流 - 资本开支）、
+    fcf_margin（自由现金流率）、cash_conversion（经营现金流 / 净利润）、
+    accrual_ratio（应计比率）；比率单位为 %，平均值取期初（上年末）与期末的平均
+
+    参数:
+        ts_code: 股票代码（必填，如：000001.SZ）
+        period: 报告期（可选，格式：YYYYMMDD，如：20231231）
+        start_date: 公告开始日期（可选，格式：YYYYMMDD）
+        end_date: 公告结束日期（可选，格式：YYYYMMDD）
+        report_type: 报告类型（可选，默认1合并报表；财务指标始终为合并口径）
+        limit: 返回报告期数量上限（默认20）
+        offset: 跳过前若干条记录，用于翻页
+        fields: 返回字段，逗号分隔（可选，默认为营收、利润、资产、经营现金流和全部派生指标；
+                可使用四张表中的任意字段）
+        shape: 输出形态，columns={"columns": [...], "data": [[...]]}（默认），records=记录列表
+
+    返回:
+        每个报告期一行的宽表，按报告期倒序；columns 形态附带 errors {接口名: 错误信息}，
+        单张报表获取失败时其余报表照常返回
+    """
+    tenant, error = _ensure_token()
+    if tenant is None:
+        return json_result(error)
+    if shape not in SHAPES:
+        return json_result({"error": f"shape must be one of {', '.join(SHAPES)}"})
+
+    if not ts_code:
+        return json_result({"error": "ts_code is required"})
+
+    from statement_engine import FUNDAMENTAL_DEFAULT_FIELDS
+
+    try:
+        df, errors = service.fundamentals(tenant, ts_code, report_type, period, start_date, end_date)
+        df = select_fields(paginate(df, limit, offset), fields, FUNDAMENTAL_DEFAULT_FIELDS, keep=("ts_code", "end_date"))
+        return frame_result(df, shape, errors=errors)
+    except Exception as e:
+        return json_result(_failure("Query failed", e))
+
+
+@mcp.tool()
+@instrument
+@offload
+@memoize(_memo_scope, "http")
+def get_daily_prices(
+    ts_code: str,
+    start_date: str = "",
+    end_date: str = "",
+    adj: str = "",
+    limit: int = 250,
+    offset: int = 0,
+    fields: str = "",
+    shape: str = RECORDS
+) -> ToolResult:
+    """
+    获取股票日线行情（开高低收、成交量、成交额），支持前复权/后复权
+    
+    参数:
+        ts_code: 股票代码（必填，如：000001.SZ）
+        start_date: 开始交易日期（可选，格式：YYYYMMDD）
+        end_date: 结束交易日期（可选，格式：YYYYMMDD）
+        adj: 复权方式（可选）：留空不复权，qfq=前复权，hfq=后复权
+        limit: 返回记录数上限（默认250，约一年；0表示不限）
+        offset: 跳过前若干条记录，用于翻页
+        fields: 返回字段，逗号分隔（默认：trade_date,open,high,low,close,pre_close,change,pct_chg,vol,amount；
+                另有 adj_factor）
+        shape: 输出形态，records=记录列表（默认），columns={"columns": [...], "data": [[...]]}
+    
+    返回:
+        按交易日倒序排列的日线行情；vol 单位为手，amount 单位为千元
+    """
+    tenant, error = _ensure_token()
+    if tenant is None:
+        return json_result([error])
+    if shape not in SHAPES:
+        return json_result([{"error": f"shape must be one of {', '.join(SHAPES)}"}])
+    
+    if not ts_code:
+        return json_result([{"error": "ts_code is required"}])
+    
+    from price_store import DAILY_FIELDS
+    
+    try:
+        df = service.daily_prices(tenant, ts_code, start_date, end_date, adj)
+        df = select_fields(paginate(df, limit, offset), fields, DAILY_FIELDS, keep=("ts_code", "trade_date"))
+        return frame_result(df, shape)
+    except Exception as e:
+        return json_result([_failure("Query failed", e)])
+
+
+@mcp.tool()
+@instrument
+@offload
+@memoize(_memo_scope, "http")
+def screen_stocks(
+    conditions: str = "",
+    industry: str = "",
+    area: str = "",
+    market: str = "",
+    period: str = "",
+    sort_by: str = "",
+    ascending: bool = False,
+    limit: int = 20,
+    offset: int = 0,
+    fields: str = "",
+    shape: str = RECORDS
+) -> ToolResult:
+    """
+    按财务比率在全市场选股（基于预先计算的比率表，毫秒级返回）
+    
+    参数:
+        conditions: 筛选条件，逗号分隔，如 "net_margin>20, revenue_yoy>30"；
+                    可用字段：total_revenue, n_income, basic_eps, gross_margin, operating_margin, net_margin,
+                    oper_cost_ratio, sell_exp_ratio, admin_exp_ratio, fin_exp_ratio,
+                    revenue_yoy, operate_profit_yoy, n_income_yoy, eps_yoy（比率和增速单位为%）
+        industry: 行业（可选，多个用逗号分隔，如：银行,证券）
+        area: 地区（可选，多个用逗号分隔）
+        market: 市场类型（可选，如：主板,创业板,科创板）
+        period: 报告期（可选，格式：YYYYMMDD；默认为披露较完整的最新报告期）
+        sort_by: 排序字段（可选，默认为第一个条件的字段，无条件时为 total_revenue）
+        ascending: 是否升序（默认降序）
+        limit: 返回数量（默认20，0表示不限）
+        offset: 跳过前若干条结果，用于翻页
+        fields: 返回字段，逗号分隔（默认：名称、行业、报告期、营收、净利润、主要利润率和增速）
+        shape: 输出形态，records=记录列表（默认），columns={"columns": [...], "data": [[...]]}
+    
+    返回:
+        符合条件的股票及其财务比率；缺失值为 null
+    """
+    tenant, error = _ensure_token()
+    if tenant is None:
+        return json_result([error])
+    if shape not in SHAPES:
+        return json_result([{"error": f"shape must be one of {', '.join(SHAPES)}"}])
+    
+    from screener import SCREEN_DEFAULT_FIELDS, parse_conditions
+    
+    try:
+        df = service.screen(tenant, conditions, industry, area, market, period, sort_by, ascending, limit, offset)
+        # 条件和排序字段始终返回
+        keep = ("ts_code", *(column for column, _, _ in parse_conditions(conditions)), *([sort_by] if sort_by else []))
+        df = select_fields(df, fields, SCREEN_DEFAULT_FIELDS, keep=keep)
+        return frame_result(df, shape)
+    except Exception as e:
+        return json_result([_failure("Screen failed", e)])
+
+
+@mcp.tool()
+@instrument
+@offload
 def check_token_status() -> Dict:
     """
     检查 Tushare Token 状态
@@ -223,37 +859,32 @@ def check_token_status() -> Dict:
     返回:
         Token 配置和连接状态信息
     """
-    if pro is None:
-        return {
-            "ok": False, 
-            "reason": "Tushare SDK not available"
-        }
-    
-    if not TUSHARE_TOKEN:
+    tenant, error = _ensure_token()
+    if tenant is None:
         return {
             "ok": False, 
-            "reason": "TUSHARE_TOKEN not configured"
+            "reason": error["error"]
         }
     
-    try:
-        # 测试 API 调用
-        pro.stock_basic(limit=1)
-        return {
-            "ok": True,
-            "message": "Token is valid and API is accessible"
-        }
-    except Exception as e:
+    # 测试 API 调用（使用当前请求的 token 及其配额）
+    ok, message = service.check_token(tenant)
+    if not ok:
         return {
             "ok": False, 
-            "reason": f"API call failed: {str(e)}"
+            "reason": f"API call failed: {message}"
         }
+    return {
+        "ok": True,
+        "message": "Token is valid and API is accessible"
+    }
 
 
 # ---------------------------
 # 5) 创建 ASGI 应用（用于 Uvicorn）
 # ---------------------------
-# 使用 http_app() 方法创建 ASGI 应用
-app = mcp.http_app()
+# 使用 http_app() 方法创建 ASGI 应用；
+# 多 worker 时使用无状态 streamable-HTTP，请求不依赖某个 worker 进程内的会话
+app = mcp.http_app(stateless_http=STATELESS_HTTP)
 
 
 # ---------------------------
@@ -264,14 +895,16 @@ if __name__ == "__main__":
     
     port = int(os.getenv("PORT", "8000"))
     print(f"Starting Tushare MCP server on port {port}")
-    print(f"Token configured: {bool(TUSHARE_TOKEN)}")
+    print(f"Token configured: {bool(service.default_token())}")
     print(f"MCP endpoint: http://0.0.0.0:{port}/mcp")
     print(f"Health check: http://0.0.0.0:{port}/health")
+    print(f"Workers: {WORKERS}")
     
-    # 使用 uvicorn 直接运行 ASGI 应用
+    # 使用 uvicorn 直接运行 ASGI 应用；多 worker 时 uvicorn 需要以导入路径加载应用
     uvicorn.run(
-        app,
+        "app_http:app" if WORKERS > 1 else app,
         host="0.0.0.0",
         port=port,
+        workers=WORKERS,
         log_level="info"
     )
@@ -0,0 +1,441 @@
+"""
+本地模拟的 Tushare HTTP 接口
+
+与 api.waditu.com/dataapi 使用相同的请求/响应格式，
+把 TUSHARE_HTTP_URL 指向 http://127.0.0.1:<端口> 即可让服务端调用它。
+
+支持的接口：stock_basic、income、balancesheet、cashflow、fina_indicator（及对应的 *_vip）、
+daily、adj_factor、disclosure_date、index_weight。数据默认按固定随机种子合成，
+也可以用 --record-dir 指定录制的响应（<接口名>.json，内容为 Tushare 响应中的 data 字段）。
+可配置上游延迟、限流错误比例和服务端错误（HTTP 503）比例，
+用于观察重试、熔断、限流和缓存的效果。
+
+用法:
+    python benchmarks/fake_tushare.py --port 9000 --stocks 5000 --latency-ms 80
+"""
+import argparse
+import datetime
+import functools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional
+
+AREAS = ["深圳", "上海", "北京", "浙江", "江苏", "广东", "山东", "四川", "湖北", "福建"]
+INDUSTRIES = ["银行", "证券", "保险", "白酒", "医药", "半导体", "软件服务", "汽车整车", "电气设备", "房地产"]
+MARKETS = ["主板", "创业板", "科创板"]
+NAME_CHARS = "安华中国平海天新金信达通兴华润东方宏远长城光明科技电子药业"
+
+STOCK_FIELDS = [
+    "ts_code", "symbol", "name", "area", "industry", "fullname", "enname", "cnspell", "market",
+    "exchange", "curr_type", "list_status", "list_date", "delist_date", "is_hs",
+]
+
+# daily/adj_factor 单次最多返回的行数
+DAILY_PAGE_ROWS = 6000
+
+RATE_LIMIT_MESSAGE = "抱歉，您每分钟最多访问该接口200次，权限的具体详情访问：https://tushare.pro/document/1?doc_id=108。"
+
+
+def _stock_rows(count: int, seed: int) -> List[Dict]:
+    rng = random.Random(seed)
+    rows = []
+    for i in range(count):
+        if i % 3 == 0:
+            code, exchange = f"{600000 + i:06d}", "SH"
+        else:
+            code, exchange = f"{i + 1:06d}", "SZ"
+        name = "".join(rng.choice(NAME_CHARS) for _ in range(4))
+        status = "L" if i % 50 else rng.choice("DP")
+        rows.append({
+            "ts_code": f"{code}.{exchange}",
+            "symbol": code,
+            "name": name,
+            "area": rng.choice(AREAS),
+            "industry": rng.choice(INDUSTRIES),
+            "fullname": f"{name}股份有限公司",
+            "enname": f"{name} Co., Ltd.",
+            "cnspell": "".join(rng.choice("abcdefghjklmnpqrstwxyz") for _ in range(4)),
+            "market": rng.choice(MARKETS),
+            "exchange": "SSE" if exchange == "SH" else "SZSE",
+            "curr_type": "CNY",
+            "list_status": status,
+            "list_date": f"{rng.randint(1991, 2022)}{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}",
+            "delist_date": None if status == "L" else "20230630",
+            "is_hs": rng.choice("NHS"),
+        })
+    return rows
+
+
+def _periods(years: int) -> List[str]:
+    last = time.localtime().tm_year - 1
+    return [f"{y}{md}" for y in range(last - years + 1, last + 1) for md in ("0331", "0630", "0930", "1231")]
+
+
+def _ann_date(period: str) -> str:
+    # 一季报/半年报/三季报约一个月后披露，年报次年四月披露
+    year, md = int(period[:4]), period[4:]
+    return {"0331": f"{year}0428", "0630": f"{year}0828", "0930": f"{year}1028", "1231": f"{year + 1}0425"}[md]
+
+
+def _income_row(ts_code: str, period: str, report_type: str) -> Dict:
+    rng = random.Random(f"{ts_code}{period}{report_type}")
+    quarter = {"0331": 1, "0630": 2, "0930": 3, "1231": 4}[period[4:]]
+    scale = (1 + int(ts_code[:6]) % 97) * 1e7 * (1.08 ** (int(period[:4]) - 2010)) * quarter
+    revenue = scale * rng.uniform(0.9, 1.1)
+    cost = revenue * rng.uniform(0.5, 0.8)
+    sell, admin, fin = (revenue * rng.uniform(0.01, 0.06) for _ in range(3))
+    operate = revenue - cost - sell - admin - fin
+    total = operate * rng.uniform(0.95, 1.05)
+    tax = max(total, 0) * 0.25
+    net = total - tax
+    values = {
+        "basic_eps": round(net / 1e9, 4), "diluted_eps": round(net / 1e9, 4),
+        "total_revenue": revenue, "revenue": revenue, "total_cogs": cost + sell + admin + fin,
+        "oper_cost": cost, "sell_exp": sell, "admin_exp": admin, "fin_exp": fin,
+        "operate_profit": operate, "total_profit": total, "income_tax": tax,
+        "n_income": net, "n_income_attr_p": net * 0.95,
+    }
+    ann = _ann_date(period)
+    return {
+        "ts_code": ts_code, "ann_date": ann, "f_ann_date": ann, "end_date": period,
+        "report_type": report_type, "comp_type": "1", "update_flag": "1",
+        **{k: round(v, 2) for k, v in values.items()},
+    }
+
+
+def _balance_row(ts_code: str, period: str, report_type: str) -> Dict:
+    """资产规模约为年化营收的 2 倍，逐年随营收增长"""
+    rng = random.Random(f"bs{ts_code}{period}{report_type}")
+    annual = _income_row(ts_code, f"{period[:4]}1231", report_type)["total_revenue"]
+    assets = annual * rng.uniform(1.8, 2.2)
+    cur_assets = assets * rng.uniform(0.4, 0.6)
+    liab = assets * rng.uniform(0.3, 0.7)
+    cur_liab = liab * rng.uniform(0.5, 0.8)
+    equity = assets - liab
+    values = {
+        "money_cap": cur_assets * 0.4, "accounts_receiv": cur_assets * 0.3, "inventories": cur_assets * 0.2,
+        "total_cur_assets": cur_assets, "fix_assets": (assets - cur_assets) * 0.6,
+        "goodwill": (assets - cur_assets) * 0.05, "total_nca": assets - cur_assets, "total_assets": assets,
+        "st_borr": cur_liab * 0.3, "total_cur_liab": cur_liab, "lt_borr": (liab - cur_liab) * 0.7,
+        "total_ncl": liab - cur_liab, "total_liab": liab, "minority_int": equity * 0.05,
+        "total_hldr_eqy_exc_min_int": equity * 0.95, "total_hldr_eqy_inc_min_int": equity,
+        "total_liab_hldr_eqy": assets,
+    }
+    ann = _ann_date(period)
+    return {
+        "ts_code": ts_code, "ann_date": ann, "f_ann_date": ann, "end_date": period,
+        "report_type": report_type, "comp_type": "1", "update_flag": "1",
+        **{k: round(v, 2) for k, v in values.items()},
+    }
+
+
+def _cashflow_row(ts_code: str, period: str, report_type: str) -> Dict:
+    """经营现金流在净利润附近波动，资本开支约为营收的 5%~15%"""
+    rng = random.Random(f"cf{ts_code}{period}{report_type}")
+    income = _income_row(ts_code, period, report_type)
+    cfo = income["n_income"] * rng.uniform(0.6, 1.4)
+    capex = income["total_revenue"] * rng.uniform(0.05, 0.15)
+    cfi = -capex * rng.uniform(1.0, 1.3)
+    cff = -cfo * rng.uniform(0.0, 0.5)
+    values = {
+        "net_profit": income["n_income"], "c_fr_sale_sg": income["total_revenue"] * rng.uniform(1.0, 1.15),
+        "n_cashflow_act": cfo, "c_pay_acq_const_fiolta": capex, "n_cashflow_inv_act": cfi,
+        "n_cash_flows_fnc_act": cff, "n_incr_cash_cash_equ": cfo + cfi + cff,
+        "free_cashflow": cfo - capex,
+    }
+    ann = _ann_date(period)
+    return {
+        "ts_code": ts_code, "ann_date": ann, "f_ann_date": ann, "end_date": period,
+        "report_type": report_type, "comp_type": "1", "update_flag": "1",
+        **{k: round(v, 2) for k, v in values.items()},
+    }
+
+
+def _indicator_row(ts_code: str, period: str, report_type: str = "1") -> Dict:
+    """由合并报表计算的财务指标（比率单位为 %）"""
+    income = _income_row(ts_code, period, "1")
+    balance = _balance_row(ts_code, period, "1")
+    cashflow = _cashflow_row(ts_code, period, "1")
+    revenue, equity = income["total_revenue"], balance["total_hldr_eqy_exc_min_int"]
+    shares = 1e9
+    values = {
+        "eps": income["basic_eps"], "bps": equity / shares, "ocfps": cashflow["n_cashflow_act"] / shares,
+        "roe": income["n_income_attr_p"] / equity * 100, "roa": income["n_income"] / balance["total_assets"] * 100,
+        "grossprofit_margin": (revenue - income["oper_cost"]) / revenue * 100,
+        "netprofit_margin": income["n_income"] / revenue * 100,
+        "debt_to_assets": balance["total_liab"] / balance["total_assets"] * 100,
+        "current_ratio": balance["total_cur_assets"] / balance["total_cur_liab"],
+        "assets_turn": revenue / balance["total_assets"],
+        "or_yoy": 8.0, "netprofit_yoy": 8.0,
+    }
+    return {
+        "ts_code": ts_code, "ann_date": _ann_date(period), "end_date": period, "update_flag": "1",
+        **{k: round(v, 4) for k, v in values.items()},
+    }
+
+
+@functools.lru_cache(maxsize=64)
+def _daily_rows(ts_code: str, years: int) -> List[Dict]:
+    """按交易日升序合成的日线行情，每年 6 月中旬除权一次"""
+    rng = random.Random(ts_code)
+    day = datetime.date(time.localtime().tm_year - years, 1, 1)
+    today = datetime.date.today()
+    close, factor, rows, ex_year = rng.uniform(5, 50), 1.0, [], None
+    while day <= today:
+        if day.weekday() < 5:
+            pre_close = close
+            if day.month == 6 and day.day >= 15 and ex_year != day.year:
+                # 除权日：复权因子上升，未复权价格相应下调
+                ex_year = day.year
+                factor *= 1.02
+                pre_close = round(pre_close / 1.02, 2)
+            close = round(max(1.0, pre_close * (1 + rng.gauss(0, 0.02))), 2)
+            high = round(max(close, pre_close) * (1 + rng.uniform(0, 0.02)), 2)
+            low = round(min(close, pre_close) * (1 - rng.uniform(0, 0.02)), 2)
+            vol = round(rng.uniform(1e4, 1e6), 2)
+            rows.append({
+                "ts_code": ts_code, "trade_date": day.strftime("%Y%m%d"),
+                "open": round(pre_close * (1 + rng.gauss(0, 0.005)), 2), "high": high, "low": low,
+                "close": close, "pre_close": pre_close, "change": round(close - pre_close, 2),
+                "pct_chg": round((close / pre_close - 1) * 100, 4), "vol": vol,
+                "amount": round(vol * close / 10, 3), "adj_factor": round(factor, 6),
+            })
+        day += datetime.timedelta(days=1)
+    return rows
+
+
+class FakeTushare:
+    """
+    模拟数据与错误注入
+
+    参数:
+        stocks: 合成的股票数量
+        years: 每只股票合成的利润表年数
+        latency_ms: 每次请求的平均延迟（毫秒），实际在 ±50% 内随机
+        rate_limit_ratio: 返回限流错误的请求比例（0~1）
+        error_ratio: 返回 HTTP 503 的请求比例（0~1），运行中可直接修改
+        record_dir: 录制的响应目录，存在 <接口名>.json 时直接返回其内容
+        revision_ratio: 有更正报告的报告期比例（0~1），这些报告期同时返回原始报告（update_flag=0）
+                        和一个月后披露的更正报告（update_flag=1）
+    """
+
+    def __init__(
+        self,
+        stocks: int = 5000,
+        years: int = 10,
+        latency_ms: float = 0.0,
+        rate_limit_ratio: float = 0.0,
+        record_dir: Optional[Path] = None,
+        seed: int = 42,
+        error_ratio: float = 0.0,
+        revision_ratio: float = 0.0,
+    ):
+        self.latency = latency_ms / 1000.0
+        self.rate_limit_ratio = rate_limit_ratio
+        self.error_ratio = error_ratio
+        self.revision_ratio = revision_ratio
+        self.record_dir = record_dir
+        self.stocks = _stock_rows(stocks, seed)
+        self.periods = _periods(years)
+        self.calls: Dict[str, int] = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def fails(self) -> bool:
+        """本次请求是否模拟服务端错误"""
+        with self._lock:
+            return self._rng.random() < self.error_ratio
+
+    def handle(self, api_name: str, params: Dict, fields: str) -> Dict:
+        with self._lock:
+            self.calls[api_name] = self.calls.get(api_name, 0) + 1
+            jitter = self._rng.uniform(0.5, 1.5)
+            limited = self._rng.random() < self.rate_limit_ratio
+        if self.latency:
+            time.sleep(self.latency * jitter)
+        if limited:
+            return {"code": 40203, "msg": RATE_LIMIT_MESSAGE, "data": None}
+
+        if self.record_dir is not None:
+            recorded = self.record_dir / f"{api_name}.json"
+            if recorded.exists():
+                return {"code": 0, "msg": "", "data": json.loads(recorded.read_text())}
+
+        handler = getattr(self, f"_{api_name}", None)
+        if handler is None:
+            return {"code": 40101, "msg": f"接口 {api_name} 不存在", "data": None}
+        rows, default_fields = handler(params)
+        columns = [f.strip() for f in fields.split(",") if f.strip()] or default_fields
+        return {"code": 0, "msg": "", "data": {
+            "fields": columns,
+            "items": [[row.get(c) for c in columns] for row in rows],
+        }}
+
+    def _stock_basic(self, params: Dict):
+        status = params.get("list_status") or "L"
+        rows = [r for r in self.stocks if r["list_status"] == status]
+        for key in ("ts_code", "exchange", "name"):
+            if params.get(key):
+                rows = [r for r in rows if r[key] == params[key]]
+        if params.get("limit"):
+            rows = rows[:int(params["limit"])]
+        return rows, ["ts_code", "symbol", "name", "area", "industry", "market", "list_date"]
+
+    def _revised(self, rows: List[Dict]) -> List[Dict]:
+        """按 revision_ratio 给部分报告期加上原始报告，最新更正排在前面"""
+        if not self.revision_ratio:
+            return rows
+        result = []
+        for r in rows:
+            result.append(r)
+            if random.Random(f"rev{r['ts_code']}{r['end_date']}").random() >= self.revision_ratio:
+                continue
+            original = {k: round(v * 0.97, 4) if isinstance(v, float) else v for k, v in r.items()}
+            corrected = _ann_date(r["end_date"])
+            fixed = datetime.datetime.strptime(corrected, "%Y%m%d") + datetime.timedelta(days=30)
+            r["f_ann_date"] = fixed.strftime("%Y%m%d")
+            original["update_flag"] = "0"
+            result.append(original)
+        return result
+
+    def _statement(self, row, params: Dict):
+        """按股票查询的报表，按报告期倒序"""
+        ts_code = params.get("ts_code", "")
+        report_type = str(params.get("report_type") or "1")
+        rows = self._revised([row(ts_code, p, report_type) for p in reversed(self.periods)])
+        if params.get("period"):
+            rows = [r for r in rows if r["end_date"] == params["period"]]
+        if params.get("start_date"):
+            rows = [r for r in rows if r["ann_date"] >= params["start_date"]]
+        if params.get("end_date"):
+            rows = [r for r in rows if r["ann_date"] <= params["end_date"]]
+        return rows, list(rows[0]) if rows else ["ts_code", "ann_date", "end_date"]
+
+    def _statement_vip(self, row, params: Dict):
+        """按报告期查询的全市场报表"""
+        period = params.get("period") or self.periods[-1]
+        report_type = str(params.get("report_type") or "1")
+        rows = self._revised([row(s["ts_code"], period, report_type) for s in self.stocks if s["list_status"] == "L"])
+        return rows, list(rows[0]) if rows else ["ts_code", "ann_date", "end_date"]
+
+    def _income(self, params: Dict):
+        return self._statement(_income_row, params)
+
+    def _balancesheet(self, params: Dict):
+        return self._statement(_balance_row, params)
+
+    def _cashflow(self, params: Dict):
+        return self._statement(_cashflow_row, params)
+
+    def _fina_indicator(self, params: Dict):
+        return self._statement(_indicator_row, params)
+
+    def _dated(self, params: Dict) -> List[Dict]:
+        """按 trade_date 过滤并倒序，最多 DAILY_PAGE_ROWS 行（与真实接口一致）"""
+        rows = _daily_rows(params.get("ts_code", ""), len(self.periods) // 4)
+        start, end = params.get("start_date") or "", params.get("end_date") or "99999999"
+        rows = [r for r in reversed(rows) if start <= r["trade_date"] <= end]
+        return rows[:DAILY_PAGE_ROWS]
+
+    def _daily(self, params: Dict):
+        fields = ["ts_code", "trade_date", "open", "high", "low", "close", "pre_close", "change", "pct_chg", "vol", "amount"]
+        return self._dated(params), fields
+
+    def _adj_factor(self, params: Dict):
+        return self._dated(params), ["ts_code", "trade_date", "adj_factor"]
+
+    def _disclosure_date(self, params: Dict):
+        """每只上市股票按 _ann_date 披露，实际披露日与计划一致"""
+        periods = [params["end_date"]] if params.get("end_date") else self.periods
+        rows = [
+            {"ts_code": s["ts_code"], "ann_date": _ann_date(p), "end_date": p,
+             "pre_date": _ann_date(p), "actual_date": _ann_date(p), "modify_date": None}
+            for p in periods for s in self.stocks if s["list_status"] == "L"
+        ]
+        for key in ("ts_code", "actual_date", "pre_date"):
+            if params.get(key):
+                rows = [r for r in rows if r[key] == params[key]]
+        return rows, ["ts_code", "ann_date", "end_date", "pre_date", "actual_date", "modify_date"]
+
+    def _index_weight(self, params: Dict):
+        """前 300 只上市股票作为任一指数的成分股，每月末一期"""
+        members = [s["ts_code"] for s in self.stocks if s["list_status"] == "L"][:300]
+        end = params.get("end_date") or time.strftime("%Y%m%d")
+        day = datetime.datetime.strptime(end, "%Y%m%d").date().replace(day=1) - datetime.timedelta(days=1)
+        rows = [{"index_code": params.get("index_code", ""), "con_code": code,
+                 "trade_date": day.strftime("%Y%m%d"), "weight": round(100 / len(members), 4)} for code in members]
+        return rows, ["index_code", "con_code", "trade_date", "weight"]
+
+    def _income_vip(self, params: Dict):
+        return self._statement_vip(_income_row, params)
+
+    def _balancesheet_vip(self, params: Dict):
+        return self._statement_vip(_balance_row, params)
+
+    def _cashflow_vip(self, params: Dict):
+        return self._statement_vip(_cashflow_row, params)
+
+    def _fina_indicator_vip(self, params: Dict):
+        return self._statement_vip(_indicator_row, params)
+
+def serve(backend: FakeTushare, port: int = 0, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """在后台线程启动模拟服务，返回 server（server.server_port 为实际端口）"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            api_name = body.get("api_name") or self.path.rstrip("/").rsplit("/", 1)[-1]
+            if backend.fails():
+                self.send_response(503)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            result = backend.handle(api_name, body.get("params") or {}, body.get("fields") or "")
+            payload = json.dumps(result, ensure_ascii=False).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-tushare", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟的 Tushare HTTP 接口")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--stocks", type=int, default=5000)
+    parser.add_argument("--years", type=int, default=10)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0)
+    parser.add_argument("--error-ratio", type=float, default=0.0)
+    parser.add_argument("--record-dir", type=Path)
+    parser.add_argument("--revision-ratio", type=float, default=0.0)
+    args = parser.parse_args()
+
+    backend = FakeTushare(
+        args.stocks, args.years, args.latency_ms, args.rate_limit_ratio, args.record_dir,
+        error_ratio=args.error_ratio, revision_ratio=args.revision_ratio,
+    )
+    server = serve(backend, args.port)
+    print(f"fake tushare listening on http://127.0.0.1:{server.server_port}  (TUSHARE_HTTP_URL)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+"""
+压测：通过 stdio（server.py）和 streamable HTTP（app_http.py）两个入口调用工具
+
+启动本地模拟 Tushare 服务（fake_tushare.py），把服务端子进程的 TUSHARE_HTTP_URL 指向它，
+在不同并发下调用 search_stocks、get_stock_basic_info、get_income_statement、get_daily_prices，
+并在进程内测量 format_income_statement_analysis。
+冷启动单独测量：从启动进程到 tools/list 返回的时间（HTTP 另记 /health 可用和预热完成的时间），
+超过 --cold-start-budget-ms 时视为失败。
+输出每个场景的 p50/p99 延迟、吞吐量、错误数以及服务端进程的峰值 RSS，
+可保存为基线并与之对比，超出容差时以非零状态退出。
+
+用法:
+    python benchmarks/run.py                               # 全部场景，与 baseline.json 对比
+    python benchmarks/run.py --transport http -c 1,16      # 只测 HTTP，并发 1 和 16
+    python benchmarks/run.py --latency-ms 80 --save-baseline
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_tushare import FakeTushare, _income_row, serve  # noqa: E402
+
+BASELINE_FILE = Path(__file__).resolve().parent / "baseline.json"
+
+# 参与比较的指标及方向（higher=越大越好）
+COMPARED = {"p50_ms": "lower", "p99_ms": "lower", "rps": "higher", "peak_rss_mb": "lower"}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _peak_rss_mb(pid: int) -> Optional[float]:
+    """进程的峰值常驻内存（VmHWM，仅 Linux）"""
+    try:
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _children(pid: int) -> List[int]:
+    try:
+        tasks = Path(f"/proc/{pid}/task").iterdir()
+        return [int(c) for t in tasks for c in (t / "children").read_text().split()]
+    except OSError:
+        return []
+
+
+def _server_env(fake_url: str, home: Path) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update({
+        "TUSHARE_TOKEN": "benchmark-token",
+        "TUSHARE_HTTP_URL": fake_url,
+        "TUSHARE_DATA_DIR": str(home / "data"),
+        # stdio 服务的 .env 和 tushare SDK 的 tk.csv 都在 HOME 下
+        "HOME": str(home),
+        "PYTHONPATH": str(ROOT),
+        # 压测时不让限流成为瓶颈
+        "TUSHARE_RATE_LIMITS": "default=100000",
+        "TUSHARE_RATE_BURST": "1000",
+    })
+    return env
+
+
+class Scenario:
+    """一个工具调用场景：工具名和按序号生成参数的函数"""
+
+    def __init__(self, name: str, make_args: Callable[[int], Dict]):
+        self.name = name
+        self.make_args = make_args
+
+
+def scenarios(backend: FakeTushare, transport: str) -> List[Scenario]:
+    listed = [s for s in backend.stocks if s["list_status"] == "L"]
+    rng = random.Random(7)
+    keywords = [rng.choice(listed)["name"][:2] for _ in range(50)] + [s["symbol"][:4] for s in listed[:50]]
+    # 利润表只在一小组股票上轮换，兼顾缓存命中和未命中
+    income_codes = [s["ts_code"] for s in listed[:40]]
+    income_args = {"limit": 12} if transport == "stdio" else {"limit": 12, "fields": "end_date,revenue,n_income"}
+    # 行情按多年窗口前复权读取
+    price_args = {"start_date": f"{time.localtime().tm_year - 5}0101", "adj": "qfq"}
+    return [
+        Scenario("search_stocks", lambda i: {"keyword": keywords[i % len(keywords)], "limit": 20}),
+        Scenario("get_stock_basic_info", lambda i: {"ts_code": listed[(i * 37) % len(listed)]["ts_code"]}),
+        Scenario("get_income_statement", lambda i: {"ts_code": income_codes[i % len(income_codes)], **income_args}),
+        Scenario("get_daily_prices", lambda i: {"ts_code": income_codes[i % len(income_codes)], **price_args}),
+    ]
+
+
+async def drive(client, scenario: Scenario, concurrency: int, total: int) -> Dict:
+    """用 concurrency 个并发工作协程发出 total 次调用"""
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            start = time.perf_counter()
+            try:
+                result = await client.call_tool(scenario.name, scenario.make_args(i), raise_on_error=False)
+                if result.is_error:
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    ms = np.array(latencies) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "rps": round(total / elapsed, 1),
+        "errors": errors,
+    }
+
+
+async def run_transport(transport: str, backend: FakeTushare, fake_url: str, args) -> Dict[str, Dict]:
+    from fastmcp import Client
+    from fastmcp.client.transports import StdioTransport, StreamableHttpTransport
+
+    home = Path(tempfile.mkdtemp(prefix=f"tushare-bench-{transport}-"))
+    env = _server_env(fake_url, home)
+    process = None
+    if transport == "stdio":
+        client = Client(StdioTransport(
+            sys.executable, [str(ROOT / "server.py")], env=env, cwd=str(ROOT), log_file=home / "server.log",
+        ))
+    else:
+        port = _free_port()
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app_http:app", "--port", str(port), "--log-level", "warning"],
+            cwd=str(ROOT), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        client = Client(StreamableHttpTransport(f"http://127.0.0.1:{port}/mcp"))
+        await _wait_for_http(port)
+
+    results = {}
+    try:
+        async with client:
+            for scenario in scenarios(backend, transport):
+                # 预热：加载股票列表等一次性开销不计入
+                await client.call_tool(scenario.name, scenario.make_args(0), raise_on_error=False)
+                for concurrency in args.concurrency:
+                    key = f"{transport}/{scenario.name}/c{concurrency}"
+                    results[key] = await drive(client, scenario, concurrency, args.requests)
+                    print(_format_row(key, results[key]))
+            pid = process.pid if process else next(iter(_children(os.getpid())), None)
+            rss = _peak_rss_mb(pid) if pid else None
+            if rss is not None:
+                results[f"{transport}/process"] = {"peak_rss_mb": round(rss, 1)}
+                print(f"{transport}/process  peak_rss={rss:.1f}MB")
+    finally:
+        if process:
+            process.terminate()
+            process.wait(timeout=10)
+    return results
+
+
+async def _wait_for_http(port: int, timeout: float = 60.0):
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as http:
+        while time.monotonic() < deadline:
+            try:
+                if (await http.get(f"http://127.0.0.1:{port}/health")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"HTTP server did not start on port {port} within {timeout:g}s")
+
+
+async def _cold_start_once(transport: str, fake_url: str) -> Dict[str, float]:
+    """启动一个新的服务进程，返回各阶段距启动的毫秒数"""
+    import httpx
+    from fastmcp import Client
+    from fastmcp.client.transports import StdioTransport, StreamableHttpTransport
+
+    home = Path(tempfile.mkdtemp(prefix=f"tushare-cold-{transport}-"))
+    env = _server_env(fake_url, home)
+    start = time.perf_counter()
+    if transport == "stdio":
+        client = Client(StdioTransport(
+            sys.executable, [str(ROOT / "server.py")], env=env, cwd=str(ROOT), log_file=home / "server.log",
+        ))
+        async with client:
+            await client.list_tools()
+            return {"tools_ms": (time.perf_counter() - start) * 1000}
+
+    port = _free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app_http:app", "--port", str(port), "--log-level", "warning"],
+        cwd=str(ROOT), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        await _wait_for_http(port)
+        marks = {"health_ms": (time.perf_counter() - start) * 1000}
+        async with Client(StreamableHttpTransport(f"http://127.0.0.1:{port}/mcp")) as client:
+            await client.list_tools()
+        marks["tools_ms"] = (time.perf_counter() - start) * 1000
+        async with httpx.AsyncClient() as http:
+            deadline = time.monotonic() + 60
+            while time.monotonic() < deadline:
+                if (await http.get(f"http://127.0.0.1:{port}/health")).json().get("ready", True):
+                    marks["ready_ms"] = (time.perf_counter() - start) * 1000
+                    break
+                await asyncio.sleep(0.02)
+        return marks
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def bench_cold_start(transport: str, fake_url: str, runs: int) -> Dict[str, Dict]:
+    """多次冷启动，p50/p99 取到 tools/list 返回为止的时间"""
+    samples = [asyncio.run(_cold_start_once(transport, fake_url)) for _ in range(runs)]
+    tools = np.array([s["tools_ms"] for s in samples])
+    result = {
+        "p50_ms": round(float(np.percentile(tools, 50)), 1),
+        "p99_ms": round(float(np.percentile(tools, 99)), 1),
+    }
+    for mark in ("health_ms", "ready_ms"):
+        if mark in samples[0]:
+            result[mark] = round(float(np.median([s[mark] for s in samples])), 1)
+    extra = "  ".join(f"{k}={v:.0f}" for k, v in result.items() if k not in ("p50_ms", "p99_ms"))
+    print(f"{transport + '/cold_start':<56} p50={result['p50_ms']:>9.1f}ms  p99={result['p99_ms']:>9.1f}ms  {extra}")
+    return {f"{transport}/cold_start": result}
+
+
+def bench_format(backend: FakeTushare, iterations: int) -> Dict[str, Dict]:
+    """进程内测量 format_income_statement_analysis（不经过传输层）"""
+    import pandas as pd
+
+    from server import INCOME_METRICS, format_income_statement_analysis
+
+    code = backend.stocks[1]["ts_code"]
+    rows = [_income_row(code, p, "1") for p in reversed(backend.periods)]
+    df = pd.DataFrame(rows)[["ts_code", "end_date", *INCOME_METRICS]]
+
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        format_income_statement_analysis(df)
+        latencies.append(time.perf_counter() - start)
+    ms = np.array(latencies) * 1000
+    result = {
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "rps": round(iterations / (sum(latencies) or 1e-9), 1),
+        "errors": 0,
+    }
+    key = f"inprocess/format_income_statement_analysis/{len(df)}rows"
+    print(_format_row(key, result))
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {key: result, "inprocess/process": {"peak_rss_mb": round(rss, 1)}}
+
+
+def _format_row(key: str, result: Dict) -> str:
+    return (f"{key:<56} p50={result['p50_ms']:>9.2f}ms  p99={result['p99_ms']:>9.2f}ms  "
+            f"rps={result['rps']:>9.1f}  errors={result['errors']}")
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float) -> List[str]:
+    """返回超出容差的指标说明"""
+    regressions = []
+    for key, metrics in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        for metric, direction in COMPARED.items():
+            if metric not in metrics or not base.get(metric):
+                continue
+            ratio = metrics[metric] / base[metric]
+            worse = ratio > 1 + tolerance if direction == "lower" else ratio < 1 - tolerance
+            if worse:
+                regressions.append(f"{key} {metric}: {base[metric]} -> {metrics[metric]} ({ratio - 1:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tushare MCP 压测")
+    parser.add_argument("--transport", default="stdio,http", help="逗号分隔：stdio,http")
+    parser.add_argument("-c", "--concurrency", default="1,8,32", help="逗号分隔的并发数")
+    parser.add_argument("-n", "--requests", type=int, default=200, help="每个场景每个并发的调用次数")
+    parser.add_argument("--format-iterations", type=int, default=200)
+    parser.add_argument("--cold-starts", type=int, default=3, help="每个入口的冷启动次数，0 表示不测")
+    parser.add_argument("--cold-start-budget-ms", type=float, default=4000.0,
+                        help="冷启动（到 tools/list 返回）p50 的上限")
+    parser.add_argument("--stocks", type=int, default=5000)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="模拟上游平均延迟")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="模拟上游限流错误比例")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果写入 --baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="相对基线允许的退化比例")
+    parser.add_argument("--output", type=Path, help="把本次结果写入该 JSON 文件")
+    args = parser.parse_args()
+    args.concurrency = [int(c) for c in args.concurrency.split(",") if c.strip()]
+
+    backend = FakeTushare(stocks=args.stocks, latency_ms=args.latency_ms, rate_limit_ratio=args.rate_limit_ratio)
+    fake = serve(backend)
+    fake_url = f"http://127.0.0.1:{fake.server_port}"
+
+    results: Dict[str, Dict] = {}
+    transports = [t.strip() for t in args.transport.split(",") if t.strip()]
+    for transport in transports:
+        if args.cold_starts:
+            results.update(bench_cold_start(transport, fake_url, args.cold_starts))
+        results.update(asyncio.run(run_transport(transport, backend, fake_url, args)))
+    if args.format_iterations:
+        results.update(bench_format(backend, args.format_iterations))
+    print(f"upstream calls: {backend.calls}")
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "latency_ms": args.latency_ms,
+            "requests": args.requests,
+            "stocks": args.stocks,
+        },
+        "results": results,
+    }
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    over_budget = [
+        f"{key} p50 {r['p50_ms']:.0f}ms exceeds budget {args.cold_start_budget_ms:.0f}ms"
+        for key, r in results.items()
+        if key.endswith("/cold_start") and r["p50_ms"] > args.cold_start_budget_ms
+    ]
+    for line in over_budget:
+        print(f"\n{line}")
+
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps(report, indent=2, ensure_ascii=False) + "\n")
+        print(f"baseline saved to {args.baseline}")
+    elif args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text())
+        regressions = compare(results, baseline.get("results", {}), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%} of {args.baseline.name}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nno regressions beyond {args.tolerance:.0%} of {args.baseline.name}")
+    if over_budget:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Tushare token 管理
+
+进程启动时读取一次 .env 文件，之后工具调用只读内存中的 token，
+不再每次调用都 mkdir/touch/解析 .env。
+为了支持在外部修改 .env 后无需重启，最多每 TOKEN_RECHECK_INTERVAL 秒
+stat 一次文件，修改时间变化时重新解析并通知订阅者（重建客户端、清空缓存）。
+
+token 优先级：运行期间写入或修改 .env 的 token > 环境变量 TUSHARE_TOKEN > 启动时 .env 中的 token。
+"""
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from dotenv import dotenv_values, set_key
+
+TOKEN_KEY = "TUSHARE_TOKEN"
+
+# 检查 .env 文件是否被修改的最小间隔（秒）
+TOKEN_RECHECK_INTERVAL = float(os.getenv("TUSHARE_TOKEN_RECHECK_INTERVAL", "5"))
+
+
+class TokenSource:
+    """
+    从环境变量和 .env 文件解析 token，文件修改后自动生效
+
+    参数:
+        env_file: .env 文件路径，不存在时自动创建
+        recheck_interval: 检查文件修改时间的最小间隔（秒）
+    """
+
+    def __init__(self, env_file: Path, recheck_interval: float = TOKEN_RECHECK_INTERVAL):
+        self.env_file = env_file
+        self._recheck_interval = recheck_interval
+        self._env_token = (os.getenv(TOKEN_KEY) or "").strip() or None
+        self._file_token: Optional[str] = None
+        self._override: Optional[str] = None
+        self._mtime: Optional[float] = None
+        self._checked_at = 0.0
+        self._listeners: List[Callable[[Optional[str]], None]] = []
+        self._lock = threading.Lock()
+
+        env_file.parent.mkdir(parents=True, exist_ok=True)
+        if not env_file.exists():
+            env_file.touch()
+        self._file_token, self._mtime = self._read()
+        self._checked_at = time.monotonic()
+
+    def get(self) -> Optional[str]:
+        """当前生效的 token，未配置时返回 None"""
+        if time.monotonic() - self._checked_at >= self._recheck_interval:
+            self._recheck()
+        return self._override or self._env_token or self._file_token
+
+    def set(self, token: str):
+        """写入 .env 并立即生效"""
+        token = token.strip()
+        with self._lock:
+            set_key(str(self.env_file), TOKEN_KEY, token)
+            self._file_token, self._mtime = self._read()
+            self._checked_at = time.monotonic()
+            self._override = token
+        self._notify(token)
+
+    def subscribe(self, listener: Callable[[Optional[str]], None]):
+        """注册 token 变化时的回调，参数为新的 token"""
+        self._listeners.append(listener)
+
+    def _read(self):
+        try:
+            mtime = self.env_file.stat().st_mtime
+            token = (dotenv_values(self.env_file).get(TOKEN_KEY) or "").strip() or None
+        except OSError:
+            return None, None
+        return token, mtime
+
+    def _recheck(self):
+        with self._lock:
+            self._checked_at = time.monotonic()
+            try:
+                mtime = self.env_file.stat().st_mtime
+            except OSError:
+                mtime = None
+            if mtime == self._mtime:
+                return
+            previous = self._override or self._env_token or self._file_token
+            self._file_token, self._mtime = self._read()
+            # 运行期间修改过文件，以文件中的 token 为准
+            self._override = self._file_token
+            current = self._override or self._env_token
+        if current != previous:
+            print("[init] TUSHARE_TOKEN changed in .env, reloading client", file=sys.stderr)
+            self._notify(current)
+
+    def _notify(self, token: Optional[str]):
+        for listener in self._listeners:
+            try:
+                listener(token)
+            except Exception as e:
+                print(f"[init] token change listener failed: {e}", file=sys.stderr)
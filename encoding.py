@@ -0,0 +1,100 @@
+"""
+工具结果编码
+
+DataFrame 用 orjson 一次编码为 JSON 文本，作为 MCP 文本内容直接返回，
+不再经过 to_json → json.loads → 框架再次序列化的重复编码。
+缺失值（NaN/None）编码为 null，数值列保持数值类型。
+
+支持两种输出形态：
+    records: [{"列名": 值, ...}, ...]（默认）
+    columns: {"columns": [...], "data": [[...], ...]}，列名只出现一次，体积更小
+
+数据来自过期缓存时（上游故障或正在后台刷新），结果末尾追加一段
+{"stale": true, "age_seconds": ..., "message": ...}，不改变数据本身的结构。
+"""
+from typing import TYPE_CHECKING, Any, Optional
+
+import orjson
+from fastmcp.tools.tool import ToolResult
+from mcp.types import TextContent
+
+from metrics import phase
+from resilience import stale_age, stale_message
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+RECORDS = "records"
+COLUMNS = "columns"
+SHAPES = (RECORDS, COLUMNS)
+
+_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def _default(obj: Any):
+    """orjson 不认识的类型：pandas 缺失值转 null，时间转字符串"""
+    import pandas as pd
+    if obj is pd.NA or obj is pd.NaT:
+        return None
+    if isinstance(obj, pd.Timestamp):
+        return obj.isoformat()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(obj: Any) -> str:
+    return orjson.dumps(obj, default=_default, option=_OPTIONS).decode()
+
+
+def frame_payload(df: "pd.DataFrame", shape: str = RECORDS) -> Any:
+    """把 DataFrame 转成可直接编码的 Python 结构（不经过中间 JSON 字符串）"""
+    columns = [str(c) for c in df.columns]
+    rows = df.to_numpy(dtype=object).tolist()
+    if shape == COLUMNS:
+        return {"columns": columns, "data": rows}
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def stale_notice(age: float) -> dict:
+    """过期缓存的提示"""
+    return {
+        "stale": True,
+        "age_seconds": round(age),
+        "message": stale_message(age),
+    }
+
+
+def json_result(obj: Any, age: Optional[float] = None) -> ToolResult:
+    """
+    任意可编码对象 → 工具结果
+
+    参数:
+        age: 数据来自过期缓存时的数据年龄（秒），附加一段提示
+    """
+    with phase("serialization"):
+        content = [TextContent(type="text", text=dumps(obj))]
+        if age is not None:
+            content.append(TextContent(type="text", text=dumps(stale_notice(age))))
+    return ToolResult(content=content)
+
+
+def frame_result(df: "pd.DataFrame", shape: str = RECORDS, **extra: Any) -> ToolResult:
+    """
+    DataFrame → 工具结果
+
+    参数:
+        shape: records 或 columns
+        extra: 附加的顶层字段（仅 columns 形态，如 errors）
+    """
+    payload = frame_payload(df, shape)
+    if extra and isinstance(payload, dict):
+        payload.update(extra)
+    return json_result(payload, stale_age(df))
+
+
+def page_payload(df: "pd.DataFrame", shape: str, next_cursor: Optional[str], total: Optional[int] = None) -> dict:
+    """一页结果：{"data": ..., "next_cursor": ..., "total": ...}，total 未知时为 null"""
+    return {"data": frame_payload(df, shape), "next_cursor": next_cursor, "total": total}
+
+
+def page_result(df: "pd.DataFrame", shape: str, next_cursor: Optional[str], total: Optional[int] = None) -> ToolResult:
+    return json_result(page_payload(df, shape, next_cursor, total), stale_age(df))
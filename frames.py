@@ -0,0 +1,67 @@
+"""
+DataFrame 结果裁剪：字段投影与分页
+
+工具都接受逗号分隔的 fields 以及 limit/offset，
+在序列化之前先裁掉不需要的列和行，减少返回给客户端的数据量。
+大结果集还可以用不透明游标（cursor）逐页获取。
+"""
+import base64
+import hashlib
+import json
+from typing import TYPE_CHECKING, Dict, Iterable, List
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+def parse_fields(fields: str) -> List[str]:
+    """把逗号分隔的字段字符串拆成列表，去掉空白和重复项"""
+    return list(dict.fromkeys(f.strip() for f in (fields or "").split(",") if f.strip()))
+
+
+def select_fields(df: "pd.DataFrame", fields: str, default: str = "", keep: Iterable[str] = ()) -> "pd.DataFrame":
+    """
+    按字段列表选列
+
+    参数:
+        fields: 逗号分隔的字段，为空时使用 default，两者都为空时返回全部列
+        keep: 始终保留并放在最前面的字段（如 ts_code）
+    """
+    wanted = parse_fields(fields or default)
+    if not wanted:
+        return df
+    columns = list(dict.fromkeys([*keep, *wanted]))
+    return df[[c for c in columns if c in df.columns]]
+
+
+def paginate(df: "pd.DataFrame", limit: int = 0, offset: int = 0) -> "pd.DataFrame":
+    """跳过前 offset 行后取至多 limit 行（limit <= 0 表示不限）"""
+    offset = max(0, offset or 0)
+    if limit and limit > 0:
+        return df.iloc[offset:offset + limit]
+    return df.iloc[offset:] if offset else df
+
+
+def _fingerprint(query: Dict) -> str:
+    text = json.dumps(query, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(text.encode()).hexdigest()[:12]
+
+
+def encode_cursor(offset: int, query: Dict) -> str:
+    """生成指向 offset 的游标，绑定查询条件，换了条件的游标无法复用"""
+    payload = json.dumps({"o": offset, "q": _fingerprint(query)}).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, query: Dict) -> int:
+    """解析游标得到 offset，游标无效或与查询条件不符时抛出 ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        offset = int(payload["o"])
+        fingerprint = payload["q"]
+    except Exception:
+        raise ValueError("invalid cursor") from None
+    if fingerprint != _fingerprint(query) or offset < 0:
+        raise ValueError("cursor does not match this query")
+    return offset
@@ -0,0 +1,421 @@
+"""
+工具输出缓存（响应级）
+
+同一会话或不同会话反复请求同一只股票的同一份报表时，工具每次都要重新读取存储、
+格式化分析文本并序列化。memoize 装饰器按 (入口, 工具, 租户, 规范化后的参数)
+缓存工具的最终输出：
+- 参数规范化：None 与空字符串等价，字符串去掉首尾空白，股票代码统一大写，
+  未传的参数取默认值；
+- 每条缓存记录它读取过的数据源（报表、行情、比率表）当时的版本号，
+  数据源刷新出新数据时版本号加一（见 changed），之后的查询视为未命中；
+- 结果来自过期数据或调用过程中上游失败时不缓存（见 no_store），
+  未配置 token 时不缓存；
+- 默认保存在进程内的 LRU 中；多 worker 部署（TUSHARE_WORKERS > 1）时保存在
+  数据目录下的 SQLite 文件中，本机各 worker 共享缓存和数据版本号；
+  设置 TUSHARE_MEMO_REDIS_URL 后保存在 Redis（或兼容的服务）中，可跨机器共享；
+  共享后端中的记录以 JSON 保存（见 encode_entry），不使用 pickle，
+  能写入 Redis 或缓存文件的人无法借此在 worker 中执行代码。
+
+命中率通过 tushare_cache_requests_total{cache="response"} 等指标和 /health 查看。
+"""
+import functools
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from metrics import cache_lookup
+from workers import WORKERS
+
+# 进程内最多缓存的工具输出条数，0 表示不启用
+MEMO_SIZE = int(os.getenv("TUSHARE_MEMO_SIZE", "512"))
+
+# 缓存有效期（秒），数据源没有刷新时也最多保留这么久
+MEMO_TTL = float(os.getenv("TUSHARE_MEMO_TTL", "600"))
+
+# 共享缓存的 Redis 地址（如 redis://127.0.0.1:6379/0），为空时只使用进程内缓存
+MEMO_REDIS_URL = os.getenv("TUSHARE_MEMO_REDIS_URL", "")
+
+# Redis 中的键前缀
+REDIS_PREFIX = "tushare:memo:"
+
+# 多 worker 共享缓存的 SQLite 文件名（位于 TUSHARE_DATA_DIR 下）
+SQLITE_FILE = "memo.sqlite"
+
+# SQLite 缓存每写入这么多条检查一次条数上限
+SQLITE_PRUNE_EVERY = 64
+
+# 规范化为大写的股票代码参数
+CODE_PARAMS = ("ts_code", "ts_codes")
+
+# 当前工具调用的缓存状态：{"store": 是否缓存结果, "deps": {数据源: 读取时的版本号}}；
+# 同一个 dict 随 copy_context 带入工作线程，线程中的修改对装饰器可见
+_call: ContextVar[Optional[Dict]] = ContextVar("tushare_memo_call", default=None)
+
+
+def encode_entry(value: Any, deps: Dict[str, int]) -> Optional[bytes]:
+    """
+    共享后端中一条缓存记录的 JSON 编码
+
+    工具输出为文本（stdio）、只含文本内容的 ToolResult（HTTP）或可编码为 JSON 的对象；
+    其他输出返回 None，不缓存。
+    """
+    if isinstance(value, str):
+        entry = {"text": value}
+    elif type(value).__name__ == "ToolResult":
+        texts = [getattr(item, "text", None) for item in value.content]
+        if any(text is None for text in texts) or value.structured_content is not None:
+            return None
+        entry = {"contents": texts}
+    else:
+        entry = {"json": value}
+    entry["deps"] = deps
+    try:
+        return json.dumps(entry, ensure_ascii=False).encode()
+    except (TypeError, ValueError):
+        return None
+
+
+def decode_entry(raw: bytes) -> Optional[Tuple[Any, Dict[str, int]]]:
+    """encode_entry 的逆运算，记录损坏时返回 None（按未命中处理）"""
+    try:
+        entry = json.loads(raw)
+        deps = {str(k): int(v) for k, v in entry["deps"].items()}
+        if "text" in entry:
+            return str(entry["text"]), deps
+        if "contents" in entry:
+            from fastmcp.tools.tool import ToolResult
+            from mcp.types import TextContent
+            return ToolResult(content=[TextContent(type="text", text=str(t)) for t in entry["contents"]]), deps
+        return entry["json"], deps
+    except Exception:
+        return None
+
+
+class LocalBackend:
+    """进程内 LRU，数据源版本号保存在字典中"""
+
+    name = "local"
+
+    def __init__(self, capacity: int = MEMO_SIZE, ttl: float = MEMO_TTL):
+        self._capacity = max(1, capacity)
+        self._ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Any, Dict[str, int]]]" = OrderedDict()
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def size(self) -> Optional[int]:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Tuple[Any, Dict[str, int]]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() >= entry[0]:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1], entry[2]
+
+    def set(self, key: str, value: Any, deps: Dict[str, int]):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self._ttl, value, deps)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._capacity:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def versions(self, sources: List[str]) -> List[int]:
+        return [self._versions.get(source, 0) for source in sources]
+
+    def bump(self, sources: Iterable[str]):
+        with self._lock:
+            for source in sources:
+                self._versions[source] = self._versions.get(source, 0) + 1
+
+
+class RedisBackend:
+    """
+    Redis 中的共享缓存
+
+    输出以 JSON 保存（见 encode_entry）并设置过期时间，条数上限由 Redis 的 maxmemory 淘汰策略控制；
+    数据源版本号保存在一个 hash 中。Redis 不可用时按未命中处理，不影响工具调用。
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str, ttl: float = MEMO_TTL):
+        import redis
+        self._client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self._ttl = max(1, int(ttl))
+        self._versions_key = REDIS_PREFIX + "versions"
+        self._failed_at = 0.0
+
+    def size(self) -> Optional[int]:
+        return None
+
+    def get(self, key: str) -> Optional[Tuple[Any, Dict[str, int]]]:
+        raw = self._call(self._client.get, REDIS_PREFIX + key)
+        return decode_entry(raw) if raw else None
+
+    def set(self, key: str, value: Any, deps: Dict[str, int]):
+        blob = encode_entry(value, deps)
+        if blob is not None:
+            self._call(self._client.set, REDIS_PREFIX + key, blob, ex=self._ttl)
+
+    def delete(self, key: str):
+        self._call(self._client.delete, REDIS_PREFIX + key)
+
+    def versions(self, sources: List[str]) -> List[int]:
+        if not sources:
+            return []
+        values = self._call(self._client.hmget, self._versions_key, sources) or [None] * len(sources)
+        return [int(v) if v is not None else 0 for v in values]
+
+    def bump(self, sources: Iterable[str]):
+        pipe = self._client.pipeline(transaction=False)
+        for source in sources:
+            pipe.hincrby(self._versions_key, source, 1)
+        self._call(pipe.execute)
+
+    def _call(self, method, *args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        except Exception as e:
+            # 每分钟最多提示一次
+            now = time.monotonic()
+            if now - self._failed_at > 60:
+                self._failed_at = now
+                print(f"[memo] redis unavailable, skipping response cache: {e}", file=sys.stderr)
+            return None
+
+
+class SqliteBackend:
+    """
+    本机各 worker 共享的 SQLite 缓存（WAL 模式，读写互不阻塞）
+
+    输出以 JSON 保存（见 encode_entry），条数超过上限时淘汰最早过期的记录；数据源版本号保存在另一张表中。
+    数据库不可用时按未命中处理，不影响工具调用。
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str, capacity: int = MEMO_SIZE, ttl: float = MEMO_TTL):
+        self._capacity = max(1, capacity)
+        self._ttl = ttl
+        self._db = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, expires REAL, value BLOB)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS versions (source TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._failed_at = 0.0
+
+    def size(self) -> Optional[int]:
+        row = self._call("SELECT COUNT(*) FROM entries")
+        return row[0][0] if row else None
+
+    def get(self, key: str) -> Optional[Tuple[Any, Dict[str, int]]]:
+        rows = self._call("SELECT value FROM entries WHERE key = ? AND expires > ?", key, time.time())
+        return decode_entry(rows[0][0]) if rows else None
+
+    def set(self, key: str, value: Any, deps: Dict[str, int]):
+        blob = encode_entry(value, deps)
+        if blob is None:
+            return
+        self._call("INSERT OR REPLACE INTO entries VALUES (?, ?, ?)", key, time.time() + self._ttl, blob)
+        self._writes += 1
+        if self._writes % SQLITE_PRUNE_EVERY == 0:
+            self._prune()
+
+    def delete(self, key: str):
+        self._call("DELETE FROM entries WHERE key = ?", key)
+
+    def versions(self, sources: List[str]) -> List[int]:
+        if not sources:
+            return []
+        placeholders = ",".join("?" * len(sources))
+        rows = self._call(f"SELECT source, version FROM versions WHERE source IN ({placeholders})", *sources) or []
+        found = dict(rows)
+        return [found.get(source, 0) for source in sources]
+
+    def bump(self, sources: Iterable[str]):
+        for source in sources:
+            self._call(
+                "INSERT INTO versions VALUES (?, 1) ON CONFLICT(source) DO UPDATE SET version = version + 1",
+                source,
+            )
+
+    def _prune(self):
+        self._call("DELETE FROM entries WHERE expires <= ?", time.time())
+        self._call(
+            "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY expires "
+            "LIMIT max(0, (SELECT COUNT(*) FROM entries) - ?))",
+            self._capacity,
+        )
+
+    def _call(self, sql: str, *params) -> Optional[List[Tuple]]:
+        try:
+            with self._lock:
+                return self._db.execute(sql, params).fetchall()
+        except sqlite3.Error as e:
+            # 每分钟最多提示一次
+            now = time.monotonic()
+            if now - self._failed_at > 60:
+                self._failed_at = now
+                print(f"[memo] sqlite cache unavailable, skipping response cache: {e}", file=sys.stderr)
+            return None
+
+
+_backend: Optional[Any] = None
+_backend_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "invalidated": 0, "stored": 0}
+
+
+def backend():
+    """缓存后端，未启用时为 None"""
+    global _backend
+    if MEMO_SIZE <= 0:
+        return None
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _create_backend()
+    return _backend
+
+
+def _create_backend():
+    if MEMO_REDIS_URL:
+        try:
+            created = RedisBackend(MEMO_REDIS_URL)
+            print("[memo] response cache shared via redis", file=sys.stderr)
+            return created
+        except ImportError:
+            print("[memo] redis package not installed, using in-process response cache", file=sys.stderr)
+    if WORKERS > 1:
+        from statement_store import DATA_DIR
+        try:
+            DATA_DIR.mkdir(parents=True, exist_ok=True)
+            created = SqliteBackend(str(DATA_DIR / SQLITE_FILE))
+            print(f"[memo] response cache shared by {WORKERS} workers via {DATA_DIR / SQLITE_FILE}", file=sys.stderr)
+            return created
+        except (OSError, sqlite3.Error) as e:
+            print(f"[memo] cannot open shared response cache, using in-process cache: {e}", file=sys.stderr)
+    return LocalBackend()
+
+
+def status() -> Dict:
+    """/health 中展示的缓存统计"""
+    lookups = _stats["hits"] + _stats["misses"]
+    current = _backend
+    return {
+        "enabled": MEMO_SIZE > 0,
+        "backend": current.name if current is not None else None,
+        "entries": current.size() if current is not None else None,
+        "hit_ratio": round(_stats["hits"] / lookups, 4) if lookups else None,
+        **_stats,
+    }
+
+
+def depends(source: str):
+    """记录当前工具调用读取了某个数据源（在读取数据之前调用）"""
+    call = _call.get()
+    if call is not None and source not in call["deps"]:
+        call["deps"][source] = backend().versions([source])[0]
+
+
+def changed(*sources: str):
+    """数据源刷新出了新数据，依赖它的缓存输出失效"""
+    current = backend()
+    if current is not None:
+        current.bump(sources)
+
+
+def no_store():
+    """当前工具调用的结果不缓存（使用了过期数据或上游调用失败）"""
+    call = _call.get()
+    if call is not None:
+        call["store"] = False
+
+
+def _normalize(name: str, value: Any) -> Any:
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        value = value.strip()
+        return value.upper() if name in CODE_PARAMS else value
+    if isinstance(value, (list, tuple)):
+        return [_normalize(name, v) for v in value]
+    return value
+
+
+def make_key(transport: str, tool: str, scope: str, signature: inspect.Signature, args, kwargs) -> str:
+    """(入口, 工具, 租户, 规范化后的全部参数) 的缓存键"""
+    bound = signature.bind(*args, **kwargs)
+    bound.apply_defaults()
+    normalized = {name: _normalize(name, value) for name, value in bound.arguments.items()}
+    digest = hashlib.sha1(json.dumps(normalized, sort_keys=True, ensure_ascii=False, default=str).encode()).hexdigest()
+    return f"{transport}:{tool}:{scope}:{digest}"
+
+
+def _valid(current, deps: Dict[str, int]) -> bool:
+    sources = list(deps)
+    return current.versions(sources) == [deps[source] for source in sources]
+
+
+def memoize(scope: Callable[[], Optional[str]], transport: str):
+    """
+    同步工具函数的输出缓存装饰器
+
+    参数:
+        scope: 无参函数，返回当前调用的租户标识；返回 None（未配置 token）时不缓存
+        transport: 入口名称（stdio/http），两种入口的输出格式不同，分开缓存
+    """
+    def decorate(func):
+        tool = func.__name__
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            current = backend()
+            namespace = scope() if current is not None else None
+            if namespace is None:
+                return func(*args, **kwargs)
+
+            key = make_key(transport, tool, namespace, signature, args, kwargs)
+            entry = current.get(key)
+            if entry is not None:
+                value, deps = entry
+                if _valid(current, deps):
+                    _stats["hits"] += 1
+                    cache_lookup("response", "hit")
+                    return value
+                _stats["invalidated"] += 1
+                current.delete(key)
+            _stats["misses"] += 1
+            cache_lookup("response", "miss")
+
+            call = {"store": True, "deps": {}}
+            token = _call.set(call)
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                _call.reset(token)
+            if call["store"]:
+                current.set(key, result, call["deps"])
+                _stats["stored"] += 1
+            return result
+        return wrapper
+    return decorate
@@ -0,0 +1,342 @@
+"""
+运行指标（Prometheus 文本格式）
+
+记录工具调用次数、错误数和耗时，并把耗时拆分为：
+    upstream        Tushare HTTP 请求
+    rate_limit_wait 排队等待限流令牌
+    serialization   结果编码
+    transform       其余部分（pandas 处理、格式化文本等）
+另外记录上游接口耗时/错误/重试、熔断拒绝、限流等待、缓存命中和进行中的请求数。
+各阶段和缓存查询同时记录到当前调用的追踪中（见 tracing）。
+
+HTTP 服务通过 /metrics 路由暴露；stdio 服务设置 TUSHARE_METRICS_PORT 后
+在该端口启动一个只提供 /metrics 的后台 HTTP 服务。
+"""
+import asyncio
+import contextvars
+import functools
+import inspect
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+import tracing
+
+# stdio 服务暴露 /metrics 的端口，0 表示不启动
+METRICS_PORT = int(os.getenv("TUSHARE_METRICS_PORT", "0"))
+
+# 耗时直方图的桶上界（秒）
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    items = labels + extra
+    if not items:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._lock = threading.Lock()
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield from self._samples()
+
+    def _samples(self):
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        super().__init__(name, help_text)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_labels(labels), 0.0)
+
+    def items(self):
+        with self._lock:
+            return list(self._values.items())
+
+    def _samples(self):
+        for labels, value in self.items():
+            yield f"{self.name}{_format_labels(labels)} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_labels(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text)
+        self._buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # labels -> [各桶计数..., 总和]
+        self._values: Dict[Labels, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = _labels(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * len(self._buckets) + [0.0]
+            for i, bound in enumerate(self._buckets):
+                if value <= bound:
+                    entry[i] += 1
+                    break
+            entry[-1] += value
+
+    def _samples(self):
+        with self._lock:
+            items = [(labels, list(entry)) for labels, entry in self._values.items()]
+        for labels, entry in items:
+            cumulative = 0
+            for bound, count in zip(self._buckets, entry):
+                cumulative += count
+                le = (("le", _format_value(float(bound))),)
+                yield f"{self.name}_bucket{_format_labels(labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(labels)} {_format_value(entry[-1])}"
+            yield f"{self.name}_count{_format_labels(labels)} {cumulative}"
+
+
+TOOL_CALLS = Counter("tushare_tool_calls_total", "Tool invocations")
+TOOL_ERRORS = Counter("tushare_tool_errors_total", "Tool invocations that raised")
+TOOL_DURATION = Histogram("tushare_tool_duration_seconds", "Tool latency by phase")
+TOOL_IN_FLIGHT = Gauge("tushare_tool_in_flight", "Tool calls in progress")
+UPSTREAM_DURATION = Histogram("tushare_upstream_duration_seconds", "Tushare HTTP request latency")
+UPSTREAM_ERRORS = Counter("tushare_upstream_errors_total", "Failed Tushare requests")
+UPSTREAM_IN_FLIGHT = Gauge("tushare_upstream_in_flight", "Tushare requests in progress")
+UPSTREAM_RETRIES = Counter("tushare_upstream_retries_total", "Tushare requests retried after a transient error")
+CIRCUIT_REJECTIONS = Counter("tushare_circuit_rejections_total", "Tushare requests rejected while the circuit was open")
+RATE_LIMIT_WAIT = Histogram("tushare_rate_limit_wait_seconds", "Time spent waiting for a rate-limit token")
+CACHE_REQUESTS = Counter("tushare_cache_requests_total", "Cache lookups by result (hit/miss/stale)")
+CACHE_HIT_RATIO = Gauge("tushare_cache_hit_ratio", "Share of cache lookups served without waiting for upstream")
+PREFETCHES = Counter("tushare_prefetch_total", "Background prefetches by dataset and result")
+
+_METRICS = (
+    TOOL_CALLS, TOOL_ERRORS, TOOL_DURATION, TOOL_IN_FLIGHT,
+    UPSTREAM_DURATION, UPSTREAM_ERRORS, UPSTREAM_IN_FLIGHT, UPSTREAM_RETRIES, CIRCUIT_REJECTIONS,
+    RATE_LIMIT_WAIT, CACHE_REQUESTS, CACHE_HIT_RATIO, PREFETCHES,
+)
+
+# 当前工具调用各阶段累计的耗时，run_blocking 通过 copy_context 带入工作线程
+_phases: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("tushare_phases", default=None)
+
+
+def _accumulate(phase: str, seconds: float):
+    phases = _phases.get()
+    if phases is not None:
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+def record_phase(phase: str, seconds: float):
+    """把刚结束的一段耗时计入当前工具调用的某个阶段（不在工具调用中时忽略）"""
+    _accumulate(phase, seconds)
+    tracing.add_span(phase, seconds)
+
+
+@contextmanager
+def phase(name: str):
+    start = time.perf_counter()
+    try:
+        with tracing.span(name):
+            yield
+    finally:
+        _accumulate(name, time.perf_counter() - start)
+
+
+class FanOut:
+    """
+    一次并发扇出（如批量查询逐只拉取）中各工作线程的阶段耗时
+
+    每个工作线程在自己的阶段表中累计，结束时只把累计耗时最长的线程（关键路径）
+    计入当前工具调用，各阶段之和不超过扇出的墙钟时间；
+    工作线程直接共享调用方的阶段表会把各线程的耗时相加。
+
+    用法:
+        with FanOut() as fan_out, ThreadPoolExecutor(...) as pool:
+            pool.submit(contextvars.copy_context().run, fan_out.run, func, arg)
+    """
+
+    def __init__(self):
+        self._parent = _phases.get()
+        self._threads: Dict[int, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def run(self, func, *args, **kwargs):
+        """在工作线程中执行 func，阶段耗时计入该线程的阶段表（需在复制的上下文中调用）"""
+        if self._parent is not None:
+            with self._lock:
+                phases = self._threads.setdefault(threading.get_ident(), {})
+            _phases.set(phases)
+        return func(*args, **kwargs)
+
+    def __enter__(self) -> "FanOut":
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._parent is None or not self._threads:
+            return
+        with self._lock:
+            slowest = max(self._threads.values(), key=lambda phases: sum(phases.values()))
+            for name, seconds in slowest.items():
+                self._parent[name] = self._parent.get(name, 0.0) + seconds
+
+
+def cache_lookup(cache: str, result: str):
+    """记录一次缓存查询，result 为 hit、miss 或 stale（返回旧数据并后台刷新）"""
+    CACHE_REQUESTS.inc(cache=cache, result=result)
+    tracing.event("cache", cache=cache, result=result)
+
+
+def _finish(tool: str, phases: Dict[str, float], start: float, failed: bool):
+    total = time.perf_counter() - start
+    TOOL_IN_FLIGHT.dec(tool=tool)
+    if failed:
+        TOOL_ERRORS.inc(tool=tool)
+    TOOL_DURATION.observe(total, tool=tool, phase="total")
+    measured = 0.0
+    # 超时返回后工作线程可能仍在写入，先复制一份
+    for name, seconds in list(phases.items()):
+        TOOL_DURATION.observe(seconds, tool=tool, phase=name)
+        measured += seconds
+    TOOL_DURATION.observe(max(0.0, total - measured), tool=tool, phase="transform")
+
+
+def instrument(func):
+    """
+    工具函数装饰器：记录调用次数、错误、进行中数量和分阶段耗时，
+    并为每次调用建立追踪（请求 ID、各阶段 span，见 tracing）
+
+    同步工具在本线程内按需做性能剖析；异步工具的剖析在线程池中进行（见 app_http.run_blocking）。
+    """
+    tool = func.__name__
+    signature = inspect.signature(func)
+
+    def begin():
+        TOOL_CALLS.inc(tool=tool)
+        TOOL_IN_FLIGHT.inc(tool=tool)
+        phases: Dict[str, float] = {}
+        return phases, _phases.set(phases), time.perf_counter()
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            phases, token, start = begin()
+            failed = True
+            try:
+                with tracing.trace(tool, signature, args, kwargs):
+                    result = await func(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                _phases.reset(token)
+                _finish(tool, phases, start, failed)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        phases, token, start = begin()
+        failed = True
+        try:
+            with tracing.trace(tool, signature, args, kwargs), tracing.profiler.run():
+                result = func(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            _phases.reset(token)
+            _finish(tool, phases, start, failed)
+    return wrapper
+
+
+def _update_hit_ratio():
+    totals: Dict[str, list] = {}
+    for labels, value in CACHE_REQUESTS.items():
+        label_map = dict(labels)
+        entry = totals.setdefault(label_map.get("cache", ""), [0.0, 0.0])
+        entry[1] += value
+        if label_map.get("result") != "miss":
+            entry[0] += value
+    for cache, (served, total) in totals.items():
+        CACHE_HIT_RATIO.set(served / total if total else 0.0, cache=cache)
+
+
+def render() -> str:
+    """所有指标的 Prometheus 文本格式"""
+    _update_hit_ratio()
+    lines = []
+    for metric in _METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port: int = METRICS_PORT, host: str = "127.0.0.1") -> Optional[ThreadingHTTPServer]:
+    """在后台线程提供 /metrics（供没有 HTTP 服务的 stdio 进程使用）"""
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        print(f"[metrics] failed to listen on {host}:{port}: {e}", file=sys.stderr)
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"[metrics] serving http://{host}:{port}/metrics", file=sys.stderr)
+    return server
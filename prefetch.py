@@ -0,0 +1,252 @@
+"""
+财报季预取调度
+
+财报季里交互查询集中在刚披露的利润表上，本地存储还没有这些数据时，
+每次都要同步等待上游。PrefetchScheduler 在后台线程中：
+- 定期按实际披露日查询 disclosure_date（财报披露计划），自选股或指数成分股
+  披露新一期报告后，立即把利润表增量同步到本地存储；
+- 启动时补齐本地还没有数据的自选股；
+- 每晚重新加载股票列表（stock_basic）和指数成分。
+
+所有上游调用都在 tushare_client.background() 中发起，最多占用各接口配额的
+PREFETCH_SHARE，且只使用空闲令牌，不会推迟交互请求。
+"""
+import datetime
+import os
+import sys
+import threading
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Set, Tuple
+
+from metrics import PREFETCHES
+from tushare_client import background
+
+if TYPE_CHECKING:
+    from tenants import Tenant
+
+# 轮询披露日历的间隔（秒），0 表示不启用预取
+PREFETCH_INTERVAL = float(os.getenv("TUSHARE_PREFETCH_INTERVAL", "0"))
+
+# 预取可占用的各接口限流配额比例
+PREFETCH_SHARE = float(os.getenv("TUSHARE_PREFETCH_SHARE", "0.2"))
+
+# 自选股，逗号分隔的股票代码
+PREFETCH_CODES = os.getenv("TUSHARE_PREFETCH_CODES", "")
+
+# 指数代码，逗号分隔（如 000300.SH），其成分股加入预取范围
+PREFETCH_INDEX = os.getenv("TUSHARE_PREFETCH_INDEX", "")
+
+# 每晚刷新股票列表和指数成分的时间（本地时间的小时）
+NIGHTLY_HOUR = int(os.getenv("TUSHARE_NIGHTLY_HOUR", "2"))
+
+# 首次轮询时回看的天数，覆盖服务停机期间的披露
+LOOKBACK_DAYS = 7
+
+# 指数成分按月更新，在最近该天数内取最新一期
+INDEX_WINDOW_DAYS = 45
+
+# 披露日历显示已披露、但同步后仍没有该期数据时（上游入库有延迟）的重试次数
+MAX_ATTEMPTS = 3
+
+DISCLOSURE_FIELDS = "ts_code,ann_date,end_date,pre_date,actual_date"
+
+
+def parse_codes(spec: str) -> List[str]:
+    """逗号分隔的代码列表，统一为大写并去重"""
+    return list(dict.fromkeys(code.strip().upper() for code in spec.split(",") if code.strip()))
+
+
+def _days(start: datetime.date, end: datetime.date) -> List[str]:
+    days = []
+    while start <= end:
+        days.append(start.strftime("%Y%m%d"))
+        start += datetime.timedelta(days=1)
+    return days
+
+
+class PrefetchScheduler:
+    """
+    后台预取默认租户的利润表和股票列表
+
+    参数:
+        tenant: 无参函数，返回当前的默认租户（未配置 token 时为 None），
+                每轮重新获取，更换 token 后自动使用新租户
+        codes: 自选股代码
+        indexes: 指数代码，成分股每晚更新
+        interval: 轮询披露日历的间隔（秒）
+        share: 可占用的限流配额比例
+    """
+
+    def __init__(
+        self,
+        tenant: Callable[[], Optional["Tenant"]],
+        codes: List[str],
+        indexes: List[str],
+        interval: float = PREFETCH_INTERVAL,
+        share: float = PREFETCH_SHARE,
+        nightly_hour: int = NIGHTLY_HOUR,
+    ):
+        self._tenant = tenant
+        self._codes = codes
+        self._indexes = indexes
+        self._interval = max(1.0, interval)
+        self._share = share
+        self._nightly_hour = nightly_hour
+        self._watchlist: Set[str] = set(codes)
+        self._checked_through: Optional[datetime.date] = None
+        self._nightly_done: Optional[datetime.date] = None
+        self._pending: Dict[Tuple[str, str], int] = {}
+        self._filled = False
+        self._constituents_loaded = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {"runs": 0, "prefetched": 0, "failed": 0, "last_run": None, "last_error": None}
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="prefetch", daemon=True)
+        self._thread.start()
+        print(
+            f"[prefetch] scheduler started: {len(self._codes)} codes, {len(self._indexes)} indexes, "
+            f"every {self._interval:g}s, {self._share:.0%} of rate budget",
+            file=sys.stderr,
+        )
+
+    def stop(self):
+        self._stop.set()
+
+    def status(self) -> Dict:
+        return {
+            "watchlist": len(self._watchlist),
+            "pending": len(self._pending),
+            "checked_through": self._checked_through.strftime("%Y%m%d") if self._checked_through else None,
+            **self._stats,
+        }
+
+    def _run(self):
+        with background(self._share):
+            while True:
+                try:
+                    self.run_once()
+                except Exception as e:
+                    self._stats["last_error"] = str(e)
+                    print(f"[prefetch] run failed: {e}", file=sys.stderr)
+                if self._stop.wait(self._interval):
+                    return
+
+    def run_once(self, now: Optional[datetime.datetime] = None):
+        """执行一轮：必要时做每晚刷新，然后预取新披露和缺失的利润表"""
+        now = now or datetime.datetime.now()
+        tenant = self._tenant()
+        if tenant is None:
+            return
+        today = now.date()
+        if self._nightly_due(now):
+            self._nightly(tenant)
+            self._nightly_done = today
+        elif self._indexes and not self._constituents_loaded:
+            # 启动后首轮（或上次加载失败）先取得指数成分
+            self._load_constituents(tenant)
+
+        if not self._filled:
+            for key in self._missing(tenant):
+                self._pending.setdefault(key, 0)
+            self._filled = True
+        try:
+            for key in self._announced(tenant, today):
+                self._pending.setdefault(key, 0)
+            self._checked_through = today
+        except Exception as e:
+            # 下一轮从同一天重新检查
+            self._stats["last_error"] = f"disclosure_date: {e}"
+            print(f"[prefetch] disclosure calendar query failed: {e}", file=sys.stderr)
+
+        for (ts_code, period), attempts in list(self._pending.items()):
+            self._prefetch(tenant, ts_code, period, attempts)
+        self._stats["runs"] += 1
+        self._stats["last_run"] = now.strftime("%Y-%m-%d %H:%M:%S")
+
+    def _nightly_due(self, now: datetime.datetime) -> bool:
+        if self._nightly_done == now.date():
+            return False
+        if self._nightly_done is None:
+            # 启动当天不重复加载（股票列表刚在首次访问时加载过）
+            self._nightly_done = now.date()
+            return False
+        return now.hour >= self._nightly_hour
+
+    def _nightly(self, tenant: "Tenant"):
+        """重新加载股票列表和指数成分"""
+        try:
+            tenant.universe.refresh()
+            PREFETCHES.inc(dataset="stock_basic", result="ok")
+        except Exception as e:
+            PREFETCHES.inc(dataset="stock_basic", result="error")
+            print(f"[prefetch] nightly stock_basic refresh failed: {e}", file=sys.stderr)
+        if self._indexes:
+            self._load_constituents(tenant)
+
+    def _load_constituents(self, tenant: "Tenant"):
+        today = datetime.date.today()
+        start = (today - datetime.timedelta(days=INDEX_WINDOW_DAYS)).strftime("%Y%m%d")
+        members = set(self._codes)
+        for index_code in self._indexes:
+            try:
+                df = tenant.client.index_weight(index_code=index_code, start_date=start, end_date=today.strftime("%Y%m%d"))
+            except Exception as e:
+                print(f"[prefetch] failed to load constituents of {index_code}: {e}", file=sys.stderr)
+                # 保留之前的成分股
+                members.update(self._watchlist)
+                continue
+            if df is None or df.empty:
+                continue
+            latest = df[df["trade_date"] == df["trade_date"].max()]
+            members.update(latest["con_code"].str.upper())
+            self._constituents_loaded = True
+        self._watchlist = members
+        # 新调入的成分股在下一轮补齐
+        self._filled = False
+        print(f"[prefetch] watchlist: {len(members)} codes", file=sys.stderr)
+
+    def _missing(self, tenant: "Tenant") -> List[Tuple[str, str]]:
+        """本地还没有利润表的自选股"""
+        return [(code, "") for code in sorted(self._watchlist) if tenant.income_store.peek(code) is None]
+
+    def _announced(self, tenant: "Tenant", today: datetime.date) -> List[Tuple[str, str]]:
+        """上次检查以来实际披露、且本地还没有该期数据的 (股票, 报告期)"""
+        start = self._checked_through or today - datetime.timedelta(days=LOOKBACK_DAYS)
+        found = []
+        for day in _days(start, today):
+            df = tenant.client.disclosure_date(actual_date=day, fields=DISCLOSURE_FIELDS)
+            if df is None or df.empty:
+                continue
+            df = df[df["ts_code"].isin(self._watchlist)]
+            for ts_code, period in zip(df["ts_code"], df["end_date"]):
+                if not self._stored(tenant, ts_code, period):
+                    found.append((ts_code, period))
+        return found
+
+    def _stored(self, tenant: "Tenant", ts_code: str, period: str) -> bool:
+        df = tenant.income_store.peek(ts_code)
+        return df is not None and (df["end_date"] == period).any()
+
+    def _prefetch(self, tenant: "Tenant", ts_code: str, period: str, attempts: int):
+        key = (ts_code, period)
+        try:
+            tenant.income_store.sync(ts_code)
+        except Exception as e:
+            PREFETCHES.inc(dataset="income", result="error")
+            self._stats["failed"] += 1
+            self._stats["last_error"] = f"{ts_code}: {e}"
+            print(f"[prefetch] income {ts_code} failed: {e}", file=sys.stderr)
+        else:
+            PREFETCHES.inc(dataset="income", result="ok")
+            self._stats["prefetched"] += 1
+            if not period or self._stored(tenant, ts_code, period):
+                self._pending.pop(key, None)
+                return
+        if attempts + 1 >= MAX_ATTEMPTS:
+            self._pending.pop(key, None)
+            print(f"[prefetch] giving up on income {ts_code} {period or ''}".rstrip(), file=sys.stderr)
+        else:
+            self._pending[key] = attempts + 1
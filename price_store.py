@@ -0,0 +1,352 @@
+"""
+日线行情本地时序存储
+
+每只股票的日线（daily）和复权因子（adj_factor）按交易日升序保存为
+~/.tushare_mcp/prices/<股票代码>/ 下的 Arrow IPC 文件。文件只追加不修改：
+每次同步只拉取本地最新交易日之后的数据，写成一个新的分块文件，
+分块数超过 MAX_CHUNKS 时合并为一个文件。
+
+读取时以内存映射方式打开，数据不经过反序列化和复制；按日期范围取数用
+二分查找切片，前复权/后复权在读取时对整个窗口做向量化乘法，
+因此多年的行情也只需几毫秒，无需分页调用受限流约束的接口。
+多个 worker 进程映射同一文件时共用操作系统的页缓存，内存占用不随 worker 数成倍增加；
+同步同一只股票时用文件锁互斥（见 workers）。
+复权方式与 tushare.pro_bar 一致：
+    hfq 价格 × 当日复权因子
+    qfq 价格 × 当日复权因子 / 窗口内最新复权因子
+"""
+import datetime
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from memo import changed, depends
+from metrics import cache_lookup
+from resilience import mark_stale
+from statement_store import DATA_DIR, normalize_code
+from workers import file_lock
+
+# 距上次同步超过该秒数后拉取新交易日，默认 1 小时
+PRICE_TTL = float(os.getenv("TUSHARE_PRICE_TTL", "3600"))
+
+# 单只股票的分块文件数超过该值时合并
+MAX_CHUNKS = 16
+
+# 内存中保留的股票数量（内存映射，只占用地址空间和文件句柄）
+MEMORY_ENTRIES = 256
+
+# 单次返回少于该行数说明已取到最早的数据，不再向前翻页
+PAGE_ROWS = 2000
+
+# 本地没有数据时从该日期开始拉取
+EARLIEST_DATE = "19900101"
+
+DAILY_FIELDS = "ts_code,trade_date,open,high,low,close,pre_close,change,pct_chg,vol,amount"
+
+# 复权时调整的价格字段
+PRICE_COLUMNS = ["open", "high", "low", "close", "pre_close"]
+
+# 复权方式：不复权、前复权、后复权
+ADJ_TYPES = ("", "qfq", "hfq")
+
+# 交易日以 YYYYMMDD 整数保存，便于二分查找
+SCHEMA = pa.schema(
+    [("trade_date", pa.int32())]
+    + [(name, pa.float64()) for name in (*PRICE_COLUMNS, "change", "pct_chg", "vol", "amount", "adj_factor")]
+)
+
+
+def _check_date(value: str, name: str) -> str:
+    """YYYYMMDD 格式的日期，留空表示不限；格式错误时抛出 ValueError"""
+    value = (value or "").strip()
+    if value and not re.fullmatch(r"\d{8}", value):
+        raise ValueError(f"{name} 应为 YYYYMMDD 格式（如 20240101），收到 {value!r}")
+    return value
+
+
+def _next_day(date: str) -> str:
+    day = datetime.datetime.strptime(date, "%Y%m%d") + datetime.timedelta(days=1)
+    return day.strftime("%Y%m%d")
+
+
+def _previous_day(date: str) -> str:
+    day = datetime.datetime.strptime(date, "%Y%m%d") - datetime.timedelta(days=1)
+    return day.strftime("%Y%m%d")
+
+
+def _dedupe(table: pa.Table) -> pa.Table:
+    """按交易日升序排列，同一交易日保留最后写入的一行"""
+    dates = table.column("trade_date").to_numpy()
+    if len(dates) < 2 or (np.diff(dates) > 0).all():
+        return table
+    order = np.argsort(dates, kind="stable")
+    ordered = dates[order]
+    last = np.append(ordered[1:] != ordered[:-1], True)
+    return table.take(pa.array(order[last]))
+
+
+def adjust(df: pd.DataFrame, adj: str) -> pd.DataFrame:
+    """
+    对按交易日升序排列的行情做复权（原地修改并返回）
+
+    停牌等原因缺失的复权因子沿用前一交易日的值。
+    """
+    if not adj or df.empty:
+        return df
+    factors = df["adj_factor"].ffill().bfill().to_numpy()
+    if np.isnan(factors).all():
+        raise ValueError("缺少复权因子，无法复权")
+    scale = factors if adj == "hfq" else factors / factors[-1]
+    df[PRICE_COLUMNS] = (df[PRICE_COLUMNS].to_numpy() * scale[:, None]).round(2)
+    df["change"] = (df["close"] - df["pre_close"]).round(2)
+    return df
+
+
+class PriceStore:
+    """
+    日线行情的本地存储
+
+    参数:
+        daily_fetch: 调用 pro.daily 的函数
+        adj_fetch: 调用 pro.adj_factor 的函数
+        root: 存储根目录
+        ttl: 增量同步间隔（秒）
+    """
+
+    def __init__(
+        self,
+        daily_fetch: Callable[..., pd.DataFrame],
+        adj_fetch: Callable[..., pd.DataFrame],
+        root: Path = DATA_DIR / "prices",
+        ttl: float = PRICE_TTL,
+    ):
+        self._daily_fetch = daily_fetch
+        self._adj_fetch = adj_fetch
+        self._dir = root
+        self._ttl = ttl
+        self._memory: "OrderedDict[str, Tuple[pa.Table, float]]" = OrderedDict()
+        self._memory_lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+
+    def get(self, ts_code: str, start_date: str = "", end_date: str = "", adj: str = "") -> pd.DataFrame:
+        """
+        返回某只股票的日线行情，按交易日倒序（与 pro.daily 一致）
+
+        参数:
+            start_date / end_date: 交易日期范围（YYYYMMDD），留空表示不限
+            adj: 复权方式，""（不复权）、"qfq"（前复权）或 "hfq"（后复权）
+
+        代码或日期格式错误时抛出 ValueError。
+        本地数据过期时同步拉取新交易日；其他线程正在同步或上游故障时返回旧数据，
+        并在 DataFrame.attrs 中标记数据年龄（见 resilience.stale_age）。
+        """
+        adj = (adj or "").strip().lower()
+        if adj not in ADJ_TYPES:
+            raise ValueError("adj 只能为空、qfq 或 hfq")
+        ts_code = normalize_code(ts_code)
+        start_date = _check_date(start_date, "start_date")
+        end_date = _check_date(end_date, "end_date")
+        depends(str(self._dir / ts_code))
+        table, age = self._load(ts_code)
+
+        dates = table.column("trade_date").to_numpy()
+        lo = np.searchsorted(dates, int(start_date), "left") if start_date else 0
+        hi = np.searchsorted(dates, int(end_date), "right") if end_date else len(dates)
+        df = table.slice(lo, max(0, hi - lo)).to_pandas()
+        df = adjust(df, adj)
+        df["trade_date"] = df["trade_date"].astype(str)
+        df.insert(0, "ts_code", ts_code)
+        df = df.iloc[::-1].reset_index(drop=True)
+        return mark_stale(df, age) if age is not None else df
+
+    def _load(self, ts_code: str) -> Tuple[pa.Table, Optional[float]]:
+        """返回 (全部行情, 旧数据年龄)，数据是最新的时年龄为 None"""
+        table, synced_at = self._remembered(ts_code)
+        if table is not None and time.time() - synced_at < self._ttl:
+            cache_lookup("daily", "hit")
+            return table, None
+
+        lock = self._key_lock(ts_code)
+        if table is not None and not lock.acquire(blocking=False):
+            # 其他线程正在同步，先返回旧数据
+            cache_lookup("daily", "stale")
+            return table, time.time() - synced_at
+        if table is None:
+            lock.acquire()
+        try:
+            # 其他 worker 正在同步同一只股票时等它写完，随后直接读盘
+            with file_lock(self._dir / ts_code):
+                table, synced_at = self._cached(ts_code)
+                if table is not None and time.time() - synced_at < self._ttl:
+                    cache_lookup("daily", "hit")
+                    return table, None
+                try:
+                    fresh = self._sync(ts_code, table)
+                except Exception as e:
+                    if table is None:
+                        cache_lookup("daily", "miss")
+                        raise
+                    cache_lookup("daily", "stale")
+                    print(f"[store] daily sync failed for {ts_code}, serving stored data: {e}", file=sys.stderr)
+                    return table, time.time() - synced_at
+                cache_lookup("daily", "miss")
+                return fresh, None
+        finally:
+            lock.release()
+
+    def _key_lock(self, ts_code: str) -> threading.Lock:
+        with self._memory_lock:
+            return self._key_locks.setdefault(ts_code, threading.Lock())
+
+    def _remembered(self, ts_code: str) -> Tuple[Optional[pa.Table], float]:
+        with self._memory_lock:
+            entry = self._memory.get(ts_code)
+            if entry is None:
+                return None, 0.0
+            self._memory.move_to_end(ts_code)
+            return entry
+
+    def _remember(self, ts_code: str, table: pa.Table, synced_at: float):
+        with self._memory_lock:
+            self._memory[ts_code] = (table, synced_at)
+            self._memory.move_to_end(ts_code)
+            while len(self._memory) > MEMORY_ENTRIES:
+                self._memory.popitem(last=False)
+
+    def _cached(self, ts_code: str) -> Tuple[Optional[pa.Table], float]:
+        """
+        依次查内存和磁盘，返回 (行情, 上次同步时间)，都没有时行情为 None
+
+        内存中的行情过期后先看同步标记：其他 worker 已同步（标记比内存新）时读盘。
+        """
+        table, synced_at = self._remembered(ts_code)
+        if table is not None and time.time() - synced_at < self._ttl:
+            return table, synced_at
+        marker = self._dir / ts_code / ".synced"
+        try:
+            marked_at = marker.stat().st_mtime
+            # 允许 utime 往返的精度误差
+            if table is not None and marked_at - synced_at < 0.001:
+                return table, synced_at
+            stored = self._read(ts_code)
+        except FileNotFoundError:
+            return (table, synced_at) if table is not None else (None, 0.0)
+        except Exception as e:
+            if table is not None:
+                return table, synced_at
+            print(f"[store] failed to read daily prices of {ts_code}, refetching: {e}", file=sys.stderr)
+            return None, 0.0
+        self._remember(ts_code, stored, marked_at)
+        if table is not None and not stored.equals(table):
+            changed(str(self._dir / ts_code))
+        return stored, marked_at
+
+    def _chunks(self, ts_code: str) -> List[Path]:
+        return sorted((self._dir / ts_code).glob("*.arrow"))
+
+    def _read(self, ts_code: str) -> pa.Table:
+        tables = [pa.ipc.open_file(pa.memory_map(str(path), "r")).read_all() for path in self._chunks(ts_code)]
+        if not tables:
+            return SCHEMA.empty_table()
+        return _dedupe(pa.concat_tables(tables))
+
+    def _sync(self, ts_code: str, stored: Optional[pa.Table]) -> pa.Table:
+        initial = stored is None
+        stored = stored if stored is not None else SCHEMA.empty_table()
+        start = EARLIEST_DATE
+        if stored.num_rows:
+            # 最近几天的复权因子可能晚于行情发布，从第一条缺失复权因子的交易日重新拉取
+            missing = stored.column("adj_factor").is_null().to_numpy(zero_copy_only=False)
+            dates = stored.column("trade_date").to_numpy()
+            start = str(dates[missing.argmax()]) if missing.any() else _next_day(str(dates[-1]))
+        end = time.strftime("%Y%m%d")
+
+        synced_at = time.time()
+        if start > end:
+            self._touch(ts_code, synced_at)
+            self._remember(ts_code, stored, synced_at)
+            return stored
+
+        daily = self._fetch_pages(self._daily_fetch, ts_code, start, end, DAILY_FIELDS)
+        if daily.empty:
+            self._touch(ts_code, synced_at)
+            self._remember(ts_code, stored, synced_at)
+            return stored
+        factors = self._fetch_pages(self._adj_fetch, ts_code, start, end, "ts_code,trade_date,adj_factor")
+        if factors.empty:
+            factors = pd.DataFrame(columns=["trade_date", "adj_factor"])
+
+        fresh = daily.drop(columns=["ts_code", "adj_factor"], errors="ignore").merge(
+            factors[["trade_date", "adj_factor"]], on="trade_date", how="left"
+        )
+        fresh["trade_date"] = fresh["trade_date"].astype("int32")
+        fresh = fresh.sort_values("trade_date", kind="stable").drop_duplicates("trade_date", keep="last")
+        chunk = pa.Table.from_pandas(fresh[SCHEMA.names], schema=SCHEMA, preserve_index=False)
+
+        self._append(ts_code, chunk)
+        table = _dedupe(pa.concat_tables([stored, chunk])) if stored.num_rows else chunk
+        self._touch(ts_code, synced_at)
+        self._remember(ts_code, table, synced_at)
+        if not initial:
+            changed(str(self._dir / ts_code))
+        return table
+
+    def _fetch_pages(self, fetch: Callable[..., pd.DataFrame], ts_code: str, start: str, end: str, fields: str) -> pd.DataFrame:
+        """按日期范围拉取，接口单次返回行数有上限，从最新往前翻页"""
+        frames = []
+        while start <= end:
+            df = fetch(ts_code=ts_code, start_date=start, end_date=end, fields=fields)
+            if df is None or df.empty:
+                break
+            frames.append(df)
+            if len(df) < PAGE_ROWS:
+                break
+            end = _previous_day(str(df["trade_date"].min()))
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+    def _append(self, ts_code: str, chunk: pa.Table):
+        chunks = self._chunks(ts_code)
+        seq = int(chunks[-1].stem) + 1 if chunks else 0
+        try:
+            self._write(ts_code, seq, chunk)
+            if len(chunks) + 1 > MAX_CHUNKS:
+                self._compact(ts_code)
+        except Exception as e:
+            # 写盘失败不影响本次查询，数据仍保留在内存中
+            print(f"[store] failed to persist daily prices of {ts_code}: {e}", file=sys.stderr)
+
+    def _compact(self, ts_code: str):
+        """把全部分块合并为一个文件；先写新文件再删旧文件，读者按顺序去重不会读到重复数据"""
+        chunks = self._chunks(ts_code)
+        table = self._read(ts_code)
+        self._write(ts_code, int(chunks[-1].stem) + 1, table)
+        for path in chunks:
+            path.unlink(missing_ok=True)
+
+    def _write(self, ts_code: str, seq: int, table: pa.Table):
+        path = self._dir / ts_code / f"{seq:06d}.arrow"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        with pa.OSFile(str(tmp), "wb") as sink, pa.ipc.new_file(sink, SCHEMA) as writer:
+            writer.write_table(table)
+        os.replace(tmp, path)
+
+    def _touch(self, ts_code: str, synced_at: float):
+        marker = self._dir / ts_code / ".synced"
+        try:
+            marker.parent.mkdir(parents=True, exist_ok=True)
+            marker.touch()
+            os.utime(marker, (synced_at, synced_at))
+        except OSError:
+            pass
@@ -0,0 +1,142 @@
+"""
+上游故障处理：重试、熔断、旧数据标记
+
+- 网络错误、超时和 5xx 属于暂时性故障，按指数退避加随机抖动重试；
+- 连续暂时性故障达到阈值后熔断，冷却期内的调用直接失败，不再占用线程等待超时；
+  冷却期过后放行一次试探调用，成功则恢复；
+- 本地缓存过期但上游不可用（或正在后台刷新）时返回旧数据，
+  DataFrame.attrs 中记录数据的年龄，工具据此在结果中提示。
+"""
+import os
+import random
+import sys
+import threading
+import time
+from typing import TYPE_CHECKING, Optional
+
+from memo import no_store
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# 暂时性故障的重试次数（不含首次调用）
+RETRIES = int(os.getenv("TUSHARE_RETRIES", "2"))
+
+# 退避基数和上限（秒），第 n 次重试前等待 [0, min(上限, 基数 * 2^n)] 内的随机时间
+RETRY_BASE_DELAY = float(os.getenv("TUSHARE_RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("TUSHARE_RETRY_MAX_DELAY", "8"))
+
+# 连续暂时性故障多少次后熔断，以及熔断持续的秒数
+BREAKER_THRESHOLD = int(os.getenv("TUSHARE_BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("TUSHARE_BREAKER_COOLDOWN", "30"))
+
+# DataFrame.attrs 中记录旧数据年龄（秒）的键
+STALE_AGE = "stale_age"
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """熔断期间拒绝调用"""
+
+
+def is_transient(exc: BaseException) -> bool:
+    """网络错误、超时和服务端 5xx 视为暂时性故障"""
+    import requests
+    if isinstance(exc, requests.HTTPError):
+        response = exc.response
+        return response is not None and response.status_code >= 500
+    return isinstance(exc, (requests.ConnectionError, requests.Timeout))
+
+
+def backoff(attempt: int, base: float = RETRY_BASE_DELAY, cap: float = RETRY_MAX_DELAY) -> float:
+    """第 attempt 次重试（从 0 开始）前的等待时间（full jitter）"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    参数:
+        threshold: 连续暂时性故障次数阈值
+        cooldown: 熔断后拒绝调用的秒数
+    """
+
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at = 0.0
+        self._state = CLOSED
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+                return HALF_OPEN
+            return self._state
+
+    def before_call(self):
+        """调用前检查，熔断中抛出 CircuitOpenError；冷却期过后只放行一个试探调用"""
+        with self._lock:
+            if self._state == CLOSED:
+                return
+            remaining = self.cooldown - (time.monotonic() - self._opened_at)
+            if remaining <= 0 and not self._trial:
+                self._trial = True
+                return
+            raise CircuitOpenError(
+                f"Tushare 连续 {self._failures} 次请求失败，暂停访问，{max(remaining, 1):.0f} 秒后重试"
+            )
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CLOSED:
+                print("[client] circuit closed, upstream recovered", file=sys.stderr)
+            self._failures = 0
+            self._state = CLOSED
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.threshold:
+                if self._state == CLOSED:
+                    print(f"[client] circuit opened after {self._failures} consecutive failures", file=sys.stderr)
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+            self._trial = False
+
+
+def mark_stale(df: "pd.DataFrame", age: float) -> "pd.DataFrame":
+    """返回标记了年龄的浅拷贝（不修改缓存中的原对象）；用到旧数据的工具输出不缓存"""
+    no_store()
+    df = df.copy(deep=False)
+    df.attrs[STALE_AGE] = age
+    return df
+
+
+def stale_age(df: "pd.DataFrame") -> Optional[float]:
+    """旧数据的年龄（秒），数据是最新的时返回 None"""
+    return getattr(df, "attrs", {}).get(STALE_AGE)
+
+
+def describe_age(seconds: float) -> str:
+    """把秒数写成"3小时"这样的中文描述"""
+    if seconds < 120:
+        return f"{seconds:.0f}秒"
+    if seconds < 7200:
+        return f"{seconds / 60:.0f}分钟"
+    if seconds < 172800:
+        return f"{seconds / 3600:.0f}小时"
+    return f"{seconds / 86400:.0f}天"
+
+
+def stale_message(age: float) -> str:
+    """过期缓存的中文提示"""
+    return f"Tushare 暂时无法获取最新数据，以上结果来自 {describe_age(age)} 前的本地缓存"
@@ -0,0 +1,391 @@
+"""
+全市场财务比率表（选股）
+
+按报告期用 income_vip 一次拉取全市场利润表，预先计算每只股票每期的
+毛利率、营业利润率、净利润率、成本费用率以及同比增速，与股票列表的
+名称、行业、地区合并为一张列式表。筛选和排序只是对这张表做向量化的
+布尔掩码和排序，全市场查询在毫秒级完成，不再需要逐只调用接口。
+
+已过披露截止日的报告期不再变化，拉取一次后以 Parquet 保存在
+~/.tushare_mcp/screen/ 下；仍在披露期内的报告期同样保存，过期后在后台重新拉取，
+财报季结束后比率表随之更新。多个 worker 共用这些文件，同一报告期的拉取用
+文件锁互斥（见 workers），一个 worker 拉取后其余 worker 直接读盘。
+"""
+import datetime
+import operator
+import os
+import re
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from memo import changed, depends
+from metrics import cache_lookup
+from resilience import mark_stale
+from statement_engine import latest_revisions
+from statement_store import DATA_DIR
+from stock_universe import StockUniverse
+from workers import file_lock
+
+# 比率表包含的最近报告期数（多取四期用于计算同比）
+SCREEN_PERIODS = int(os.getenv("TUSHARE_SCREEN_PERIODS", "8"))
+
+# 披露期内的报告期重新拉取的间隔（秒），默认 1 天
+SCREEN_TTL = float(os.getenv("TUSHARE_SCREEN_TTL", "86400"))
+
+# 披露截止日之后仍可能有更正公告，再等待的天数
+DISCLOSURE_GRACE_DAYS = 30
+
+# 后台刷新失败后的重试间隔（秒）
+REFRESH_RETRY_INTERVAL = 300.0
+
+# 未指定报告期时，选择披露数量不少于最多一期该比例的最新报告期
+MIN_COVERAGE = 0.5
+
+SCREEN_FIELDS = (
+    "ts_code,ann_date,f_ann_date,end_date,report_type,update_flag,total_revenue,oper_cost,"
+    "sell_exp,admin_exp,fin_exp,operate_profit,n_income,basic_eps"
+)
+
+# 比率表的列及说明，金额单位为元，比率和增速单位为 %
+RATIO_COLUMNS = {
+    "total_revenue": "营业总收入",
+    "n_income": "净利润",
+    "basic_eps": "基本每股收益",
+    "gross_margin": "毛利率",
+    "operating_margin": "营业利润率",
+    "net_margin": "净利润率",
+    "oper_cost_ratio": "营业成本率",
+    "sell_exp_ratio": "销售费用率",
+    "admin_exp_ratio": "管理费用率",
+    "fin_exp_ratio": "财务费用率",
+    "revenue_yoy": "营收同比",
+    "operate_profit_yoy": "营业利润同比",
+    "n_income_yoy": "净利润同比",
+    "eps_yoy": "每股收益同比",
+}
+
+# 选股结果默认返回的字段
+SCREEN_DEFAULT_FIELDS = (
+    "name,industry,end_date,total_revenue,n_income,gross_margin,operating_margin,net_margin,"
+    "revenue_yoy,n_income_yoy"
+)
+
+# 与股票列表合并的字段
+PROFILE_COLUMNS = ["name", "industry", "area", "market"]
+
+# 各报告期的披露截止日（月日），年报为次年
+DISCLOSURE_DEADLINES = {"0331": "0430", "0630": "0831", "0930": "1031", "1231": "0430"}
+
+_COMPARISONS = {
+    ">=": operator.ge,
+    "<=": operator.le,
+    "!=": operator.ne,
+    "==": operator.eq,
+    "=": operator.eq,
+    ">": operator.gt,
+    "<": operator.lt,
+}
+_CONDITION = re.compile(r"^\s*([a-z_]+)\s*(>=|<=|!=|==|=|>|<)\s*(-?\d+(?:\.\d+)?)\s*$")
+
+
+def recent_periods(count: int, today: Optional[datetime.date] = None) -> List[str]:
+    """截至今天已结束的最近 count 个报告期，按时间倒序"""
+    today = today or datetime.date.today()
+    year, quarter = today.year, (today.month - 1) // 3
+    periods = []
+    while len(periods) < count:
+        if quarter == 0:
+            year, quarter = year - 1, 4
+        periods.append(f"{year}{('0331', '0630', '0930', '1231')[quarter - 1]}")
+        quarter -= 1
+    return periods
+
+
+def disclosure_closed(period: str, today: Optional[datetime.date] = None) -> bool:
+    """报告期是否已过披露截止日（加上更正公告的等待期）"""
+    today = today or datetime.date.today()
+    year = int(period[:4]) + (1 if period[4:] == "1231" else 0)
+    deadline = datetime.datetime.strptime(f"{year}{DISCLOSURE_DEADLINES[period[4:]]}", "%Y%m%d").date()
+    return today > deadline + datetime.timedelta(days=DISCLOSURE_GRACE_DAYS)
+
+
+def parse_conditions(conditions: str) -> List[Tuple[str, Callable, float]]:
+    """
+    解析筛选条件，如 "net_margin>20, revenue_yoy>=30"
+
+    条件之间用逗号、分号或 and 分隔，字段必须是 RATIO_COLUMNS 中的列，
+    格式不正确时抛出 ValueError。
+    """
+    parsed = []
+    for item in re.split(r",|;|\band\b", conditions or ""):
+        if not item.strip():
+            continue
+        match = _CONDITION.match(item.lower())
+        if match is None:
+            raise ValueError(f"无法解析筛选条件：{item.strip()}（格式如 net_margin>20）")
+        column, op, value = match.groups()
+        if column not in RATIO_COLUMNS:
+            raise ValueError(f"未知字段：{column}，可选：{', '.join(RATIO_COLUMNS)}")
+        parsed.append((column, _COMPARISONS[op], float(value)))
+    return parsed
+
+
+def _previous_year(periods: pd.Series) -> pd.Series:
+    return (periods.astype(int) - 10000).astype(str)
+
+
+def compute_ratios(raw: pd.DataFrame) -> pd.DataFrame:
+    """
+    由利润表原始数据计算比率和同比增速
+
+    参数:
+        raw: 每行一只股票一个报告期，包含 SCREEN_FIELDS 中的金额字段
+    """
+    df = raw[["ts_code", "end_date"]].reset_index(drop=True)
+    amounts = ["total_revenue", "oper_cost", "sell_exp", "admin_exp", "fin_exp", "operate_profit", "n_income"]
+    values = raw[amounts + ["basic_eps"]].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+    revenue = values[:, 0]
+
+    # 各项占营收比，一次计算
+    with np.errstate(divide="ignore", invalid="ignore"):
+        shares = values[:, 1:len(amounts)] / revenue[:, None] * 100
+    shares[~np.isfinite(shares)] = np.nan
+    share = dict(zip(amounts[1:], shares.T))
+
+    df["total_revenue"] = revenue
+    df["n_income"] = values[:, amounts.index("n_income")]
+    df["basic_eps"] = values[:, -1]
+    df["gross_margin"] = 100 - share["oper_cost"]
+    df["operating_margin"] = share["operate_profit"]
+    df["net_margin"] = share["n_income"]
+    for key in ("oper_cost", "sell_exp", "admin_exp", "fin_exp"):
+        df[f"{key}_ratio"] = share[key]
+
+    # 同比：与上年同期对比（利润表为年初至今累计值，同期可比）
+    current = pd.DataFrame(
+        values[:, [0, amounts.index("operate_profit"), amounts.index("n_income"), -1]],
+        index=pd.MultiIndex.from_arrays([df["ts_code"], df["end_date"]]),
+    )
+    base = current.reindex(pd.MultiIndex.from_arrays([df["ts_code"], _previous_year(df["end_date"])])).to_numpy()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        growth = (current.to_numpy() - base) / np.abs(base) * 100
+    growth[~np.isfinite(growth)] = np.nan
+    for i, key in enumerate(("revenue_yoy", "operate_profit_yoy", "n_income_yoy", "eps_yoy")):
+        df[key] = growth[:, i]
+    return df
+
+
+class RatioScreener:
+    """
+    全市场财务比率表
+
+    参数:
+        bulk_fetch: 按报告期拉取全市场利润表的函数（pro.income_vip）
+        universe: 股票列表缓存，提供名称、行业、地区
+        root: 存储目录
+        periods: 保留的报告期数
+        ttl: 披露期内报告期的刷新间隔（秒）
+    """
+
+    def __init__(
+        self,
+        bulk_fetch: Callable[..., pd.DataFrame],
+        universe: StockUniverse,
+        root: Path = DATA_DIR / "screen",
+        periods: int = SCREEN_PERIODS,
+        ttl: float = SCREEN_TTL,
+    ):
+        self._bulk_fetch = bulk_fetch
+        self._universe = universe
+        self._dir = root
+        self._periods = max(1, periods)
+        self._ttl = ttl
+        self._raw: Dict[str, pd.DataFrame] = {}
+        # 披露期内各报告期数据的拉取时间（time.time()），比率表的年龄以最早的一期为准
+        self._synced: Dict[str, float] = {}
+        self._table: Optional[pd.DataFrame] = None
+        self._built_at = 0.0
+        self._next_refresh = 0.0
+        self._load_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refreshing = False
+
+    @property
+    def age(self) -> float:
+        """距上次成功构建的秒数"""
+        return time.monotonic() - self._built_at if self._table is not None else float("inf")
+
+    def table(self) -> pd.DataFrame:
+        """完整比率表；首次调用阻塞构建，过期后在后台刷新并返回旧表"""
+        depends(str(self._dir))
+        table = self._table
+        if table is None:
+            with self._load_lock:
+                if self._table is None:
+                    cache_lookup("screen", "miss")
+                    self._build()
+                else:
+                    cache_lookup("screen", "hit")
+                return self._table
+        if self.age > self._ttl:
+            cache_lookup("screen", "stale")
+            if time.monotonic() >= self._next_refresh:
+                self._refresh_in_background()
+        else:
+            cache_lookup("screen", "hit")
+        return table
+
+    def invalidate(self):
+        """丢弃内存中的比率表，下次访问时重新构建（例如更换 token 之后）"""
+        with self._load_lock:
+            self._raw = {}
+            self._table = None
+            self._built_at = 0.0
+            self._next_refresh = 0.0
+
+    def default_period(self, table: pd.DataFrame) -> str:
+        """披露数量足够的最新报告期（财报季初期最新一期只有少数公司披露）"""
+        counts = table["end_date"].value_counts()
+        if counts.empty:
+            return ""
+        enough = counts[counts >= counts.max() * MIN_COVERAGE]
+        return enough.index.max()
+
+    def screen(
+        self,
+        conditions: str = "",
+        industry: str = "",
+        area: str = "",
+        market: str = "",
+        period: str = "",
+        sort_by: str = "",
+        ascending: bool = False,
+        limit: int = 20,
+        offset: int = 0,
+    ) -> pd.DataFrame:
+        """
+        按条件筛选并排序
+
+        参数:
+            conditions: 比率条件，如 "net_margin>20, revenue_yoy>30"
+            industry / area / market: 行业、地区、市场，多个值用逗号分隔
+            period: 报告期，留空时用 default_period
+            sort_by: 排序字段，留空时按第一个条件的字段排序，没有条件时按营业总收入
+            ascending: 是否升序
+            limit / offset: 分页，limit <= 0 表示不限
+        """
+        parsed = parse_conditions(conditions)
+        sort_by = (sort_by or (parsed[0][0] if parsed else "total_revenue")).strip()
+        if sort_by not in RATIO_COLUMNS:
+            raise ValueError(f"未知排序字段：{sort_by}，可选：{', '.join(RATIO_COLUMNS)}")
+
+        table = self.table()
+        period = period or self.default_period(table)
+        mask = (table["end_date"] == period).to_numpy()
+        for column, compare, value in parsed:
+            # 缺少数据（NaN）的股票不会被选中
+            values = table[column].to_numpy()
+            mask &= compare(values, value) & ~np.isnan(values)
+        for column, wanted in (("industry", industry), ("area", area), ("market", market)):
+            options = [v.strip() for v in wanted.split(",") if v.strip()]
+            if options:
+                mask &= table[column].isin(options).to_numpy()
+
+        result = table[mask].sort_values(sort_by, ascending=ascending, na_position="last", kind="stable")
+        offset = max(0, offset or 0)
+        result = result.iloc[offset:offset + limit] if limit and limit > 0 else result.iloc[offset:]
+        result = result.reset_index(drop=True)
+        return mark_stale(result, self.age) if self.age > self._ttl else result
+
+    def _path(self, period: str) -> Path:
+        return self._dir / f"income_{period}.parquet"
+
+    def _period_raw(self, period: str, refresh: bool) -> Optional[pd.DataFrame]:
+        """
+        某一报告期的原始数据
+
+        已过披露期且已保存的直接读盘；披露期内的报告期在保存后 ttl 内也直接读盘
+        （可能是其他 worker 刚拉取的），否则重新拉取并保存。
+        同一报告期有更正公告时按 statement_engine.latest_revisions 保留一条，与利润表工具一致。
+        """
+        path = self._path(period)
+        closed = disclosure_closed(period)
+        if period in self._raw and not (refresh and not closed):
+            return self._raw[period]
+        with file_lock(path):
+            try:
+                synced_at = path.stat().st_mtime
+                if closed or time.time() - synced_at < self._ttl:
+                    # 旧版本保存的文件可能按其他顺序去重过，读盘后再统一一次
+                    df = latest_revisions(pd.read_parquet(path))
+                    self._synced[period] = synced_at
+                    return df
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"[screen] failed to read {path}, refetching: {e}", file=sys.stderr)
+
+            df = self._bulk_fetch(period=period, report_type="1", fields=SCREEN_FIELDS)
+            if df is None or df.empty:
+                return None
+            self._synced[period] = time.time()
+            df = latest_revisions(df)
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = path.with_suffix(".tmp")
+                df.to_parquet(tmp, index=False)
+                os.replace(tmp, path)
+            except Exception as e:
+                print(f"[screen] failed to persist {path}: {e}", file=sys.stderr)
+            return df
+
+    def _build(self, refresh: bool = False):
+        raw = {}
+        for period in recent_periods(self._periods):
+            df = self._period_raw(period, refresh)
+            if df is not None:
+                raw[period] = df
+        frames = [df for df in raw.values() if not df.empty]
+        if not frames:
+            raise ValueError("未获取到任何报告期的利润表数据")
+
+        ratios = compute_ratios(pd.concat(frames, ignore_index=True))
+        profiles = self._universe.listed().set_index("ts_code")
+        profiles = profiles.reindex(ratios["ts_code"])[PROFILE_COLUMNS].reset_index(drop=True)
+        table = pd.concat([ratios[["ts_code"]], profiles, ratios.drop(columns=["ts_code"])], axis=1)
+        # 只保留上市状态的股票
+        table = table[table["name"].notna()].reset_index(drop=True)
+
+        rebuilt = self._table is not None
+        self._raw, self._table = raw, table
+        # 披露期内的报告期可能读自较早保存的文件，比率表的年龄从其中最早的一期算起
+        now = time.time()
+        oldest = min((self._synced.get(p, now) for p in raw if not disclosure_closed(p)), default=now)
+        self._built_at = time.monotonic() - max(0.0, now - oldest)
+        if rebuilt:
+            changed(str(self._dir))
+        print(f"[screen] ratio table built: {len(table)} rows, {len(raw)} periods", file=sys.stderr)
+
+    def _refresh_in_background(self):
+        with self._refresh_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._background_refresh, name="ratio-screener-refresh", daemon=True).start()
+
+    def _background_refresh(self):
+        try:
+            self._build(refresh=True)
+        except Exception as e:
+            print(f"[screen] ratio table refresh failed, serving stale data: {e}", file=sys.stderr)
+            # 推迟下一次刷新，避免上游故障时每次调用都重试
+            self._next_refresh = time.monotonic() + REFRESH_RETRY_INTERVAL
+        finally:
+            with self._refresh_lock:
+                self._refreshing = False
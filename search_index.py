@@ -0,0 +1,144 @@
+"""
+股票搜索索引
+
+在缓存的股票列表上预先建立 n-gram（单字 + 双字）倒排索引，
+search_stocks 只需对少量候选做校验，不再逐列全量扫描。
+
+排序规则（数值越小越靠前）:
+    0 代码精确匹配（ts_code 或 symbol）
+    1 代码前缀匹配
+    2 名称 / 拼音首字母 / 代码子串匹配
+    3 行业 / 地区 / 市场匹配
+同一档内按匹配位置、名称长度、代码排序。
+"""
+import heapq
+from collections import defaultdict
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import pandas as pd
+
+RANK_EXACT_CODE = 0
+RANK_CODE_PREFIX = 1
+RANK_NAME = 2
+RANK_CATEGORY = 3
+
+CODE_FIELDS = ("ts_code", "symbol")
+NAME_FIELDS = ("name", "cnspell")
+CATEGORY_FIELDS = ("industry", "area", "market")
+
+
+def _grams(text: str) -> Set[str]:
+    """文本的全部单字和双字片段"""
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    return grams
+
+
+def _query_grams(keyword: str) -> Set[str]:
+    if len(keyword) == 1:
+        return {keyword}
+    return {keyword[i:i + 2] for i in range(len(keyword) - 1)}
+
+
+class _FieldIndex:
+    """单个字段的倒排索引，按去重后的取值建立（行业、地区只有百余个取值）"""
+
+    def __init__(self, series: pd.Series):
+        codes, uniques = pd.factorize(series.fillna("").astype(str).str.lower())
+        self.values: List[str] = list(uniques)
+        self.rows: List[List[int]] = [[] for _ in self.values]
+        for row, code in enumerate(codes):
+            if code >= 0:
+                self.rows[code].append(row)
+        self.grams: Dict[str, Set[int]] = defaultdict(set)
+        for value_id, value in enumerate(self.values):
+            for gram in _grams(value):
+                self.grams[gram].add(value_id)
+
+    def match(self, keyword: str) -> Iterator[Tuple[str, int, List[int]]]:
+        """返回 (取值, 匹配位置, 行号列表)"""
+        postings = []
+        for gram in _query_grams(keyword):
+            posting = self.grams.get(gram)
+            if not posting:
+                return
+            postings.append(posting)
+        postings.sort(key=len)
+        candidates = postings[0].intersection(*postings[1:])
+        for value_id in candidates:
+            value = self.values[value_id]
+            pos = value.find(keyword)
+            if pos >= 0:
+                yield value, pos, self.rows[value_id]
+
+
+class StockSearchIndex:
+    """
+    股票搜索索引
+
+    参数:
+        df: 股票列表，需包含 ts_code、symbol、name 列，
+            cnspell、industry、area、market 列可选
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df.reset_index(drop=True)
+        self._fields = {
+            field: _FieldIndex(self.df[field])
+            for field in CODE_FIELDS + NAME_FIELDS + CATEGORY_FIELDS
+            if field in self.df.columns
+        }
+        self._name_len = self.df["name"].fillna("").str.len().to_numpy()
+        self._codes = self.df["ts_code"].to_numpy()
+        self._exact: Dict[str, List[int]] = defaultdict(list)
+        for field in CODE_FIELDS:
+            for row, code in enumerate(self.df[field].fillna("").str.lower()):
+                self._exact[code].append(row)
+
+    def __len__(self) -> int:
+        return len(self.df)
+
+    def rank(self, keyword: str, limit: Optional[int] = None) -> List[int]:
+        """返回按相关度排序的匹配行号，limit 为空时返回全部"""
+        kw = (keyword or "").strip().lower()
+        if not kw:
+            return []
+
+        best: Dict[int, Tuple[int, int]] = {}
+
+        def offer(row: int, rank: int, pos: int):
+            current = best.get(row)
+            if current is None or (rank, pos) < current:
+                best[row] = (rank, pos)
+
+        for row in self._exact.get(kw, ()):
+            offer(row, RANK_EXACT_CODE, 0)
+        for field in CODE_FIELDS:
+            index = self._fields.get(field)
+            if index is None:
+                continue
+            for _, pos, rows in index.match(kw):
+                rank = RANK_CODE_PREFIX if pos == 0 else RANK_NAME
+                for row in rows:
+                    offer(row, rank, pos)
+        for fields, rank in ((NAME_FIELDS, RANK_NAME), (CATEGORY_FIELDS, RANK_CATEGORY)):
+            for field in fields:
+                index = self._fields.get(field)
+                if index is None:
+                    continue
+                for _, pos, rows in index.match(kw):
+                    for row in rows:
+                        offer(row, rank, pos)
+
+        def key(row: int):
+            return (*best[row], self._name_len[row], self._codes[row])
+
+        if limit:
+            return heapq.nsmallest(limit, best, key=key)
+        return sorted(best, key=key)
+
+    def search(self, keyword: str, limit: int = 50, offset: int = 0) -> pd.DataFrame:
+        """按相关度跳过前 offset 条后返回至多 limit 条匹配结果（limit <= 0 表示不限）"""
+        offset = max(0, offset or 0)
+        rows = self.rank(keyword, limit=offset + limit if limit and limit > 0 else None)
+        return self.df.iloc[rows[offset:]]
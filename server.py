@@ -1,70 +1,65 @@
-# --- begin: env-based tushare init (non-interactive friendly) ---
 import os
-
-def _init_tushare_from_env():
-    """
-    Initialize Tushare using env var TUSHARE_TOKEN (if provided).
-    This lets Smithery's scanner start without interactive prompts.
-    """
-    try:
-        import tushare as ts
-    except Exception as e:
-        print(f"[init] tushare import failed: {e}")
-        return
-
-    token = os.getenv("TUSHARE_TOKEN", "").strip()
-    if not token:
-        print("[init] TUSHARE_TOKEN not found; tools may return auth error if called")
-        return
-
-    try:
-        ts.set_token(token)
-        pro = ts.pro_api()
-        # Lightweight probe; don't raise if it fails
-        try:
-            pro.stock_basic(limit=1)
-            print("[init] Tushare token OK")
-        except Exception as pe:
-            print(f"[init] token set, probe failed (won't block): {pe}")
-    except Exception as e:
-        print(f"[init] failed to set Tushare token: {e}")
-
-# 调用一次，保证在无交互时也能完成初始化
-_init_tushare_from_env()
-# --- end: env-based tushare init ---
-import os
-from pathlib import Path
-from typing import Optional
-import tushare as ts
-from mcp.server.fastmcp import FastMCP, Context
-from dotenv import load_dotenv, set_key
+import sys
+import threading
+from typing import List, Optional
+from mcp.server.fastmcp import FastMCP
+import numpy as np
 import pandas as pd
 
+import service
+from frames import paginate, parse_fields, select_fields
+from memo import memoize, no_store
+from metrics import instrument, serve as serve_metrics
+from resilience import stale_age, stale_message
+from screener import RATIO_COLUMNS, parse_conditions
+from statement_engine import latest_revisions, revision_history
+from statement_store import INCOME_SUMMARY_FIELDS
+from tracing import record_exception, traced
+
 # 创建MCP服务器实例
 mcp = FastMCP("Tushare Stock Info")
 
-# 环境变量文件路径
-ENV_FILE = Path.home() / ".tushare_mcp" / ".env"
-
-def init_env_file():
-    """初始化环境变量文件"""
-    ENV_FILE.parent.mkdir(parents=True, exist_ok=True)
-    if not ENV_FILE.exists():
-        ENV_FILE.touch()
-    load_dotenv(ENV_FILE)
+# 同一进程同时提供 HTTP 服务的端口（0 表示不启用），与 stdio 共享租户和缓存
+HTTP_PORT = int(os.getenv("TUSHARE_HTTP_PORT", "0"))
 
 def get_tushare_token() -> Optional[str]:
     """获取Tushare token"""
-    init_env_file()
-    return os.getenv("TUSHARE_TOKEN")
+    return service.default_token()
 
 def set_tushare_token(token: str):
     """设置Tushare token"""
-    init_env_file()
-    set_key(ENV_FILE, "TUSHARE_TOKEN", token)
-    # 初始化tushare
+    service.set_token(token)
+    # 同步到tushare SDK自身的配置（ts.pro_bar 等辅助函数使用）
+    import tushare as ts
     ts.set_token(token)
 
+def stale_note(df: pd.DataFrame) -> str:
+    """数据来自过期缓存时附在结果末尾的提示，数据最新时为空"""
+    age = stale_age(df)
+    return f"\n\n（提示：{stale_message(age)}）" if age is not None else ""
+
+def failure(prefix: str, e: Exception) -> str:
+    """工具的错误信息，附带请求 ID（异常类型和堆栈记录在追踪中，见 tracing）；错误结果不缓存"""
+    no_store()
+    request_id = record_exception(e)
+    return f"{prefix}：{str(e)}" + (f"（请求 ID：{request_id}）" if request_id else "")
+
+def serve_http(port: int):
+    """
+    在后台线程中同时提供 HTTP 传输（app_http.app）
+
+    两个入口共用 service 模块中的租户表，stdio 会话预热的缓存 HTTP 请求可以直接使用。
+    stdout 是 stdio 会话的协议通道，uvicorn 的日志只输出到 stderr。
+    """
+    import uvicorn
+    from app_http import app
+
+    config = uvicorn.Config(app, host="0.0.0.0", port=port, log_level="warning", access_log=False, log_config=None)
+    # 非主线程中 uvicorn 不接管信号，退出由 stdio 会话决定
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, name="http-server", daemon=True).start()
+    print(f"[init] HTTP transport on port {port}", file=sys.stderr)
+
 @mcp.prompt()
 def configure_token() -> str:
     """配置Tushare token的提示模板"""
@@ -75,49 +70,63 @@ def configure_token() -> str:
 请输入您的token:"""
 
 @mcp.tool()
+@instrument
 def setup_tushare_token(token: str) -> str:
     """设置Tushare API token"""
     try:
         set_tushare_token(token)
         # 测试token是否有效
-        ts.pro_api()
+        ok, error = service.check_token(service.tenant())
+        if not ok:
+            return f"Token配置失败：{error}"
         return "Token配置成功！您现在可以使用Tushare的API功能了。"
     except Exception as e:
-        return f"Token配置失败：{str(e)}"
+        return failure("Token配置失败", e)
 
 @mcp.tool()
+@instrument
 def check_token_status() -> str:
     """检查Tushare token状态"""
     token = get_tushare_token()
     if not token:
         return "未配置Tushare token。请使用configure_token提示来设置您的token。"
-    try:
-        ts.pro_api()
-        return "Token配置正常，可以使用Tushare API。"
-    except Exception as e:
-        return f"Token无效或已过期：{str(e)}"
+    ok, error = service.check_token(service.tenant())
+    if not ok:
+        return f"Token无效或已过期：{error}"
+    return "Token配置正常，可以使用Tushare API。"
+
+# get_stock_basic_info 默认显示的字段（与 stock_basic 默认输出一致）
+BASIC_INFO_DEFAULT_FIELDS = "area,industry,market,list_date"
 
 @mcp.tool()
-def get_stock_basic_info(ts_code: str = "", name: str = "") -> str:
+@instrument
+def get_stock_basic_info(
+    ts_code: str = "",
+    name: str = "",
+    exchange: str = "",
+    list_status: str = "",
+    fields: str = "",
+    limit: int = 100,
+    offset: int = 0
+) -> str:
     """
     获取股票基本信息
     
     参数:
         ts_code: 股票代码（如：000001.SZ）
-        name: 股票名称（如：平安银行）
+        name: 股票名称（如：平安银行），模糊匹配
+        exchange: 交易所代码（SSE=上交所, SZSE=深交所, BSE=北交所）
+        list_status: 上市状态（L=上市, D=退市, P=暂停上市；默认L）
+        fields: 显示字段，逗号分隔（可选：area,industry,list_date,market,exchange,curr_type,list_status,delist_date；默认area,industry,market,list_date）
+        limit: 返回数量上限（默认100，0表示不限）
+        offset: 跳过前若干条结果，用于翻页
     """
     if not get_tushare_token():
         return "请先配置Tushare token"
     
     try:
-        pro = ts.pro_api()
-        filters = {}
-        if ts_code:
-            filters['ts_code'] = ts_code
-        if name:
-            filters['name'] = name
-            
-        df = pro.stock_basic(**filters)
+        df = service.stock_basic(service.tenant(), ts_code, name, exchange, list_status)
+        df = select_fields(paginate(df, limit, offset), fields, BASIC_INFO_DEFAULT_FIELDS, keep=('ts_code', 'name'))
         if df.empty:
             return "未找到符合条件的股票"
             
@@ -156,44 +165,138 @@ def get_stock_basic_info(ts_code: str = "", name: str = "") -> str:
             info += "\n------------------------"
             result.append(info)
             
-        return "\n".join(result)
+        return "\n".join(result) + stale_note(df)
         
     except Exception as e:
-        return f"查询失败：{str(e)}"
+        return failure("查询失败", e)
 
 @mcp.tool()
-def search_stocks(keyword: str) -> str:
+@instrument
+def search_stocks(keyword: str, limit: int = 50, offset: int = 0, fields: str = "") -> str:
     """
     搜索股票
     
     参数:
-        keyword: 关键词（可以是股票代码的一部分或股票名称的一部分）
+        keyword: 关键词（可以是股票代码、股票名称、拼音首字母、行业或地区的一部分）
+        limit: 返回结果数量上限（默认50，按匹配度排序：代码精确匹配 > 代码前缀 > 名称 > 行业/地区）
+        offset: 跳过前若干条结果，用于翻页
+        fields: 代码和名称之外附加显示的字段，逗号分隔（如：industry,area）
     """
     if not get_tushare_token():
         return "请先配置Tushare token"
     
     try:
-        pro = ts.pro_api()
-        df = pro.stock_basic()
-        
-        # 在代码和名称中搜索关键词
-        mask = (df['ts_code'].str.contains(keyword, case=False)) | \
-               (df['name'].str.contains(keyword, case=False))
-        results = df[mask]
+        results = service.search(service.tenant(), keyword, limit=limit, offset=offset)
         
         if results.empty:
             return "未找到符合条件的股票"
             
         # 格式化输出
-        output = []
-        for _, row in results.iterrows():
-            output.append(f"{row['ts_code']} - {row['name']}")
+        output = (results['ts_code'] + " - " + results['name']).tolist()
+        extra = [f for f in parse_fields(fields) if f in results.columns and f not in ('ts_code', 'name')]
+        if extra:
+            details = results[extra].fillna("").astype(str).agg(" | ".join, axis=1)
+            output = [f"{line} | {detail}" for line, detail in zip(output, details)]
             
-        return "\n".join(output)
+        return "\n".join(output) + stale_note(results)
         
     except Exception as e:
-        return f"搜索失败：{str(e)}"
+        return failure("搜索失败", e)
+
+# 利润表分析展示的指标
+INCOME_METRICS = {
+    'total_revenue': '营业总收入',
+    'revenue': '营业收入',
+    'total_cogs': '营业总成本',
+    'oper_cost': '营业成本',
+    'sell_exp': '销售费用',
+    'admin_exp': '管理费用',
+    'fin_exp': '财务费用',
+    'operate_profit': '营业利润',
+    'total_profit': '利润总额',
+    'n_income': '净利润',
+    'basic_eps': '每股收益'
+}
+
+QUARTER_LABELS = {'03': 'Q1', '06': 'Q2', '09': 'Q3', '12': 'Q4'}
+
+# 报表类型（report_type）的说明
+REPORT_TYPES = {
+    "1": "合并报表",
+    "2": "单季合并",
+    "3": "调整单季合并表",
+    "4": "调整合并报表",
+    "5": "调整前合并报表",
+    "6": "母公司报表",
+    "7": "母公司单季表",
+    "8": "母公司调整单季表",
+    "9": "母公司调整表",
+    "10": "母公司调整前报表",
+    "11": "母公司调整前合并报表",
+    "12": "母公司调整前报表"
+}
+
+# 金额单位：亿元
+AMOUNT_UNIT = 100000000
+
+# 单季报表类型，其余类型的利润表为年初至今的累计值
+QUARTERLY_REPORT_TYPES = ("2", "3", "7", "8")
+
+def _growth(values: pd.DataFrame, offset) -> pd.Series:
+    """
+    最新一期相对 (报告期 - offset) 那一期的变动率（%）
+    
+    缺少对比期或对比期为0时为NaN
+    """
+    base = values.reindex(values.index - offset).to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change = (values.to_numpy() - base) / np.abs(base) * 100
+    change[~np.isfinite(change)] = np.nan
+    return pd.Series(change[-1], index=values.columns)
+
+def _single_quarter(values: pd.DataFrame) -> pd.DataFrame:
+    """
+    累计值（年初至今）→ 单季值：一季度即累计值，其余季度减去同一年上一季度的累计值
+
+    缺少上一季度时为NaN
+    """
+    previous = values.reindex(values.index - pd.offsets.QuarterEnd(1)).to_numpy()
+    previous[values.index.month == 3] = 0
+    return pd.DataFrame(values.to_numpy() - previous, index=values.index, columns=values.columns)
+
+@traced
+def _period_table(df: pd.DataFrame, metrics: dict, units: Optional[dict] = None) -> str:
+    """
+    指标 x 报告期的表格
+    
+    参数:
+        df: 按报告期升序排列的报表数据
+        metrics: 字段 → 显示名称
+        units: 不换算为亿元的字段 → 单位后缀（如比率为 %，每股指标为空）
+    """
+    units = units or {}
+    end_date = df['end_date'].astype(str)
+    
+    # 报告期标签，如 2023Q4
+    period = end_date.str[:4] + end_date.str[4:6].map(QUARTER_LABELS)
+    
+    # 指标矩阵（期数 x 指标），金额统一换算为亿元
+    values = df.reindex(columns=list(metrics)).apply(pd.to_numeric, errors='coerce')
+    is_amount = np.array([column not in units for column in values.columns])
+    scaled = values.to_numpy(dtype=float) / np.where(is_amount, AMOUNT_UNIT, 1)
+    suffix = np.array([units.get(column, '亿') for column in values.columns])
+    cells = np.char.add(np.char.mod('%.2f', scaled), suffix)
+    cells = np.where(np.isnan(scaled), '-', cells)
+    
+    header = ["项目"] + period.tolist()
+    table = []
+    table.append(" | ".join([f"{col:^12}" for col in header]))
+    table.append("-" * (14 * len(header)))
+    for name, row in zip(metrics.values(), cells.T):
+        table.append(" | ".join([f"{col:^12}" for col in [name, *row]]))
+    return "\n".join(table)
 
+@traced
 def format_income_statement_analysis(df: pd.DataFrame) -> str:
     """
     格式化利润表分析输出
@@ -206,148 +309,77 @@ def format_income_statement_analysis(df: pd.DataFrame) -> str:
         
     # 按照报告期末排序
     df = df.sort_values('end_date')
-    
-    # 提取年份和季度信息
-    df['year'] = df['end_date'].str[:4]
-    df['quarter'] = df['end_date'].str[4:6].map({'03': 'Q1', '06': 'Q2', '09': 'Q3', '12': 'Q4'})
-    df['period'] = df['year'] + df['quarter']
-    
-    # 准备表头
-    header = ["项目"] + df['period'].tolist()
-    
-    # 准备数据行
-    rows = []
-    metrics = {
-        'total_revenue': '营业总收入',
-        'revenue': '营业收入',
-        'total_cogs': '营业总成本',
-        'oper_cost': '营业成本',
-        'sell_exp': '销售费用',
-        'admin_exp': '管理费用',
-        'fin_exp': '财务费用',
-        'operate_profit': '营业利润',
-        'total_profit': '利润总额',
-        'n_income': '净利润',
-        'basic_eps': '每股收益'
-    }
-    
-    for key, name in metrics.items():
-        row = [name]
-        for _, period_data in df.iterrows():
-            value = period_data[key]
-            # 格式化数值（单位：亿元）
-            if key != 'basic_eps':
-                value = f"{float(value)/100000000:.2f}亿" if pd.notna(value) else '-'
-            else:
-                value = f"{float(value):.2f}" if pd.notna(value) else '-'
-            row.append(value)
-        rows.append(row)
-    
-    # 生成表格
-    table = []
-    table.append(" | ".join([f"{col:^12}" for col in header]))
-    table.append("-" * (14 * len(header)))
-    for row in rows:
-        table.append(" | ".join([f"{col:^12}" for col in row]))
-    
-    # 计算同比增长率
-    def calc_yoy(series):
-        if len(series) >= 2:
-            return (series.iloc[-1] - series.iloc[-2]) / abs(series.iloc[-2]) * 100
-        return None
-    
-    # 计算环比增长率
-    def calc_qoq(series):
-        if len(series) >= 2:
-            return (series.iloc[-1] - series.iloc[-2]) / abs(series.iloc[-2]) * 100
-        return None
+    end_date = df['end_date'].astype(str)
+    table = _period_table(df, INCOME_METRICS, {'basic_eps': ''})
+    values = df.reindex(columns=list(INCOME_METRICS)).apply(pd.to_numeric, errors='coerce')
+    
+    # 按报告期索引，用于计算同比（上年同期）和环比（上一季度）
+    series = values.set_axis(pd.to_datetime(end_date, format='%Y%m%d'))
+    series = series[~series.index.duplicated(keep='last')]
+    yoy = _growth(series, pd.DateOffset(years=1))
+    # 累计值的相邻两期跨度不同（如一季度对上年全年），环比先换算为单季值
+    report_type = str(df['report_type'].iloc[-1]) if 'report_type' in df.columns else '1'
+    quarterly = series if report_type in QUARTERLY_REPORT_TYPES else _single_quarter(series)
+    qoq = _growth(quarterly, pd.offsets.QuarterEnd(1))
+    latest = series.iloc[-1]
     
     # 生成分析报告
     analysis = []
     analysis.append("\n📊 财务分析报告")
     analysis.append("=" * 50)
     
+    def append_growth(prefix, label, value):
+        if pd.notna(value):
+            analysis.append(f"{prefix}{label}：{value:+.2f}%")
+    
     # 1. 收入分析
     analysis.append("\n一、收入分析")
     analysis.append("-" * 20)
     
     # 1.1 营收规模与增长
-    revenue_yoy = calc_yoy(df['total_revenue'])
-    revenue_qoq = calc_qoq(df['total_revenue'])
-    latest_revenue = float(df.iloc[-1]['total_revenue'])/100000000
-    
     analysis.append("1. 营收规模与增长：")
-    analysis.append(f"   • 当期营收：{latest_revenue:.2f}亿元")
-    if revenue_yoy is not None:
-        analysis.append(f"   • 同比变动：{revenue_yoy:+.2f}%")
-    if revenue_qoq is not None:
-        analysis.append(f"   • 环比变动：{revenue_qoq:+.2f}%")
+    analysis.append(f"   • 当期营收：{latest['total_revenue']/AMOUNT_UNIT:.2f}亿元")
+    append_growth("   • ", "同比变动", yoy['total_revenue'])
+    append_growth("   • ", "单季环比变动", qoq['total_revenue'])
     
     # 2. 盈利能力分析
     analysis.append("\n二、盈利能力分析")
     analysis.append("-" * 20)
     
     # 2.1 利润规模与增长
-    latest = df.iloc[-1]
-    profit_yoy = calc_yoy(df['n_income'])
-    profit_qoq = calc_qoq(df['n_income'])
-    latest_profit = float(latest['n_income'])/100000000
-    
     analysis.append("1. 利润规模与增长：")
-    analysis.append(f"   • 当期净利润：{latest_profit:.2f}亿元")
-    if profit_yoy is not None:
-        analysis.append(f"   • 同比变动：{profit_yoy:+.2f}%")
-    if profit_qoq is not None:
-        analysis.append(f"   • 环比变动：{profit_qoq:+.2f}%")
+    analysis.append(f"   • 当期净利润：{latest['n_income']/AMOUNT_UNIT:.2f}亿元")
+    append_growth("   • ", "同比变动", yoy['n_income'])
+    append_growth("   • ", "单季环比变动", qoq['n_income'])
     
-    # 2.2 盈利能力指标
-    gross_margin = ((latest['total_revenue'] - latest['oper_cost']) / latest['total_revenue']) * 100
-    operating_margin = (latest['operate_profit'] / latest['total_revenue']) * 100
-    net_margin = (latest['n_income'] / latest['total_revenue']) * 100
+    # 2.2 盈利能力指标（占营收比，一次计算）
+    ratios = latest / latest['total_revenue'] * 100
+    gross_margin = 100 - ratios['oper_cost']
     
     analysis.append("\n2. 盈利能力指标：")
     analysis.append(f"   • 毛利率：{gross_margin:.2f}%")
-    analysis.append(f"   • 营业利润率：{operating_margin:.2f}%")
-    analysis.append(f"   • 净利润率：{net_margin:.2f}%")
+    analysis.append(f"   • 营业利润率：{ratios['operate_profit']:.2f}%")
+    analysis.append(f"   • 净利润率：{ratios['n_income']:.2f}%")
     
     # 3. 成本费用分析
     analysis.append("\n三、成本费用分析")
     analysis.append("-" * 20)
     
     # 3.1 成本费用结构
-    total_revenue = float(latest['total_revenue'])
-    cost_structure = {
-        '营业成本': (latest['oper_cost'] / total_revenue) * 100,
-        '销售费用': (latest['sell_exp'] / total_revenue) * 100,
-        '管理费用': (latest['admin_exp'] / total_revenue) * 100,
-        '财务费用': (latest['fin_exp'] / total_revenue) * 100
-    }
-    
     analysis.append("1. 成本费用结构（占营收比）：")
-    for item, ratio in cost_structure.items():
-        analysis.append(f"   • {item}率：{ratio:.2f}%")
+    for key in ['oper_cost', 'sell_exp', 'admin_exp', 'fin_exp']:
+        analysis.append(f"   • {INCOME_METRICS[key]}率：{ratios[key]:.2f}%")
     
     # 3.2 费用变动分析
     analysis.append("\n2. 主要费用同比变动：")
-    expense_items = {
-        '销售费用': ('sell_exp', calc_yoy(df['sell_exp'])),
-        '管理费用': ('admin_exp', calc_yoy(df['admin_exp'])),
-        '财务费用': ('fin_exp', calc_yoy(df['fin_exp']))
-    }
-    
-    for name, (_, yoy) in expense_items.items():
-        if yoy is not None:
-            analysis.append(f"   • {name}：{yoy:+.2f}%")
+    for key in ['sell_exp', 'admin_exp', 'fin_exp']:
+        append_growth("   • ", INCOME_METRICS[key], yoy[key])
     
     # 4. 每股指标
     analysis.append("\n四、每股指标")
     analysis.append("-" * 20)
-    latest_eps = float(latest['basic_eps'])
-    eps_yoy = calc_yoy(df['basic_eps'])
-    
-    analysis.append(f"• 基本每股收益：{latest_eps:.4f}元")
-    if eps_yoy is not None:
-        analysis.append(f"• 同比变动：{eps_yoy:+.2f}%")
+    analysis.append(f"• 基本每股收益：{latest['basic_eps']:.4f}元")
+    append_growth("• ", "同比变动", yoy['basic_eps'])
     
     # 5. 风险提示
     analysis.append("\n⚠️ 风险提示")
@@ -358,75 +390,455 @@ def format_income_statement_analysis(df: pd.DataFrame) -> str:
     analysis.append("• 宏观经济环境")
     analysis.append("• 政策法规变化")
     
-    return "\n".join(table) + "\n\n" + "\n".join(analysis)
+    return table + "\n\n" + "\n".join(analysis)
+
+@traced
+def format_revisions(history: pd.DataFrame) -> str:
+    """更正记录：同一报告期各次披露的主要指标"""
+    if history.empty:
+        return "\n\n📝 更正记录：所选报告期没有更正"
+    columns = ['end_date', 'ann_date', 'f_ann_date', 'update_flag', 'total_revenue', 'n_income', 'basic_eps']
+    shown = history.reindex(columns=columns)
+    for column in ('total_revenue', 'n_income'):
+        shown[column] = (pd.to_numeric(shown[column], errors='coerce') / AMOUNT_UNIT).map(
+            lambda v: f"{v:.2f}亿" if pd.notna(v) else '-')
+    shown.columns = ['报告期', '公告日期', '实际公告日期', '更新标识', '营业总收入', '净利润', '每股收益']
+    return f"\n\n📝 更正记录（{history['end_date'].nunique()} 个报告期有更正，更新标识为1的是最新数据）：\n" + shown.to_string(index=False)
 
 @mcp.tool()
+@instrument
+@memoize(service.memo_scope, 'stdio')
 def get_income_statement(
     ts_code: str,
+    period: str = "",
     start_date: str = "",
     end_date: str = "",
-    report_type: str = "1"
+    report_type: str = "1",
+    limit: int = 0,
+    revisions: bool = False
 ) -> str:
     """
     获取利润表数据
     
     参数:
         ts_code: 股票代码（如：000001.SZ）
-        start_date: 开始日期（YYYYMMDD格式，如：20230101）
-        end_date: 结束日期（YYYYMMDD格式，如：20231231）
+        period: 报告期（YYYYMMDD格式，如：20231231），指定后只分析该期
+        start_date: 公告开始日期（YYYYMMDD格式，如：20230101）
+        end_date: 公告结束日期（YYYYMMDD格式，如：20231231）
         report_type: 报告类型（1合并报表；2单季合并；3调整单季合并表；4调整合并报表；5调整前合并报表；6母公司报表；7母公司单季表；8母公司调整单季表；9母公司调整表；10母公司调整前报表；11母公司调整前合并报表；12母公司调整前报表）
+        limit: 只分析最近若干期（默认0表示全部）
+        revisions: 是否附带更正记录（同一报告期的原始报告和更正报告），分析始终使用最新更正
     """
     if not get_tushare_token():
         return "请先配置Tushare token"
     
     try:
-        pro = ts.pro_api()
-        # 获取股票名称
-        stock_info = pro.stock_basic(ts_code=ts_code)
-        stock_name = stock_info.iloc[0]['name'] if not stock_info.empty else ts_code
-        
-        params = {
-            'ts_code': ts_code,
-            'fields': 'ts_code,ann_date,f_ann_date,end_date,report_type,comp_type,basic_eps,diluted_eps,total_revenue,revenue,int_income,prem_earned,comm_income,n_commis_income,n_oth_income,n_oth_b_income,prem_income,out_prem,une_prem_reser,reins_income,n_sec_tb_income,n_sec_uw_income,n_asset_mg_income,oth_b_income,fv_value_chg_gain,invest_income,ass_invest_income,forex_gain,total_cogs,oper_cost,int_exp,comm_exp,biz_tax_surchg,sell_exp,admin_exp,fin_exp,assets_impair_loss,prem_refund,compens_payout,reser_insur_liab,div_payt,reins_exp,oper_exp,compens_payout_refu,insur_reser_refu,reins_cost_refund,other_bus_cost,operate_profit,non_oper_income,non_oper_exp,nca_disploss,total_profit,income_tax,n_income,n_income_attr_p,minority_gain,oth_compr_income,t_compr_income,compr_inc_attr_p,compr_inc_attr_m_s,ebit,ebitda,insurance_exp,undist_profit,distable_profit,update_flag'
-        }
+        tenant = service.tenant()
         
-        if start_date:
-            params['start_date'] = start_date
-        if end_date:
-            params['end_date'] = end_date
+        # 获取股票名称（从缓存读取）
+        stock_name = service.stock_name(tenant, ts_code)
         
-        df = pro.income(**params)
+        # 从本地存储读取全部历史，按报告期和公告日期筛选；每个报告期只保留最新更正
+        history = service.income_statement(tenant, ts_code, report_type, period, start_date, end_date, revisions=True)
+        df = latest_revisions(history)
+        # 存储按报告期倒序排列，只保留分析用到的列
+        df = select_fields(paginate(df, limit), ",".join(INCOME_METRICS), keep=('ts_code', 'end_date'))
         
         if df.empty:
             return "未找到符合条件的利润表数据"
             
         # 获取报表类型描述
-        report_types = {
-            "1": "合并报表",
-            "2": "单季合并",
-            "3": "调整单季合并表",
-            "4": "调整合并报表",
-            "5": "调整前合并报表",
-            "6": "母公司报表",
-            "7": "母公司单季表",
-            "8": "母公司调整单季表",
-            "9": "母公司调整表",
-            "10": "母公司调整前报表",
-            "11": "母公司调整前合并报表",
-            "12": "母公司调整前报表"
-        }
-        report_type_desc = report_types.get(report_type, "未知类型")
+        report_type_desc = REPORT_TYPES.get(report_type, "未知类型")
         
         # 构建输出标题
         title = f"我查询到了 {stock_name}（{ts_code}）的{report_type_desc}利润数据，如下呈现：\n\n"
         
         # 格式化数据并生成分析
         result = format_income_statement_analysis(df)
+        if revisions:
+            result += format_revisions(revision_history(history[history['end_date'].isin(df['end_date'])]))
+        
+        return title + result + stale_note(df)
+        
+    except Exception as e:
+        return failure("查询失败", e)
+
+@mcp.tool()
+@instrument
+@memoize(service.memo_scope, 'stdio')
+def get_income_statements_batch(
+    ts_codes: List[str],
+    period: str = "",
+    start_date: str = "",
+    end_date: str = "",
+    report_type: str = "1",
+    fields: str = "",
+    limit: int = 0,
+    offset: int = 0
+) -> str:
+    """
+    批量获取多只股票的利润表数据，合并为一张表便于横向对比
+    
+    参数:
+        ts_codes: 股票代码列表（如：["000001.SZ", "600000.SH"]）
+        period: 报告期（YYYYMMDD格式，如：20231231），指定后每只股票只返回该期数据
+        start_date: 公告开始日期（YYYYMMDD格式，如：20230101）
+        end_date: 公告结束日期（YYYYMMDD格式，如：20231231）
+        report_type: 报告类型（同get_income_statement，默认1合并报表）
+        fields: 返回字段，逗号分隔（默认：营业收入、营业利润、净利润、每股收益等主要指标）
+        limit: 返回记录数上限（默认0表示不限）
+        offset: 跳过前若干条记录，用于翻页
+    """
+    if not get_tushare_token():
+        return "请先配置Tushare token"
+    if not ts_codes:
+        return "请至少提供一个股票代码"
+    
+    try:
+        tenant = service.tenant()
+        df, errors = service.income_statements(tenant, ts_codes, report_type, period, start_date, end_date, fields)
+        
+        output = []
+        if df.empty:
+            output.append("未找到符合条件的利润表数据")
+        else:
+            df = select_fields(paginate(df, limit, offset), fields, INCOME_SUMMARY_FIELDS, keep=('ts_code', 'end_date'))
+            df.insert(1, 'name', df['ts_code'].map(service.stock_names(tenant)))
+            output.append(f"共 {df['ts_code'].nunique()} 只股票、{len(df)} 条利润表记录：\n")
+            output.append(df.to_string(index=False))
+        
+        if errors:
+            output.append("\n以下股票查询失败：")
+            output.extend(f"• {code}：{error}" for code, error in errors.items())
+        
+        return "\n".join(output) + stale_note(df)
+        
+    except Exception as e:
+        return failure("查询失败", e)
+
+# 资产负债表展示的指标
+BALANCE_METRICS = {
+    'money_cap': '货币资金',
+    'accounts_receiv': '应收账款',
+    'inventories': '存货',
+    'total_cur_assets': '流动资产合计',
+    'fix_assets': '固定资产',
+    'goodwill': '商誉',
+    'total_assets': '资产总计',
+    'st_borr': '短期借款',
+    'total_cur_liab': '流动负债合计',
+    'lt_borr': '长期借款',
+    'total_liab': '负债合计',
+    'total_hldr_eqy_exc_min_int': '归母股东权益',
+    'total_hldr_eqy_inc_min_int': '股东权益合计'
+}
+
+# 现金流量表展示的指标
+CASHFLOW_METRICS = {
+    'c_fr_sale_sg': '销售商品收到现金',
+    'n_cashflow_act': '经营活动现金流净额',
+    'c_pay_acq_const_fiolta': '购建长期资产支付现金',
+    'n_cashflow_inv_act': '投资活动现金流净额',
+    'n_cash_flows_fnc_act': '筹资活动现金流净额',
+    'n_incr_cash_cash_equ': '现金净增加额',
+    'c_cash_equ_end_period': '期末现金余额',
+    'free_cashflow': '企业自由现金流'
+}
+
+# 财务指标展示的指标，均不换算单位
+INDICATOR_METRICS = {
+    'eps': '每股收益',
+    'bps': '每股净资产',
+    'ocfps': '每股经营现金流',
+    'roe': '净资产收益率',
+    'roa': '总资产报酬率',
+    'grossprofit_margin': '毛利率',
+    'netprofit_margin': '净利率',
+    'debt_to_assets': '资产负债率',
+    'current_ratio': '流动比率',
+    'quick_ratio': '速动比率',
+    'assets_turn': '总资产周转率',
+    'or_yoy': '营收同比',
+    'netprofit_yoy': '净利润同比'
+}
+INDICATOR_UNITS = {
+    column: ('' if column in ('eps', 'bps', 'ocfps', 'current_ratio', 'quick_ratio', 'assets_turn') else '%')
+    for column in INDICATOR_METRICS
+}
+
+# 综合财务分析展示的基础指标和派生指标（派生指标说明见 statement_engine.DERIVED_COLUMNS）
+FUNDAMENTAL_METRICS = {
+    'total_revenue': '营业总收入',
+    'n_income_attr_p': '归母净利润',
+    'total_assets': '资产总计',
+    'total_hldr_eqy_exc_min_int': '归母股东权益',
+    'n_cashflow_act': '经营现金流',
+    'fcf': '自由现金流',
+    'roe_avg': 'ROE(平均)',
+    'roa_avg': 'ROA(平均)',
+    'gross_margin': '毛利率',
+    'net_margin': '净利润率',
+    'debt_ratio': '资产负债率',
+    'fcf_margin': '自由现金流率',
+    'cash_conversion': '现金含量',
+    'accrual_ratio': '应计比率'
+}
+FUNDAMENTAL_UNITS = {
+    column: ('' if column == 'cash_conversion' else '%')
+    for column in list(FUNDAMENTAL_METRICS)[6:]
+}
+
+def _statement_report(endpoint: str, label: str, metrics: dict, units: Optional[dict],
+                      ts_code: str, period: str, start_date: str, end_date: str,
+                      report_type: str, limit: int) -> str:
+    """资产负债表、现金流量表和财务指标工具的公共部分"""
+    if not get_tushare_token():
+        return "请先配置Tushare token"
+    
+    try:
+        tenant = service.tenant()
+        stock_name = service.stock_name(tenant, ts_code)
+        df = service.statement(tenant, endpoint, ts_code, report_type, period, start_date, end_date)
+        df = paginate(df, limit)
+        if df.empty:
+            return f"未找到符合条件的{label}数据"
+        
+        kind = "" if endpoint == "fina_indicator" else REPORT_TYPES.get(report_type, "未知类型")
+        title = f"我查询到了 {stock_name}（{ts_code}）的{kind}{label}数据，如下呈现：\n\n"
+        return title + _period_table(df.sort_values('end_date'), metrics, units) + stale_note(df)
+        
+    except Exception as e:
+        return failure("查询失败", e)
+
+@mcp.tool()
+@instrument
+@memoize(service.memo_scope, 'stdio')
+def get_balance_sheet(
+    ts_code: str,
+    period: str = "",
+    start_date: str = "",
+    end_date: str = "",
+    report_type: str = "1",
+    limit: int = 8
+) -> str:
+    """
+    获取资产负债表数据（资产、负债、股东权益）
+    
+    参数:
+        ts_code: 股票代码（如：000001.SZ）
+        period: 报告期（YYYYMMDD格式，如：20231231）
+        start_date: 公告开始日期（YYYYMMDD格式，如：20230101）
+        end_date: 公告结束日期（YYYYMMDD格式，如：20231231）
+        report_type: 报告类型（同get_income_statement，默认1合并报表）
+        limit: 只显示最近若干期（默认8，0表示全部）
+    """
+    return _statement_report("balancesheet", "资产负债表", BALANCE_METRICS, None,
+                             ts_code, period, start_date, end_date, report_type, limit)
+
+@mcp.tool()
+@instrument
+@memoize(service.memo_scope, 'stdio')
+def get_cash_flow(
+    ts_code: str,
+    period: str = "",
+    start_date: str = "",
+    end_date: str = "",
+    report_type: str = "1",
+    limit: int = 8
+) -> str:
+    """
+    获取现金流量表数据（经营、投资、筹资活动现金流）
+    
+    参数:
+        ts_code: 股票代码（如：000001.SZ）
+        period: 报告期（YYYYMMDD格式，如：20231231）
+        start_date: 公告开始日期（YYYYMMDD格式，如：20230101）
+        end_date: 公告结束日期（YYYYMMDD格式，如：20231231）
+        report_type: 报告类型（同get_income_statement，默认1合并报表）
+        limit: 只显示最近若干期（默认8，0表示全部）
+    """
+    return _statement_report("cashflow", "现金流量表", CASHFLOW_METRICS, None,
+                             ts_code, period, start_date, end_date, report_type, limit)
+
+@mcp.tool()
+@instrument
+@memoize(service.memo_scope, 'stdio')
+def get_financial_indicators(
+    ts_code: str,
+    period: str = "",
+    start_date: str = "",
+    end_date: str = "",
+    limit: int = 8
+) -> str:
+    """
+    获取财务指标数据（每股指标、ROE、毛利率、资产负债率、周转率、增长率等）
+    
+    参数:
+        ts_code: 股票代码（如：000001.SZ）
+        period: 报告期（YYYYMMDD格式，如：20231231）
+        start_date: 公告开始日期（YYYYMMDD格式，如：20230101）
+        end_date: 公告结束日期（YYYYMMDD格式，如：20231231）
+        limit: 只显示最近若干期（默认8，0表示全部）
+    """
+    return _statement_report("fina_indicator", "财务指标", INDICATOR_METRICS, INDICATOR_UNITS,
+                             ts_code, period, start_date, end_date, "1", limit)
+
+@mcp.tool()
+@instrument
+@memoize(service.memo_scope, 'stdio')
+def get_fundamentals(
+    ts_code: str,
+    period: str = "",
+    start_date: str = "",
+    end_date: str = "",
+    report_type: str = "1",
+    limit: int = 8
+) -> str:
+    """
+    综合财务分析：合并利润表、资产负债表、现金流量表和财务指标，计算平均ROE/ROA、毛利率、
+    资产负债率、自由现金流、现金含量（经营现金流/净利润）和应计比率等派生指标
+    
+    参数:
+        ts_code: 股票代码（如：000001.SZ）
+        period: 报告期（YYYYMMDD格式，如：20231231）
+        start_date: 公告开始日期（YYYYMMDD格式，如：20230101）
+        end_date: 公告结束日期（YYYYMMDD格式，如：20231231）
+        report_type: 报告类型（同get_income_statement，默认1合并报表）
+        limit: 只显示最近若干期（默认8，0表示全部）
+    """
+    if not get_tushare_token():
+        return "请先配置Tushare token"
+    
+    try:
+        tenant = service.tenant()
+        stock_name = service.stock_name(tenant, ts_code)
+        df, errors = service.fundamentals(tenant, ts_code, report_type, period, start_date, end_date)
+        df = paginate(df, limit)
+        
+        output = []
+        if df.empty:
+            output.append("未找到符合条件的财务数据")
+        else:
+            output.append(f"我查询到了 {stock_name}（{ts_code}）的{REPORT_TYPES.get(report_type, '未知类型')}综合财务数据，如下呈现：\n")
+            output.append(_period_table(df.sort_values('end_date'), FUNDAMENTAL_METRICS, FUNDAMENTAL_UNITS))
+            output.append("\n说明：ROE、ROA 的分母为期初（上年末）与期末的平均值；金额为年初至报告期末累计，"
+                          "非年报期的收益率未年化；现金含量 = 经营现金流 / 净利润；"
+                          "应计比率 = (净利润 - 经营现金流) / 平均总资产。")
+        
+        if errors:
+            output.append("\n以下报表查询失败：")
+            output.extend(f"• {endpoint}：{error}" for endpoint, error in errors.items())
+        
+        return "\n".join(output) + stale_note(df)
+        
+    except Exception as e:
+        return failure("查询失败", e)
+
+# 复权方式的说明
+ADJ_LABELS = {'': '不复权', 'qfq': '前复权', 'hfq': '后复权'}
+
+@mcp.tool()
+@instrument
+@memoize(service.memo_scope, 'stdio')
+def get_daily_prices(
+    ts_code: str,
+    start_date: str = "",
+    end_date: str = "",
+    adj: str = "",
+    limit: int = 30
+) -> str:
+    """
+    获取股票日线行情，并统计区间涨跌幅、最高价、最低价
+    
+    参数:
+        ts_code: 股票代码（如：000001.SZ）
+        start_date: 开始交易日期（YYYYMMDD格式，如：20230101）
+        end_date: 结束交易日期（YYYYMMDD格式，如：20231231）
+        adj: 复权方式（留空不复权，qfq前复权，hfq后复权）
+        limit: 列出最近若干个交易日的明细（默认30，0表示全部；区间统计始终基于全部数据）
+    """
+    if not get_tushare_token():
+        return "请先配置Tushare token"
+    
+    try:
+        tenant = service.tenant()
+        df = service.daily_prices(tenant, ts_code, start_date, end_date, adj)
+        if df.empty:
+            return "未找到符合条件的行情数据"
+        
+        stock_name = service.stock_name(tenant, ts_code)
+        latest, first = df.iloc[0], df.iloc[-1]
+        output = [
+            f"{stock_name}（{df['ts_code'].iat[0]}）日线行情（{ADJ_LABELS.get(adj.strip().lower(), adj)}），"
+            f"{first['trade_date']} 至 {latest['trade_date']} 共 {len(df)} 个交易日：",
+            f"• 最新收盘价：{latest['close']:.2f}",
+            f"• 区间涨跌幅：{(latest['close'] / first['pre_close'] - 1) * 100:.2f}%",
+            f"• 区间最高价：{df['high'].max():.2f}（{df['trade_date'].iat[df['high'].to_numpy().argmax()]}）",
+            f"• 区间最低价：{df['low'].min():.2f}（{df['trade_date'].iat[df['low'].to_numpy().argmin()]}）",
+            "",
+            select_fields(paginate(df, limit), "open,high,low,close,pct_chg,vol", keep=('trade_date',)).to_string(index=False),
+        ]
+        return "\n".join(output) + stale_note(df)
+        
+    except Exception as e:
+        return failure("查询失败", e)
+
+# 选股结果中以亿元显示的金额字段
+SCREEN_AMOUNT_COLUMNS = ('total_revenue', 'n_income')
+
+@mcp.tool()
+@instrument
+@memoize(service.memo_scope, 'stdio')
+def screen_stocks(
+    conditions: str = "",
+    industry: str = "",
+    area: str = "",
+    market: str = "",
+    period: str = "",
+    sort_by: str = "",
+    ascending: bool = False,
+    limit: int = 20
+) -> str:
+    """
+    按财务比率在全市场选股，如"净利润率>20%且营收同比>30%的银行股，前20名"
+    
+    参数:
+        conditions: 筛选条件，逗号分隔，如 "net_margin>20, revenue_yoy>30"（比率和增速单位为%）；
+                    可用字段：gross_margin毛利率, operating_margin营业利润率, net_margin净利润率,
+                    oper_cost_ratio/sell_exp_ratio/admin_exp_ratio/fin_exp_ratio成本费用率,
+                    revenue_yoy营收同比, operate_profit_yoy营业利润同比, n_income_yoy净利润同比, eps_yoy每股收益同比,
+                    total_revenue营业总收入(元), n_income净利润(元), basic_eps每股收益
+        industry: 行业（多个用逗号分隔，如：银行,证券）
+        area: 地区（多个用逗号分隔）
+        market: 市场类型（如：主板,创业板,科创板）
+        period: 报告期（YYYYMMDD格式，默认为披露较完整的最新报告期）
+        sort_by: 排序字段（默认为第一个条件的字段，无条件时按营业总收入）
+        ascending: 是否升序（默认降序）
+        limit: 返回数量（默认20，0表示不限）
+    """
+    if not get_tushare_token():
+        return "请先配置Tushare token"
+    
+    try:
+        df = service.screen(service.tenant(), conditions, industry, area, market, period, sort_by, ascending, limit)
+        if df.empty:
+            return "未找到符合条件的股票"
+        
+        # 显示名称、行业以及条件、排序和主要比率字段
+        columns = [c for c, _, _ in parse_conditions(conditions)] + ([sort_by] if sort_by else [])
+        columns += ['total_revenue', 'n_income', 'gross_margin', 'net_margin', 'revenue_yoy', 'n_income_yoy']
+        shown = df[['ts_code', 'name', 'industry'] + list(dict.fromkeys(columns))].copy()
+        for column in shown.columns[3:]:
+            values = shown[column] / AMOUNT_UNIT if column in SCREEN_AMOUNT_COLUMNS else shown[column]
+            suffix = '亿' if column in SCREEN_AMOUNT_COLUMNS else ('' if column == 'basic_eps' else '%')
+            shown[column] = values.map(lambda v: f"{v:.2f}{suffix}" if pd.notna(v) else '-')
+        shown.columns = ['代码', '名称', '行业'] + [RATIO_COLUMNS[c] for c in shown.columns[3:]]
         
-        return title + result
+        title = f"报告期 {df['end_date'].iat[0]}，列出 {len(df)} 只符合条件的股票：\n"
+        return title + shown.to_string(index=False) + stale_note(df)
         
     except Exception as e:
-        return f"查询失败：{str(e)}"
+        return failure("选股失败", e)
 
 @mcp.prompt()
 def income_statement_query() -> str:
@@ -468,4 +880,11 @@ def income_statement_query() -> str:
 请告诉我您想查询的内容："""
 
 if __name__ == "__main__":
-    mcp.run() 
+    # 设置了 TUSHARE_METRICS_PORT 时在该端口提供 /metrics
+    serve_metrics()
+    # 探针在后台执行，不推迟 stdio 会话的建立
+    service.start_warmup()
+    # 设置了 TUSHARE_HTTP_PORT 时同一进程同时提供 HTTP 传输
+    if HTTP_PORT:
+        serve_http(HTTP_PORT)
+    mcp.run()
@@ -0,0 +1,296 @@
+"""
+数据服务层
+
+stdio（server.py）和 HTTP（app_http.py）两个入口共用的数据访问、缓存与转换：
+- token 来自环境变量 TUSHARE_TOKEN 或 ~/.tushare_mcp/.env（见 credentials.TokenSource），
+  作为默认租户；HTTP 请求还可以携带自己的 token（见 tenants）；
+- 每个租户的限流客户端、股票列表缓存、报表/行情存储和选股比率表保存在同一个
+  TenantRegistry 中，同一进程同时提供 stdio 和 HTTP 时两者共享这些缓存；
+- 每个工具对应一个查询函数，完成筛选并返回 DataFrame，
+  入口只负责参数、分页选列和输出格式（stdio 为中文文本，HTTP 为 JSON）；
+  查询函数在追踪中各记为一个 span（见 tracing.traced）。
+
+pandas 等较重的依赖随 tenants 模块在首次使用或后台预热时才导入。
+"""
+import os
+import sys
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, Iterable, Optional, Tuple
+
+from credentials import TokenSource
+from tracing import traced
+from warmup import WarmUp
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from prefetch import PrefetchScheduler
+    from tenants import Tenant, TenantRegistry
+
+# 环境变量文件路径
+ENV_FILE = Path.home() / ".tushare_mcp" / ".env"
+
+# 未指定 fields 时股票列表类查询返回的默认字段
+BASIC_INFO_FIELDS = (
+    "ts_code,symbol,name,area,industry,market,list_date,"
+    "fullname,enname,cnspell,list_status,exchange"
+)
+SEARCH_FIELDS = "ts_code,symbol,name,area,industry,market,list_date"
+
+_tokens: Optional[TokenSource] = None
+_registry: Optional["TenantRegistry"] = None
+_lock = threading.Lock()
+
+# 财报季预取调度（TUSHARE_PREFETCH_INTERVAL 为 0 时不启动）
+prefetcher: Optional["PrefetchScheduler"] = None
+
+# 后台预热（导入数据模块、探测 Tushare 连通性），两个入口共用
+warmup = WarmUp()
+
+
+class TokenNotConfigured(Exception):
+    """未配置 Tushare token"""
+
+
+def tokens() -> TokenSource:
+    """进程内共享的 token 来源，.env 被修改后自动重新加载"""
+    global _tokens
+    if _tokens is None:
+        with _lock:
+            if _tokens is None:
+                _tokens = TokenSource(ENV_FILE)
+    return _tokens
+
+
+def default_token() -> Optional[str]:
+    return tokens().get()
+
+
+def registry() -> "TenantRegistry":
+    """进程内共享的租户表，首次调用时导入数据模块"""
+    global _registry
+    if _registry is None:
+        source = tokens()
+        with _lock:
+            if _registry is None:
+                from tenants import TenantRegistry
+                _registry = TenantRegistry(source.get() or "")
+                # 默认 token 变化后换用新的租户（新的客户端和股票列表缓存）
+                source.subscribe(_registry.set_default)
+                if source.get():
+                    print("[init] Tushare token configured", file=sys.stderr)
+                else:
+                    print("[init] TUSHARE_TOKEN not set - tools will require configuration", file=sys.stderr)
+    return _registry
+
+
+def loaded_registry() -> Optional["TenantRegistry"]:
+    """已创建的租户表，尚未创建时为 None（不触发导入）"""
+    return _registry
+
+
+def tenant(token: Optional[str] = None) -> "Tenant":
+    """token 对应的租户，token 为空时为默认租户；都没有时抛出 TokenNotConfigured"""
+    reg = registry()
+    # 读取一次默认 token，.env 被修改时借此触发重新加载
+    default_token()
+    found = reg.get(token)
+    if found is None:
+        raise TokenNotConfigured("TUSHARE_TOKEN not configured")
+    return found
+
+
+def memo_scope(token: Optional[str] = None) -> Optional[str]:
+    """工具输出缓存（memo）的租户标识，未配置 token 时为 None（不缓存）"""
+    try:
+        return tenant(token).namespace
+    except TokenNotConfigured:
+        return None
+
+
+def set_token(token: str):
+    """写入 .env 并立即作为默认 token 生效"""
+    registry()
+    tokens().set(token)
+
+
+def probe():
+    """轻量级探针测试，在后台执行，失败不影响服务"""
+    if not default_token():
+        print("[init] TUSHARE_TOKEN not found; tools may return auth error if called", file=sys.stderr)
+        return
+    tenant().client.stock_basic(limit=1)
+    print("[init] Tushare API connection OK", file=sys.stderr)
+
+
+def start_prefetch():
+    """按配置启动财报季预取调度，只预取默认租户；多 worker 部署时只在一个 worker 中运行"""
+    global prefetcher
+    from prefetch import PREFETCH_CODES, PREFETCH_INDEX, PREFETCH_INTERVAL, PrefetchScheduler, parse_codes
+    from statement_store import DATA_DIR
+    from workers import hold_lock
+    if prefetcher is not None or PREFETCH_INTERVAL <= 0:
+        return
+    if not hold_lock(DATA_DIR / "prefetch"):
+        print(f"[prefetch] another worker is running the scheduler, skipping in pid {os.getpid()}", file=sys.stderr)
+        return
+    prefetcher = PrefetchScheduler(lambda: registry().get(default_token()), parse_codes(PREFETCH_CODES), parse_codes(PREFETCH_INDEX))
+    prefetcher.start()
+
+
+def start_warmup():
+    """启动后台预热；同一进程内多个入口重复调用只执行一次"""
+    warmup.start([
+        ("imports", registry, True),
+        ("probe", probe, False),
+        ("prefetch", start_prefetch, False),
+    ])
+
+
+def check_token(t: "Tenant") -> Tuple[bool, str]:
+    """用一次轻量调用验证 token，返回 (是否可用, 错误信息)"""
+    try:
+        t.client.stock_basic(limit=1)
+        return True, ""
+    except Exception as e:
+        return False, str(e)
+
+
+@traced
+def stock_basic(
+    t: "Tenant",
+    ts_code: str = "",
+    name: str = "",
+    exchange: str = "",
+    list_status: str = "",
+) -> "pd.DataFrame":
+    """按代码、名称（子串匹配）、交易所、上市状态筛选股票"""
+    return t.universe.select(
+        ts_code=ts_code,
+        name=name,
+        exchange=exchange,
+        list_status=list_status,
+        fuzzy_name=True,
+    )
+
+
+@traced
+def search(t: "Tenant", keyword: str, limit: int = 50, offset: int = 0) -> "pd.DataFrame":
+    """按相关度搜索上市股票"""
+    return t.universe.search(keyword, limit=limit, offset=offset)
+
+
+@traced
+def stock_name(t: "Tenant", ts_code: str) -> str:
+    """股票名称，找不到时返回代码本身"""
+    return t.universe.name_of(ts_code, default=ts_code)
+
+
+@traced
+def stock_names(t: "Tenant") -> "pd.Series":
+    """全部股票的 代码 → 名称"""
+    return t.universe.frame()["name"]
+
+
+@traced
+def income_statement(
+    t: "Tenant",
+    ts_code: str,
+    report_type: str = "1",
+    period: str = "",
+    start_date: str = "",
+    end_date: str = "",
+    revisions: bool = False,
+) -> "pd.DataFrame":
+    """
+    一只股票的利润表，按报告期倒序
+
+    参数:
+        period: 报告期
+        start_date / end_date: 公告日期范围
+        revisions: 为 True 时保留同一报告期的全部披露（原始报告和更正报告），
+                   否则每个报告期只保留最新更正
+    """
+    from statement_engine import filter_periods, latest_revisions
+    df = t.income_store.get(ts_code, report_type)
+    if not revisions:
+        df = latest_revisions(df)
+    return filter_periods(df, period, start_date, end_date)
+
+
+@traced
+def income_statements(
+    t: "Tenant",
+    ts_codes: Iterable[str],
+    report_type: str = "1",
+    period: str = "",
+    start_date: str = "",
+    end_date: str = "",
+    fields: str = "",
+    revisions: bool = False,
+) -> Tuple["pd.DataFrame", Dict[str, str]]:
+    """多只股票的利润表，返回 (合并后的数据, {股票代码: 错误信息})；revisions 同 income_statement"""
+    from statement_engine import filter_periods, latest_revisions
+    df, errors = t.income_store.get_many(ts_codes, report_type, period, fields=fields)
+    if not revisions:
+        df = latest_revisions(df)
+    return filter_periods(df, "", start_date, end_date), errors
+
+
+@traced
+def statement(
+    t: "Tenant",
+    endpoint: str,
+    ts_code: str,
+    report_type: str = "1",
+    period: str = "",
+    start_date: str = "",
+    end_date: str = "",
+) -> "pd.DataFrame":
+    """
+    一只股票的资产负债表（balancesheet）、现金流量表（cashflow）或财务指标（fina_indicator），
+    每个报告期只保留最新更正，按报告期倒序；财务指标没有报表类型，忽略 report_type
+    """
+    return t.statements.statement(endpoint, ts_code, report_type, period, start_date, end_date)
+
+
+@traced
+def fundamentals(
+    t: "Tenant",
+    ts_code: str,
+    report_type: str = "1",
+    period: str = "",
+    start_date: str = "",
+    end_date: str = "",
+) -> Tuple["pd.DataFrame", Dict[str, str]]:
+    """三张报表与财务指标按报告期合并的宽表及派生指标，返回 (宽表, {接口名: 错误信息})"""
+    return t.statements.frame(ts_code, report_type, period, start_date, end_date)
+
+
+@traced
+def daily_prices(
+    t: "Tenant",
+    ts_code: str,
+    start_date: str = "",
+    end_date: str = "",
+    adj: str = "",
+) -> "pd.DataFrame":
+    """日线行情，按交易日倒序；adj 留空不复权，qfq 前复权，hfq 后复权"""
+    return t.price_store.get(ts_code, start_date, end_date, adj)
+
+
+@traced
+def screen(
+    t: "Tenant",
+    conditions: str = "",
+    industry: str = "",
+    area: str = "",
+    market: str = "",
+    period: str = "",
+    sort_by: str = "",
+    ascending: bool = False,
+    limit: int = 20,
+    offset: int = 0,
+) -> "pd.DataFrame":
+    """按财务比率选股，参数见 screener.RatioScreener.screen"""
+    return t.screener.screen(conditions, industry, area, market, period, sort_by, ascending, limit, offset)
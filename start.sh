@@ -4,14 +4,21 @@
 # 设置默认端口（Smithery 使用 8081）
 export PORT=${PORT:-8081}
 
+# worker 进程数（auto 为 CPU 核数），多个 worker 共享 TUSHARE_DATA_DIR 下的缓存
+export TUSHARE_WORKERS=${TUSHARE_WORKERS:-1}
+if [ "$TUSHARE_WORKERS" = "auto" ]; then
+    TUSHARE_WORKERS=$(nproc)
+fi
+
 echo "========================================="
 echo "Tushare MCP Server Starting"
 echo "========================================="
 echo "PORT: $PORT"
+echo "Workers: $TUSHARE_WORKERS"
 echo "TUSHARE_TOKEN configured: $([ -n "$TUSHARE_TOKEN" ] && echo "Yes" || echo "No")"
 echo "MCP endpoint: http://0.0.0.0:$PORT/mcp"
 echo "Health check: http://0.0.0.0:$PORT/health"
 echo "========================================="
 
 # 启动 uvicorn
-exec uvicorn app_http:app --host 0.0.0.0 --port $PORT --log-level info
+exec uvicorn app_http:app --host 0.0.0.0 --port $PORT --workers $TUSHARE_WORKERS --log-level info
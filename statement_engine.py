@@ -0,0 +1,254 @@
+"""
+财务报表引擎：利润表、资产负债表、现金流量表和财务指标的统一处理
+
+各报表的本地存储见 statement_store.StatementStore，这里负责：
+- 同一报告期的多次更正（update_flag）只保留最新披露的一条；
+- 按报告期和公告日期筛选、按字段选列；
+- 三张报表和财务指标按 (ts_code, end_date) 合并为一张宽表，
+  并向量化计算派生指标（平均净资产收益率、自由现金流、应计比率等）。
+
+合并后的宽表按 (股票, 报表类型) 缓存，底层报表没有变化时直接复用，
+同一只股票的多次分析不再重复合并和计算。
+"""
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from resilience import mark_stale, stale_age
+from statement_store import StatementStore, normalize_code
+
+# 参与合并的报表，顺序即宽表中列的顺序；重名的列保留靠前报表的值
+STATEMENTS = ("income", "balancesheet", "cashflow", "fina_indicator")
+
+# 合并时只保留第一张报表的公告信息列
+META_COLUMNS = ["ann_date", "f_ann_date", "report_type", "comp_type", "update_flag"]
+
+# 派生指标及说明，金额单位为元，比率单位为 %
+DERIVED_COLUMNS = {
+    "roe_avg": "净资产收益率（平均归母净资产）",
+    "roa_avg": "总资产收益率（平均总资产）",
+    "gross_margin": "毛利率",
+    "net_margin": "净利润率",
+    "debt_ratio": "资产负债率",
+    "fcf": "自由现金流（经营现金流 - 资本开支）",
+    "fcf_margin": "自由现金流率",
+    "cash_conversion": "经营现金流 / 净利润",
+    "accrual_ratio": "应计比率（(净利润 - 经营现金流) / 平均总资产）",
+}
+
+# 宽表默认返回的字段
+FUNDAMENTAL_DEFAULT_FIELDS = (
+    "end_date,ann_date,total_revenue,n_income_attr_p,total_assets,total_hldr_eqy_exc_min_int,"
+    "n_cashflow_act," + ",".join(DERIVED_COLUMNS)
+)
+
+# 同一报告期多次披露时的先后顺序，最后一条为最新更正
+REVISION_ORDER = ("end_date", "ann_date", "f_ann_date", "update_flag")
+
+# 缓存的宽表数量
+JOINED_ENTRIES = 64
+
+
+def _revision_key(df: pd.DataFrame) -> List[str]:
+    return [c for c in ("ts_code", "end_date", "report_type") if c in df.columns]
+
+
+def latest_revisions(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    每个 (ts_code, end_date, report_type) 只保留最新披露的一条（更正后的数据），其余行保持原有顺序
+
+    按公告日期、实际公告日期和 update_flag 排序后整体去重，不逐组处理。
+    """
+    if df.empty:
+        return df
+    order = [c for c in REVISION_ORDER if c in df.columns]
+    latest = df.sort_values(order, kind="stable").drop_duplicates(_revision_key(df), keep="last")
+    latest = latest.sort_index().reset_index(drop=True)
+    age = stale_age(df)
+    return mark_stale(latest, age) if age is not None else latest
+
+
+def revision_history(df: pd.DataFrame) -> pd.DataFrame:
+    """有多次披露（原始报告和更正报告）的报告期的全部记录，按报告期倒序、披露先后排列"""
+    if df.empty:
+        return df
+    revised = df[df.duplicated(_revision_key(df), keep=False)]
+    order = [c for c in REVISION_ORDER if c in df.columns]
+    ascending = [c != "end_date" for c in order]
+    return revised.sort_values(order, ascending=ascending, kind="stable").reset_index(drop=True)
+
+
+def filter_periods(df: pd.DataFrame, period: str = "", start_date: str = "", end_date: str = "") -> pd.DataFrame:
+    """按报告期（end_date）和公告日期（ann_date）范围筛选"""
+    if period:
+        df = df[df["end_date"] == period]
+    if start_date:
+        df = df[df["ann_date"] >= start_date]
+    if end_date:
+        df = df[df["ann_date"] <= end_date]
+    return df
+
+
+def join_statements(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """按 (ts_code, end_date) 外连接各报表，后面报表中已出现的列不再重复"""
+    joined: Optional[pd.DataFrame] = None
+    for df in frames:
+        if df is None or df.empty:
+            continue
+        if joined is None:
+            joined = df
+            continue
+        extra = [c for c in df.columns if c not in joined.columns and c not in META_COLUMNS]
+        joined = joined.merge(df[["ts_code", "end_date", *extra]], on=["ts_code", "end_date"], how="outer")
+    if joined is None:
+        return pd.DataFrame(columns=["ts_code", "end_date"])
+    return joined.sort_values("end_date", ascending=False, kind="stable").reset_index(drop=True)
+
+
+def _column(df: pd.DataFrame, name: str) -> np.ndarray:
+    if name not in df.columns:
+        return np.full(len(df), np.nan)
+    return pd.to_numeric(df[name], errors="coerce").to_numpy(dtype=float)
+
+
+def _opening(df: pd.DataFrame, name: str) -> np.ndarray:
+    """期初值：上一年年末（12 月 31 日）的同一列，缺失时为 NaN"""
+    values = pd.Series(_column(df, name), index=pd.MultiIndex.from_arrays([df["ts_code"], df["end_date"]]))
+    values = values[~values.index.duplicated(keep="first")]
+    prior = (df["end_date"].str[:4].astype(int) - 1).astype(str) + "1231"
+    return values.reindex(pd.MultiIndex.from_arrays([df["ts_code"], prior])).to_numpy(dtype=float)
+
+
+def _ratio(numerator: np.ndarray, denominator: np.ndarray, scale: float = 1.0) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result = numerator / denominator * scale
+    result[~np.isfinite(result)] = np.nan
+    return result
+
+
+def derive_metrics(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    在宽表上计算 DERIVED_COLUMNS 中的派生指标
+
+    报表中的金额是年初至报告期末的累计值，收益率的分母取期初（上年末）与期末的平均值，
+    期初缺失时只用期末值。
+    """
+    df = df.copy()
+    if df.empty:
+        for column in DERIVED_COLUMNS:
+            df[column] = pd.Series(dtype=float)
+        return df
+
+    revenue = _column(df, "total_revenue")
+    net_income = _column(df, "n_income")
+    equity = _column(df, "total_hldr_eqy_exc_min_int")
+    assets = _column(df, "total_assets")
+    cfo = _column(df, "n_cashflow_act")
+
+    opening_equity = _opening(df, "total_hldr_eqy_exc_min_int")
+    opening_assets = _opening(df, "total_assets")
+    avg_equity = np.where(np.isnan(opening_equity), equity, (opening_equity + equity) / 2)
+    avg_assets = np.where(np.isnan(opening_assets), assets, (opening_assets + assets) / 2)
+    fcf = cfo - np.nan_to_num(_column(df, "c_pay_acq_const_fiolta"))
+
+    df["roe_avg"] = _ratio(_column(df, "n_income_attr_p"), avg_equity, 100)
+    df["roa_avg"] = _ratio(net_income, avg_assets, 100)
+    df["gross_margin"] = _ratio(revenue - _column(df, "oper_cost"), revenue, 100)
+    df["net_margin"] = _ratio(net_income, revenue, 100)
+    df["debt_ratio"] = _ratio(_column(df, "total_liab"), assets, 100)
+    df["fcf"] = fcf
+    df["fcf_margin"] = _ratio(fcf, revenue, 100)
+    df["cash_conversion"] = _ratio(cfo, net_income)
+    df["accrual_ratio"] = _ratio(net_income - cfo, avg_assets, 100)
+    return df
+
+
+class StatementEngine:
+    """
+    多张报表的统一查询与合并
+
+    参数:
+        stores: 接口名 → StatementStore，至少包含 income
+    """
+
+    def __init__(self, stores: Dict[str, StatementStore]):
+        self.stores = stores
+        self._joined: "OrderedDict[Tuple[str, str], Tuple[Tuple, pd.DataFrame]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def statement(
+        self,
+        endpoint: str,
+        ts_code: str,
+        report_type: str = "1",
+        period: str = "",
+        start_date: str = "",
+        end_date: str = "",
+    ) -> pd.DataFrame:
+        """单张报表，每个报告期一条（最新更正），按报告期倒序（与本地存储一致）"""
+        store = self._store(endpoint)
+        df = store.get(ts_code, report_type if store.typed else "1")
+        return filter_periods(latest_revisions(df), period, start_date, end_date)
+
+    def frame(
+        self,
+        ts_code: str,
+        report_type: str = "1",
+        period: str = "",
+        start_date: str = "",
+        end_date: str = "",
+    ) -> Tuple[pd.DataFrame, Dict[str, str]]:
+        """
+        三张报表与财务指标的宽表（含派生指标），返回 (宽表, {接口名: 错误信息})
+
+        单张报表拉取失败时其余报表照常合并，失败的列为空。
+        """
+        ts_code = normalize_code(ts_code)
+        report_type = str(report_type or "1")
+        frames, errors, ages, fingerprint = [], {}, [], []
+        for endpoint in STATEMENTS:
+            if endpoint not in self.stores:
+                continue
+            store = self.stores[endpoint]
+            # 读取前取版本号：读取期间数据被替换时，下次调用版本号不同，宽表随之重算
+            version = store.version(ts_code, report_type if store.typed else "1")
+            try:
+                df = self.statement(endpoint, ts_code, report_type)
+            except Exception as e:
+                errors[endpoint] = str(e)
+                continue
+            frames.append(df)
+            # 此前尚未加载时取本次加载后的版本号
+            fingerprint.append((endpoint, version or store.version(ts_code, report_type if store.typed else "1")))
+            if stale_age(df) is not None:
+                ages.append(stale_age(df))
+
+        joined = self._join((ts_code, report_type), tuple(fingerprint), frames)
+        result = filter_periods(joined, period, start_date, end_date)
+        if ages:
+            result = mark_stale(result, max(ages))
+        return result, errors
+
+    def _store(self, endpoint: str) -> StatementStore:
+        try:
+            return self.stores[endpoint]
+        except KeyError:
+            raise ValueError(f"不支持的报表：{endpoint}") from None
+
+    def _join(self, key: Tuple[str, str], fingerprint: Tuple, frames: List[pd.DataFrame]) -> pd.DataFrame:
+        """底层报表的版本号（见 StatementStore.version）都没有变化时复用上次的宽表，否则重新合并并计算派生指标"""
+        with self._lock:
+            entry = self._joined.get(key)
+            if entry is not None and entry[0] == fingerprint:
+                self._joined.move_to_end(key)
+                return entry[1]
+        joined = derive_metrics(join_statements(frames))
+        with self._lock:
+            self._joined[key] = (fingerprint, joined)
+            self._joined.move_to_end(key)
+            while len(self._joined) > JOINED_ENTRIES:
+                self._joined.popitem(last=False)
+        return joined
@@ -0,0 +1,460 @@
+"""
+财务报表本地列式存储
+
+财务报表一经披露就不再变化（更正报告以新的 update_flag 另起一行），
+因此把每只股票、每种报表类型的全部历史以 Parquet 文件保存在
+~/.tushare_mcp/statements/ 下，重复查询直接读本地文件。
+过期后只拉取最近 REFRESH_PERIODS 个报告期的公告日期（ann_date）以来的记录并合并：
+Tushare 的更正有时沿用原报告的公告日期（只更新 f_ann_date/update_flag），
+按本地最新公告日期增量拉取会漏掉这些更正，因此每次刷新都重新拉取最近几期；
+更早报告期的更正需删除本地文件后重新拉取。进程重启后也无需重新拉取历史数据。
+过期的数据先原样返回（标记数据年龄），增量刷新在后台进行，
+上游故障或熔断期间工具仍可使用本地数据。
+多个 worker 进程共用同一目录，同一文件的拉取用文件锁互斥（见 workers），
+一个 worker 拉取后其余 worker 直接读盘。
+"""
+import contextvars
+import itertools
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional, Set, Tuple
+
+import pandas as pd
+
+from frames import parse_fields
+from memo import changed, depends
+from metrics import FanOut, cache_lookup
+from resilience import mark_stale, stale_age
+from workers import file_lock
+
+# 本地数据目录
+DATA_DIR = Path(os.getenv("TUSHARE_DATA_DIR", str(Path.home() / ".tushare_mcp")))
+
+# 距上次同步超过该秒数后做一次增量刷新，默认 6 小时
+STATEMENT_TTL = float(os.getenv("TUSHARE_STATEMENT_TTL", "21600"))
+
+# 增量刷新时重新拉取的最近报告期数（覆盖沿用原公告日期的更正），默认两年
+REFRESH_PERIODS = int(os.getenv("TUSHARE_REFRESH_PERIODS", "8"))
+
+# 内存中保留的 (股票, 报表类型) 数量
+MEMORY_ENTRIES = 256
+
+# 批量查询时，股票数量达到该值且指定了报告期，改用按报告期全市场拉取的接口
+BULK_THRESHOLD = int(os.getenv("TUSHARE_BULK_THRESHOLD", "20"))
+
+# 批量查询逐只拉取时的并发数（实际速率仍受客户端限流约束）
+BATCH_CONCURRENCY = int(os.getenv("TUSHARE_BATCH_CONCURRENCY", "8"))
+
+# 后台增量刷新的并发数
+REFRESH_WORKERS = int(os.getenv("TUSHARE_REFRESH_WORKERS", "2"))
+
+# 一行报表的唯一键
+STATEMENT_KEY = ["ts_code", "end_date", "report_type", "update_flag"]
+
+# 财务指标（fina_indicator）没有报表类型，唯一键不含 report_type
+INDICATOR_KEY = ["ts_code", "end_date", "update_flag"]
+
+INCOME_FIELDS = (
+    "ts_code,ann_date,f_ann_date,end_date,report_type,comp_type,basic_eps,diluted_eps,"
+    "total_revenue,revenue,int_income,prem_earned,comm_income,n_commis_income,n_oth_income,"
+    "n_oth_b_income,prem_income,out_prem,une_prem_reser,reins_income,n_sec_tb_income,"
+    "n_sec_uw_income,n_asset_mg_income,oth_b_income,fv_value_chg_gain,invest_income,"
+    "ass_invest_income,forex_gain,total_cogs,oper_cost,int_exp,comm_exp,biz_tax_surchg,"
+    "sell_exp,admin_exp,fin_exp,assets_impair_loss,prem_refund,compens_payout,reser_insur_liab,"
+    "div_payt,reins_exp,oper_exp,compens_payout_refu,insur_reser_refu,reins_cost_refund,"
+    "other_bus_cost,operate_profit,non_oper_income,non_oper_exp,nca_disploss,total_profit,"
+    "income_tax,n_income,n_income_attr_p,minority_gain,oth_compr_income,t_compr_income,"
+    "compr_inc_attr_p,compr_inc_attr_m_s,ebit,ebitda,insurance_exp,undist_profit,"
+    "distable_profit,update_flag"
+)
+
+# 批量对比时默认返回的利润表字段
+INCOME_SUMMARY_FIELDS = (
+    "ts_code,ann_date,end_date,report_type,total_revenue,revenue,oper_cost,operate_profit,"
+    "total_profit,n_income,n_income_attr_p,basic_eps"
+)
+
+BALANCE_FIELDS = (
+    "ts_code,ann_date,f_ann_date,end_date,report_type,comp_type,total_share,cap_rese,undistr_porfit,"
+    "surplus_rese,money_cap,trad_asset,notes_receiv,accounts_receiv,oth_receiv,prepayment,inventories,"
+    "total_cur_assets,fix_assets,cip,intan_assets,goodwill,lt_eqt_invest,total_nca,total_assets,st_borr,"
+    "notes_payable,acct_payable,adv_receipts,contract_liab,total_cur_liab,lt_borr,bond_payable,total_ncl,"
+    "total_liab,minority_int,total_hldr_eqy_exc_min_int,total_hldr_eqy_inc_min_int,total_liab_hldr_eqy,"
+    "update_flag"
+)
+
+CASHFLOW_FIELDS = (
+    "ts_code,ann_date,f_ann_date,end_date,report_type,comp_type,net_profit,finan_exp,c_fr_sale_sg,"
+    "c_inf_fr_operate_a,c_paid_goods_s,c_paid_to_for_empl,c_paid_for_taxes,st_cash_out_act,n_cashflow_act,"
+    "c_pay_acq_const_fiolta,c_disp_withdrwl_invest,c_paid_invest,stot_inflows_inv_act,stot_out_inv_act,"
+    "n_cashflow_inv_act,c_recp_borrow,c_prepay_amt_borr,c_pay_dist_dpcp_int_exp,n_cash_flows_fnc_act,"
+    "n_incr_cash_cash_equ,c_cash_equ_beg_period,c_cash_equ_end_period,free_cashflow,depr_fa_coga_dpba,"
+    "amort_intang_assets,update_flag"
+)
+
+INDICATOR_FIELDS = (
+    "ts_code,ann_date,end_date,eps,dt_eps,bps,ocfps,cfps,roe,roe_waa,roe_dt,roa,roic,grossprofit_margin,"
+    "netprofit_margin,current_ratio,quick_ratio,debt_to_assets,assets_turn,inv_turn,ar_turn,ocf_to_or,"
+    "fcff,fcfe,or_yoy,netprofit_yoy,q_roe,q_sales_yoy,update_flag"
+)
+
+
+# A 股代码：6 位代码加交易所后缀
+TS_CODE_PATTERN = re.compile(r"^[0-9A-Z]{6}\.(SH|SZ|BJ)$")
+
+
+def normalize_code(ts_code: str) -> str:
+    """
+    去掉空白并转为大写后的股票代码
+
+    代码会拼进本地文件路径，在加锁、拉取和拼接路径之前校验；
+    不是 A 股代码格式（如 600000.SH）时抛出 ValueError。
+    """
+    code = (ts_code or "").strip().upper()
+    if not TS_CODE_PATTERN.match(code):
+        raise ValueError(f"股票代码格式错误：{ts_code!r}（格式如 600000.SH）")
+    return code
+
+
+def _report_type(report_type: str) -> str:
+    value = str(report_type or "1").strip()
+    if not value.isdigit():
+        raise ValueError(f"报表类型格式错误：{report_type!r}（如 1 表示合并报表）")
+    return value
+
+
+# 内存中数据的版本号，所有存储共用一个递增序列
+_versions = itertools.count(1)
+
+_refresh_pool: Optional[ThreadPoolExecutor] = None
+_refresh_pool_lock = threading.Lock()
+
+
+def _refresher() -> ThreadPoolExecutor:
+    """所有报表存储共用的后台刷新线程池"""
+    global _refresh_pool
+    with _refresh_pool_lock:
+        if _refresh_pool is None:
+            _refresh_pool = ThreadPoolExecutor(
+                max_workers=max(1, REFRESH_WORKERS),
+                thread_name_prefix="statement-refresh",
+            )
+        return _refresh_pool
+
+
+class StatementStore:
+    """
+    单个报表接口（如 income）的本地存储
+
+    参数:
+        endpoint: 接口名称，同时作为子目录名
+        fetch: 调用上游接口的函数，接受 pro.<endpoint> 的关键字参数
+        fields: 拉取并保存的字段列表
+        root: 存储根目录
+        ttl: 增量刷新间隔（秒）
+        bulk_fetch: 可选，按报告期拉取全市场数据的接口（如 pro.income_vip）
+        key: 一行报表的唯一键；不含 report_type 时（如 fina_indicator）不向上游传报表类型
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        fetch: Callable[..., pd.DataFrame],
+        fields: str,
+        root: Path = DATA_DIR / "statements",
+        ttl: float = STATEMENT_TTL,
+        bulk_fetch: Optional[Callable[..., pd.DataFrame]] = None,
+        key: Iterable[str] = STATEMENT_KEY,
+    ):
+        self.endpoint = endpoint
+        self.key = list(key)
+        self.typed = "report_type" in self.key
+        self._fetch = fetch
+        self._bulk_fetch = bulk_fetch
+        self._fields = fields
+        self._dir = root / endpoint
+        self._ttl = ttl
+        self._memory: "OrderedDict[Tuple[str, str], Tuple[pd.DataFrame, float]]" = OrderedDict()
+        self._memory_lock = threading.Lock()
+        self._key_locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._refreshing: Set[Tuple[str, str]] = set()
+        self._versions: Dict[Tuple[str, str], int] = {}
+
+    def get(self, ts_code: str, report_type: str = "1") -> pd.DataFrame:
+        """
+        返回某只股票某种报表类型的全部历史
+
+        本地数据未过期时不访问上游；已过期时立即返回旧数据并在后台刷新，
+        返回的 DataFrame.attrs 中带有数据年龄（见 resilience.stale_age）。
+        只有本地没有数据时才同步拉取。代码格式错误时抛出 ValueError（见 normalize_code）。
+        """
+        key = (normalize_code(ts_code), _report_type(report_type))
+        depends(self._source(key))
+        df = self._serve_cached(key)
+        if df is not None:
+            return df
+
+        with self._key_lock(key), file_lock(self._path(key)):
+            # 等锁期间可能已被其他线程或其他 worker 拉取
+            df = self._serve_cached(key)
+            if df is not None:
+                return df
+            cache_lookup(self.endpoint, "miss")
+            return self._refresh(key, None)
+
+    def peek(self, ts_code: str, report_type: str = "1") -> Optional[pd.DataFrame]:
+        """本地已有的数据（内存或磁盘），没有时返回 None；不访问上游，也不占用内存缓存"""
+        key = (normalize_code(ts_code), _report_type(report_type))
+        with self._memory_lock:
+            entry = self._memory.get(key)
+        if entry is not None:
+            return entry[0]
+        try:
+            return pd.read_parquet(self._path(key))
+        except Exception:
+            return None
+
+    def sync(self, ts_code: str, report_type: str = "1") -> pd.DataFrame:
+        """立即做一次增量同步（不论是否过期），用于预取"""
+        key = (normalize_code(ts_code), _report_type(report_type))
+        with self._key_lock(key), file_lock(self._path(key)):
+            stored, _ = self._cached(key)
+            return self._refresh(key, stored)
+
+    def version(self, ts_code: str, report_type: str = "1") -> int:
+        """
+        内存中某只股票数据的版本号，尚未加载时为 0
+
+        数据每次被替换（刷新出新记录、更正替换了旧行、从磁盘重新加载）时变化，
+        只更新同步时间时不变；用于判断基于该数据的派生结果是否需要重算。
+        """
+        key = (normalize_code(ts_code), _report_type(report_type))
+        with self._memory_lock:
+            return self._versions.get(key, 0)
+
+    def _serve_cached(self, key: Tuple[str, str]) -> Optional[pd.DataFrame]:
+        df, synced_at = self._cached(key)
+        if df is None:
+            return None
+        age = time.time() - synced_at
+        if age < self._ttl:
+            cache_lookup(self.endpoint, "hit")
+            return df
+        cache_lookup(self.endpoint, "stale")
+        self._refresh_in_background(key)
+        return mark_stale(df, age)
+
+    def _refresh_in_background(self, key: Tuple[str, str]):
+        with self._memory_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        _refresher().submit(self._background_refresh, key)
+
+    def _background_refresh(self, key: Tuple[str, str]):
+        try:
+            with self._key_lock(key), file_lock(self._path(key)):
+                df, synced_at = self._cached(key)
+                if df is not None and time.time() - synced_at < self._ttl:
+                    return
+                self._refresh(key, df)
+        except Exception as e:
+            # 保留旧数据，下次访问时再尝试刷新
+            print(f"[store] {self.endpoint} refresh failed for {key[0]}, serving stored data: {e}", file=sys.stderr)
+        finally:
+            with self._memory_lock:
+                self._refreshing.discard(key)
+
+    def get_many(
+        self,
+        ts_codes: Iterable[str],
+        report_type: str = "1",
+        period: str = "",
+        fields: str = "",
+    ) -> Tuple[pd.DataFrame, Dict[str, str]]:
+        """
+        批量查询多只股票，返回 (合并后的数据, {股票代码: 错误信息})
+
+        股票较多且指定了报告期时，优先用 bulk_fetch 一次拉取全市场该期数据，
+        此时只向上游请求 fields 中的字段（加上唯一键和公告日期）；
+        否则逐只从本地存储读取，缺失或过期的并发拉取。
+        任何一个代码格式错误时抛出 ValueError，不发起任何拉取。
+        """
+        codes = list(dict.fromkeys(normalize_code(code) for code in ts_codes if code and code.strip()))
+        report_type = _report_type(report_type)
+        if not codes:
+            return pd.DataFrame(columns=self._fields.split(",")), {}
+
+        if period and self._bulk_fetch is not None and len(codes) >= BULK_THRESHOLD:
+            depends(self._source())
+            try:
+                wanted = parse_fields(fields)
+                # 公告日期用于筛选和排列更正记录
+                bulk_fields = ",".join(dict.fromkeys([*self.key, "ann_date", *wanted])) if wanted else self._fields
+                params = {"period": period, "fields": bulk_fields}
+                if self.typed:
+                    params["report_type"] = report_type
+                df = self._bulk_fetch(**params)
+                df = df[df["ts_code"].isin(codes)].drop_duplicates(self.key, keep="last")
+                return df.reset_index(drop=True), {}
+            except Exception as e:
+                print(f"[store] bulk {self.endpoint} fetch failed, falling back to per-ticker: {e}", file=sys.stderr)
+
+        def load(code: str):
+            try:
+                return self.get(code, report_type), None
+            except Exception as e:
+                return None, str(e)
+
+        frames, errors, ages = [], {}, []
+        workers = max(1, min(BATCH_CONCURRENCY, len(codes)))
+        with FanOut() as fan_out, ThreadPoolExecutor(max_workers=workers) as pool:
+            # 每个任务带上调用方的上下文（追踪、缓存依赖）；各线程的上游耗时按关键路径计入当前工具调用
+            futures = [pool.submit(contextvars.copy_context().run, fan_out.run, load, code) for code in codes]
+            for code, (df, error) in zip(codes, (f.result() for f in futures)):
+                if error is not None:
+                    errors[code] = error
+                elif not df.empty:
+                    frames.append(df)
+                    if stale_age(df) is not None:
+                        ages.append(stale_age(df))
+
+        if not frames:
+            return pd.DataFrame(columns=self._fields.split(",")), errors
+        merged = pd.concat(frames, ignore_index=True)
+        if period:
+            merged = merged[merged["end_date"] == period].reset_index(drop=True)
+        if ages:
+            merged = mark_stale(merged, max(ages))
+        return merged, errors
+
+    def _path(self, key: Tuple[str, str]) -> Path:
+        ts_code, report_type = key
+        return self._dir / f"{ts_code}_{report_type}.parquet"
+
+    def _key_lock(self, key: Tuple[str, str]) -> threading.Lock:
+        with self._memory_lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _cached(self, key: Tuple[str, str]) -> Tuple[Optional[pd.DataFrame], float]:
+        """
+        依次查内存和磁盘，返回 (数据, 上次同步时间)，都没有时数据为 None
+
+        内存中的数据过期后先看磁盘文件：其他 worker 已刷新（文件比内存新）时读盘，
+        不再重复拉取。
+        """
+        with self._memory_lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+        if entry is not None and time.time() - entry[1] < self._ttl:
+            return entry
+        path = self._path(key)
+        try:
+            synced_at = path.stat().st_mtime
+            # 允许 utime 往返的精度误差
+            if entry is not None and synced_at - entry[1] < 0.001:
+                return entry
+            df = pd.read_parquet(path)
+        except FileNotFoundError:
+            return entry if entry is not None else (None, 0.0)
+        except Exception as e:
+            if entry is not None:
+                return entry
+            print(f"[store] failed to read {path}, refetching: {e}", file=sys.stderr)
+            return None, 0.0
+        self._remember(key, df, synced_at)
+        if entry is not None and not df.equals(entry[0]):
+            changed(self._source(key), self._source())
+        return df, synced_at
+
+    def _remember(self, key: Tuple[str, str], df: pd.DataFrame, synced_at: float):
+        with self._memory_lock:
+            entry = self._memory.get(key)
+            if entry is None or entry[0] is not df:
+                self._versions[key] = next(_versions)
+            self._memory[key] = (df, synced_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > MEMORY_ENTRIES:
+                evicted, _ = self._memory.popitem(last=False)
+                self._versions.pop(evicted, None)
+
+    def _refresh(self, key: Tuple[str, str], stored: Optional[pd.DataFrame]) -> pd.DataFrame:
+        """
+        从上游拉取并与本地数据合并、写盘
+
+        本地已有数据时只拉取最近 REFRESH_PERIODS 个报告期中最早公告日期以来的记录：
+        既包含新披露的报告，也包含这几期沿用原公告日期发布的更正（同一唯一键以新拉取的为准）。
+        """
+        ts_code, report_type = key
+        params = {"ts_code": ts_code, "fields": self._fields}
+        if self.typed:
+            params["report_type"] = report_type
+        start = self._window_start(stored)
+        if start:
+            params["start_date"] = start
+
+        fresh = self._fetch(**params)
+        if fresh is None:
+            fresh = pd.DataFrame(columns=self._fields.split(","))
+        synced_at = time.time()
+
+        if stored is not None and not stored.empty and fresh.empty:
+            # 没有新公告，只更新同步时间
+            self._touch(key, synced_at)
+            self._remember(key, stored, synced_at)
+            return stored
+
+        merged = fresh if stored is None or stored.empty else pd.concat([stored, fresh], ignore_index=True)
+        merged = (
+            merged.drop_duplicates(self.key, keep="last")
+            .sort_values(["end_date", "ann_date"], ascending=False, kind="stable")
+            .reset_index(drop=True)
+        )
+        if stored is not None and merged.equals(stored):
+            # 重新拉取的几期没有变化，只更新同步时间
+            self._touch(key, synced_at)
+            self._remember(key, stored, synced_at)
+            return stored
+        self._write(key, merged)
+        self._touch(key, synced_at)
+        self._remember(key, merged, synced_at)
+        if stored is not None:
+            # 首次加载不算变化：此前没有基于该数据的输出
+            changed(self._source(key), self._source())
+        return merged
+
+    def _window_start(self, stored: Optional[pd.DataFrame]) -> str:
+        """增量拉取的起始公告日期：最近 REFRESH_PERIODS 个报告期中最早的公告日期，本地没有数据时为空（全量拉取）"""
+        if stored is None or stored.empty or REFRESH_PERIODS <= 0:
+            return ""
+        recent = sorted(stored["end_date"].dropna().unique())[-REFRESH_PERIODS:]
+        start = stored.loc[stored["end_date"].isin(recent), "ann_date"].dropna()
+        return str(start.min()) if not start.empty else ""
+
+    def _source(self, key: Optional[Tuple[str, str]] = None) -> str:
+        """工具输出缓存（memo）中的数据源名称，不指定 key 时表示整个接口"""
+        return str(self._path(key)) if key is not None else str(self._dir)
+
+    def _touch(self, key: Tuple[str, str], synced_at: float):
+        try:
+            os.utime(self._path(key), (synced_at, synced_at))
+        except OSError:
+            pass
+
+    def _write(self, key: Tuple[str, str], df: pd.DataFrame):
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(".tmp")
+            df.to_parquet(tmp, index=False)
+            os.replace(tmp, path)
+        except Exception as e:
+            # 写盘失败不影响本次查询，数据仍保留在内存中
+            print(f"[store] failed to persist {path}: {e}", file=sys.stderr)
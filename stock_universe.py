@@ -0,0 +1,253 @@
+"""
+股票列表（stock_basic）内存缓存
+
+stock_basic 全量列表一天最多变动一次，没必要在每次工具调用时重新下载。
+StockUniverse 在首次访问时同步加载，过期后由后台线程刷新，
+刷新期间（或上游故障时）继续使用旧数据，因此工具调用只做内存查询；
+过期数据的查询结果在 DataFrame.attrs 中标记数据年龄。
+指定 path 时列表同时以 Parquet 保存在本地，未过期的文件直接加载：
+进程重启或多个 worker 同时启动时只有一个拉取（文件锁互斥，见 workers）。
+工具输出中的股票名称来自这里，列表是工具输出缓存（memo）的数据源之一：
+重新加载后名称变化或有新股上市时，相关输出失效。
+"""
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional, Tuple
+
+import pandas as pd
+
+from memo import changed, depends
+from metrics import cache_lookup
+from resilience import mark_stale
+from search_index import StockSearchIndex
+from workers import file_lock
+
+# 缓存的字段为两个服务端用到的字段并集
+UNIVERSE_FIELDS = (
+    "ts_code,symbol,name,area,industry,fullname,enname,cnspell,market,"
+    "exchange,curr_type,list_status,list_date,delist_date,is_hs"
+)
+
+# 缓存有效期（秒），默认 12 小时
+UNIVERSE_TTL = float(os.getenv("TUSHARE_UNIVERSE_TTL", "43200"))
+
+# 后台刷新失败后的重试间隔（秒）
+REFRESH_RETRY_INTERVAL = 300.0
+
+
+def load_stock_basic(pro) -> pd.DataFrame:
+    """拉取全部上市状态（L=上市, D=退市, P=暂停上市）的股票列表"""
+    frames = []
+    for status in ("L", "D", "P"):
+        df = pro.stock_basic(list_status=status, fields=UNIVERSE_FIELDS)
+        if df is not None and not df.empty:
+            frames.append(df)
+    if not frames:
+        return pd.DataFrame(columns=UNIVERSE_FIELDS.split(","))
+    return pd.concat(frames, ignore_index=True)
+
+
+class StockUniverse:
+    """
+    带 TTL 的股票列表缓存
+
+    参数:
+        loader: 无参函数，返回完整的 stock_basic DataFrame
+        ttl: 缓存有效期（秒）
+        path: 可选，本地保存的 Parquet 文件路径
+    """
+
+    def __init__(self, loader: Callable[[], pd.DataFrame], ttl: float = UNIVERSE_TTL, path: Optional[Path] = None):
+        self._loader = loader
+        self._ttl = ttl
+        self._path = path
+        self._df: Optional[pd.DataFrame] = None
+        self._listed: Optional[pd.DataFrame] = None
+        self._index: Optional[StockSearchIndex] = None
+        self._loaded_at = 0.0
+        self._next_refresh = 0.0
+        self._load_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refreshing = False
+        # 工具输出缓存中的数据源名称
+        self._source = str(path) if path is not None else f"stock_basic:{id(self)}"
+
+    @property
+    def loaded(self) -> bool:
+        return self._df is not None
+
+    @property
+    def age(self) -> float:
+        """距上次成功加载的秒数"""
+        return time.monotonic() - self._loaded_at if self.loaded else float("inf")
+
+    @property
+    def stale(self) -> bool:
+        return self.age > self._ttl
+
+    def frame(self) -> pd.DataFrame:
+        """完整股票列表；首次调用阻塞加载，过期后触发后台刷新并返回旧数据"""
+        depends(self._source)
+        df = self._df
+        if df is None:
+            with self._load_lock:
+                if self._df is None:
+                    cache_lookup("stock_basic", "miss")
+                    self._load()
+                else:
+                    cache_lookup("stock_basic", "hit")
+                return self._df
+        if self.stale:
+            cache_lookup("stock_basic", "stale")
+            if time.monotonic() >= self._next_refresh:
+                self._refresh_in_background()
+        else:
+            cache_lookup("stock_basic", "hit")
+        return df
+
+    def listed(self) -> pd.DataFrame:
+        """上市状态为 L 的股票（与 stock_basic 默认返回一致）"""
+        self.frame()
+        return self._listed
+
+    def search(self, keyword: str, limit: int = 50, offset: int = 0) -> pd.DataFrame:
+        """在上市股票中按相关度搜索，见 search_index.StockSearchIndex"""
+        self.frame()
+        return self._flag(self._index.search(keyword, limit=limit, offset=offset))
+
+    def refresh(self):
+        """立即从上游重新加载（如每晚定时刷新），失败时抛出异常并保留旧数据"""
+        self._load(force=True)
+
+    def invalidate(self):
+        """丢弃缓存，下次访问时重新加载（例如更换 token 之后）"""
+        with self._load_lock:
+            self._df = None
+            self._listed = None
+            self._index = None
+            self._loaded_at = 0.0
+            self._next_refresh = 0.0
+
+    def get(self, ts_code: str) -> Optional[pd.Series]:
+        """按代码查询单只股票，不存在时返回 None"""
+        df = self.frame()
+        try:
+            return df.loc[ts_code.strip().upper()]
+        except KeyError:
+            return None
+
+    def name_of(self, ts_code: str, default: Optional[str] = None) -> Optional[str]:
+        """按代码查询股票名称"""
+        row = self.get(ts_code)
+        return row["name"] if row is not None else default
+
+    def select(
+        self,
+        ts_code: str = "",
+        name: str = "",
+        exchange: str = "",
+        list_status: str = "",
+        fuzzy_name: bool = False,
+    ) -> pd.DataFrame:
+        """
+        按条件筛选股票，语义与 pro.stock_basic 保持一致
+
+        参数:
+            ts_code: 股票代码，精确匹配
+            name: 股票名称，fuzzy_name 为 True 时做子串匹配
+            exchange: 交易所代码（SSE/SZSE/BSE）
+            list_status: 上市状态，留空时默认为 L
+        """
+        df = self.frame()
+        if ts_code:
+            df = df.loc[df.index.intersection([ts_code.strip().upper()])]
+        status = (list_status or "L").strip().upper()
+        df = df[df["list_status"] == status]
+        if exchange:
+            df = df[df["exchange"] == exchange.strip().upper()]
+        if name:
+            if fuzzy_name:
+                df = df[df["name"].str.contains(name, regex=False, na=False)]
+            else:
+                df = df[df["name"] == name]
+        return self._flag(df.reset_index(drop=True))
+
+    def _flag(self, df: pd.DataFrame) -> pd.DataFrame:
+        """过期数据的查询结果标记数据年龄"""
+        return mark_stale(df, self.age) if self.stale else df
+
+    def _load(self, force: bool = False):
+        """加载列表；指定了 path 时优先读取未过期的本地文件（force 时跳过），拉取后写盘"""
+        if self._path is None:
+            self._replace(self._loader(), time.time(), "upstream")
+            return
+        with file_lock(self._path):
+            df, synced_at = (None, 0.0) if force else self._stored()
+            source = "disk"
+            if df is None:
+                df, synced_at, source = self._loader(), time.time(), "upstream"
+                self._persist(df)
+        self._replace(df, synced_at, source)
+
+    def _stored(self) -> Tuple[Optional[pd.DataFrame], float]:
+        """本地保存的未过期列表及其保存时间，没有或已过期时为 (None, 0)"""
+        try:
+            synced_at = self._path.stat().st_mtime
+            if time.time() - synced_at >= self._ttl:
+                return None, 0.0
+            return pd.read_parquet(self._path), synced_at
+        except FileNotFoundError:
+            return None, 0.0
+        except Exception as e:
+            print(f"[cache] failed to read {self._path}, refetching: {e}", file=sys.stderr)
+            return None, 0.0
+
+    def _persist(self, df: pd.DataFrame):
+        try:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self._path.with_suffix(".tmp")
+            df.to_parquet(tmp, index=False)
+            os.replace(tmp, self._path)
+        except Exception as e:
+            # 写盘失败不影响本次加载
+            print(f"[cache] failed to persist {self._path}: {e}", file=sys.stderr)
+
+    def _replace(self, df: pd.DataFrame, synced_at: float, source: str):
+        df = df.drop_duplicates("ts_code").set_index("ts_code", drop=False)
+        df.index.name = None
+        listed = df[df["list_status"] == "L"].reset_index(drop=True)
+        index = StockSearchIndex(listed)
+        previous = self._df
+        # 先准备好全部数据再替换引用，读者不会看到半更新的状态
+        self._df, self._listed, self._index = df, listed, index
+        if previous is not None and not df.equals(previous):
+            # 首次加载不算变化：此前没有基于该列表的输出
+            changed(self._source)
+        # 读自本地文件时，年龄从文件保存时算起
+        self._loaded_at = time.monotonic() - max(0.0, time.time() - synced_at)
+        print(f"[cache] stock_basic loaded from {source}: {len(df)} rows", file=sys.stderr)
+
+    def _refresh_in_background(self):
+        with self._refresh_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(
+            target=self._background_refresh,
+            name="stock-universe-refresh",
+            daemon=True,
+        ).start()
+
+    def _background_refresh(self):
+        try:
+            self._load()
+        except Exception as e:
+            print(f"[cache] stock_basic refresh failed, serving stale data: {e}", file=sys.stderr)
+            # 推迟下一次刷新，避免上游故障时每次调用都重试
+            self._next_refresh = time.monotonic() + REFRESH_RETRY_INTERVAL
+        finally:
+            with self._refresh_lock:
+                self._refreshing = False
@@ -0,0 +1,235 @@
+"""
+多租户：按 token 隔离的客户端与缓存
+
+同一部署服务多个团队时，各自的 Tushare token 有各自的积分和频次配额。
+每个 token 对应一个 Tenant，拥有独立的限流客户端（令牌桶）、股票列表缓存
+、报表和行情存储目录，一个租户的高频调用不会耗尽其他租户的配额。
+Tenant 保存在 LRU 中，超出 MAX_TENANTS 时淘汰最久未使用的租户。
+请求携带的 token 首次使用前先用一次轻量调用验证，验证通过后才会在磁盘上创建租户目录，
+随意构造的 token 不会留下文件；上游明确拒绝的 token 在 REJECT_TTL 秒内直接拒绝，
+网络故障、熔断或限流导致的验证失败不缓存，下次请求重新验证。
+"""
+import base64
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Mapping, Optional, Tuple
+
+from price_store import PriceStore
+from screener import RatioScreener
+from statement_engine import StatementEngine
+from statement_store import (
+    BALANCE_FIELDS,
+    CASHFLOW_FIELDS,
+    DATA_DIR,
+    INCOME_FIELDS,
+    INDICATOR_FIELDS,
+    INDICATOR_KEY,
+    StatementStore,
+)
+from stock_universe import StockUniverse, load_stock_basic
+from tushare_client import PooledDataApi, TushareClient, is_auth_error
+
+# 同时保留的租户数量
+MAX_TENANTS = int(os.getenv("TUSHARE_MAX_TENANTS", "32"))
+
+# 验证失败的 token 在该秒数内直接拒绝，不再请求上游
+REJECT_TTL = 60.0
+
+# 最多记住的验证失败的 token 数量
+REJECTED_ENTRIES = 1024
+
+# 携带 token 的请求头
+TOKEN_HEADER = "x-tushare-token"
+
+# 携带 token 的查询参数（与 smithery.yaml 的 configSchema 一致）
+TOKEN_PARAM = "TUSHARE_TOKEN"
+
+
+class InvalidToken(Exception):
+    """请求携带的 token 未通过验证"""
+
+
+def token_from_request(headers: Mapping[str, str], query: Mapping[str, str]) -> Optional[str]:
+    """
+    从 HTTP 请求中取出调用方的 token
+
+    依次检查请求头 X-Tushare-Token、查询参数 TUSHARE_TOKEN、
+    以及 Smithery 会话配置（查询参数 config，base64 编码的 JSON）。
+    """
+    token = headers.get(TOKEN_HEADER) or query.get(TOKEN_PARAM)
+    if not token and query.get("config"):
+        try:
+            raw = query["config"]
+            config = json.loads(base64.urlsafe_b64decode(raw + "=" * (-len(raw) % 4)))
+            token = config.get(TOKEN_PARAM)
+        except Exception:
+            token = None
+    if not isinstance(token, str):
+        return None
+    return token.strip() or None
+
+
+def namespace_of(token: str) -> str:
+    """token 的摘要，作为租户标识和缓存目录名，不在日志和磁盘上暴露 token"""
+    return hashlib.sha256(token.encode()).hexdigest()[:16]
+
+
+class Tenant:
+    """
+    一个 token 对应的客户端、股票列表缓存、财务报表和日线行情存储、选股比率表
+
+    参数:
+        token: Tushare API token
+        shared: 为 True 时使用默认的存储目录（部署时配置的 token），
+                否则存储在 DATA_DIR/tenants/<namespace>/ 下
+    """
+
+    def __init__(self, token: str, shared: bool = False):
+        self.token = token
+        self.namespace = namespace_of(token)
+        self.client = TushareClient(lambda: PooledDataApi(token))
+        root = DATA_DIR if shared else DATA_DIR / "tenants" / self.namespace
+        self.root = root
+        self.universe = StockUniverse(lambda: load_stock_basic(self.client), path=root / "stock_basic.parquet")
+        self.income_store = StatementStore(
+            "income",
+            self.client.income,
+            INCOME_FIELDS,
+            root=root / "statements",
+            bulk_fetch=self.client.income_vip,
+        )
+        self.balance_store = StatementStore(
+            "balancesheet",
+            self.client.balancesheet,
+            BALANCE_FIELDS,
+            root=root / "statements",
+            bulk_fetch=self.client.balancesheet_vip,
+        )
+        self.cashflow_store = StatementStore(
+            "cashflow",
+            self.client.cashflow,
+            CASHFLOW_FIELDS,
+            root=root / "statements",
+            bulk_fetch=self.client.cashflow_vip,
+        )
+        self.indicator_store = StatementStore(
+            "fina_indicator",
+            self.client.fina_indicator,
+            INDICATOR_FIELDS,
+            root=root / "statements",
+            bulk_fetch=self.client.fina_indicator_vip,
+            key=INDICATOR_KEY,
+        )
+        self.statements = StatementEngine(
+            {
+                "income": self.income_store,
+                "balancesheet": self.balance_store,
+                "cashflow": self.cashflow_store,
+                "fina_indicator": self.indicator_store,
+            }
+        )
+        self.price_store = PriceStore(self.client.daily, self.client.adj_factor, root=root / "prices")
+        self.screener = RatioScreener(self.client.income_vip, self.universe, root=root / "screen")
+
+    def verify(self):
+        """
+        用一次轻量调用验证 token，成功后创建租户目录
+
+        上游以 token 无效或无权限拒绝时抛出 InvalidToken，不在磁盘上留下任何文件；
+        网络故障、熔断、限流等其他错误原样抛出。
+        """
+        try:
+            self.client.stock_basic(limit=1)
+        except Exception as e:
+            if not is_auth_error(e):
+                raise
+            raise InvalidToken(f"token 验证失败：{e}") from e
+        self.root.mkdir(parents=True, exist_ok=True)
+
+
+class TenantRegistry:
+    """
+    token → Tenant 的 LRU
+
+    参数:
+        default_token: 部署时配置的 token，请求未携带 token 时使用，不会被淘汰
+        capacity: 最多保留的其他租户数量
+    """
+
+    def __init__(self, default_token: str = "", capacity: int = MAX_TENANTS):
+        self._default = Tenant(default_token, shared=True) if default_token else None
+        self._capacity = max(1, capacity)
+        self._tenants: "OrderedDict[str, Tenant]" = OrderedDict()
+        # 验证失败的 token 摘要 → (失败时间, 错误信息)
+        self._rejected: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def default(self) -> Optional[Tenant]:
+        return self._default
+
+    def __len__(self) -> int:
+        return len(self._tenants) + (1 if self._default else 0)
+
+    def set_default(self, token: Optional[str]):
+        """更换部署时配置的 token：新建默认租户（沿用默认存储目录），进行中的调用继续使用旧租户"""
+        self._default = Tenant(token, shared=True) if token else None
+        print(f"[tenant] default token {'changed' if token else 'cleared'}", file=sys.stderr)
+
+    def cached(self, token: Optional[str]) -> bool:
+        """token 的租户是否无需验证即可取得（默认租户或已在 LRU 中），此时 get 不会访问上游"""
+        if not token or (self._default and token == self._default.token):
+            return True
+        with self._lock:
+            return token in self._tenants
+
+    def get(self, token: Optional[str]) -> Optional[Tenant]:
+        """
+        返回 token 对应的租户；token 为空时返回默认租户（可能为 None）
+
+        新 token 的租户目录尚不存在时先验证（见 Tenant.verify），验证失败抛出 InvalidToken，
+        上游暂时不可用时抛出原始异常（不记入拒绝列表）；
+        验证期间不持有锁，其他租户的请求不受影响，但调用方会阻塞，异步代码应在线程池中调用。
+        """
+        if not token or (self._default and token == self._default.token):
+            return self._default
+        with self._lock:
+            tenant = self._tenants.get(token)
+            if tenant is not None:
+                self._tenants.move_to_end(token)
+                return tenant
+            rejected = self._rejected.get(namespace_of(token))
+        if rejected is not None and time.monotonic() - rejected[0] < REJECT_TTL:
+            raise InvalidToken(rejected[1])
+
+        tenant = Tenant(token)
+        # 目录已存在说明此前验证通过（如进程重启前），不再重复验证
+        if not tenant.root.exists():
+            try:
+                tenant.verify()
+            except InvalidToken as e:
+                with self._lock:
+                    self._rejected[tenant.namespace] = (time.monotonic(), str(e))
+                    self._rejected.move_to_end(tenant.namespace)
+                    while len(self._rejected) > REJECTED_ENTRIES:
+                        self._rejected.popitem(last=False)
+                print(f"[tenant] rejected {tenant.namespace}: {e}", file=sys.stderr)
+                raise
+
+        with self._lock:
+            existing = self._tenants.get(token)
+            if existing is not None:
+                # 并发的首次请求已先一步创建
+                return existing
+            self._tenants[token] = tenant
+            self._rejected.pop(tenant.namespace, None)
+            print(f"[tenant] created {tenant.namespace} ({len(self._tenants)} active)", file=sys.stderr)
+            while len(self._tenants) > self._capacity:
+                _, evicted = self._tenants.popitem(last=False)
+                print(f"[tenant] evicted {evicted.namespace}", file=sys.stderr)
+            return tenant
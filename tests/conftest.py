@@ -0,0 +1,41 @@
+"""
+测试公共设置
+
+模块级配置（数据目录等）在导入时读取环境变量，先指向临时目录再导入被测模块；
+上游数据由 benchmarks/fake_tushare.py 在进程内合成，不访问网络。
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT), str(ROOT / "benchmarks")]
+
+_home = tempfile.mkdtemp(prefix="tushare-mcp-tests-")
+os.environ["TUSHARE_DATA_DIR"] = _home
+os.environ["HOME"] = _home
+os.environ.pop("TUSHARE_TOKEN", None)
+os.environ.pop("TUSHARE_MEMO_REDIS_URL", None)
+os.environ["TUSHARE_WORKERS"] = "1"
+
+import pandas as pd  # noqa: E402
+import pytest  # noqa: E402
+from fake_tushare import FakeTushare  # noqa: E402
+
+
+@pytest.fixture
+def fake() -> FakeTushare:
+    """30 只股票、3 年报表，一半报告期有更正报告"""
+    return FakeTushare(stocks=30, years=3, revision_ratio=0.5)
+
+
+@pytest.fixture
+def fetch(fake):
+    """fetch("income") 返回与 pro.income 用法相同的函数，数据来自 fake"""
+    def endpoint(api_name: str):
+        def call(fields: str = "", **params) -> pd.DataFrame:
+            data = fake.handle(api_name, params, fields)["data"]
+            return pd.DataFrame(data["items"], columns=data["fields"])
+        return call
+    return endpoint
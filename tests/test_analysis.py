@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from server import _growth, _single_quarter, format_income_statement_analysis
+
+
+def cumulative(year_quarters):
+    """[(年份, [一至四季度单季值])] → 按报告期索引的累计值（年初至今）"""
+    index, values = [], []
+    for year, quarters in year_quarters:
+        for quarter, total in enumerate(np.cumsum(quarters), start=1):
+            index.append(pd.Timestamp(year, quarter * 3, 1) + pd.offsets.MonthEnd(0))
+            values.append(total)
+    return pd.DataFrame({"total_revenue": values}, index=pd.DatetimeIndex(index))
+
+
+def test_single_quarter_undoes_cumulation():
+    values = cumulative([(2022, [1, 2, 3, 4]), (2023, [5, 6, 7, 8])])
+    assert _single_quarter(values)["total_revenue"].tolist() == [1, 2, 3, 4, 5, 6, 7, 8]
+
+
+def test_single_quarter_missing_previous_is_nan():
+    values = cumulative([(2023, [5, 6, 7, 8])]).iloc[[0, 2]]
+    assert _single_quarter(values)["total_revenue"].iloc[0] == 5
+    assert np.isnan(_single_quarter(values)["total_revenue"].iloc[1])
+
+
+def test_growth_year_over_year():
+    values = cumulative([(2022, [1, 1, 1, 1]), (2023, [2, 2, 2, 2])])
+    assert _growth(values, pd.DateOffset(years=1))["total_revenue"] == pytest.approx(100.0)
+
+
+def test_growth_missing_or_zero_base_is_nan():
+    values = cumulative([(2023, [0, 1, 1, 1])])
+    assert np.isnan(_growth(values, pd.DateOffset(years=1))["total_revenue"])
+    assert np.isnan(_growth(values.iloc[:1], pd.offsets.QuarterEnd(1))["total_revenue"])
+
+
+def test_flat_business_has_zero_quarter_change():
+    values = cumulative([(2022, [10e8] * 4), (2023, [10e8])])
+    df = pd.DataFrame({
+        "ts_code": "600000.SH",
+        "end_date": values.index.strftime("%Y%m%d"),
+        "report_type": "1",
+        "total_revenue": values["total_revenue"].to_numpy(),
+    })
+    # 一季度累计值只有上年全年的四分之一，单季口径下环比不变
+    assert "单季环比变动：+0.00%" in format_income_statement_analysis(df)
@@ -0,0 +1,86 @@
+import pandas as pd
+import pytest
+
+import statement_store
+from statement_store import INCOME_FIELDS, StatementStore
+
+
+@pytest.fixture
+def calls():
+    return {"income": [], "income_vip": []}
+
+
+@pytest.fixture
+def store(fetch, calls, tmp_path):
+    def endpoint(api_name):
+        call = fetch(api_name)
+
+        def record(**params):
+            calls[api_name].append(params)
+            if params.get("ts_code") == "000404.SZ":
+                raise ValueError("上游错误")
+            return call(**params)
+        return record
+
+    return StatementStore("income", endpoint("income"), INCOME_FIELDS, root=tmp_path,
+                          bulk_fetch=endpoint("income_vip"))
+
+
+def listed_codes(fake, count):
+    return [row["ts_code"] for row in fake.stocks if row["list_status"] == "L"][:count]
+
+
+def test_per_ticker_fan_out_collects_errors(store, fake, calls):
+    codes = listed_codes(fake, 3)
+    df, errors = store.get_many([*codes, codes[0].lower(), "000404.SZ"])
+    assert set(df["ts_code"]) == set(codes)
+    assert list(errors) == ["000404.SZ"]
+    # 重复的代码只拉取一次
+    assert sorted(c["ts_code"] for c in calls["income"]) == sorted([*codes, "000404.SZ"])
+
+
+def test_period_filter(store, fake):
+    codes = listed_codes(fake, 2)
+    period = fake.periods[-1]
+    df, _ = store.get_many(codes, period=period)
+    assert set(df["end_date"]) == {period}
+    assert set(df["ts_code"]) == set(codes)
+
+
+def test_many_codes_with_period_use_one_bulk_call(store, fake, calls, monkeypatch):
+    monkeypatch.setattr(statement_store, "BULK_THRESHOLD", 3)
+    codes = listed_codes(fake, 4)
+    df, errors = store.get_many(codes, period=fake.periods[-1], fields="n_income")
+    assert errors == {}
+    assert set(df["ts_code"]) == set(codes)
+    assert calls["income"] == []
+    assert len(calls["income_vip"]) == 1
+    # 只请求所需字段加上唯一键和公告日期
+    requested = calls["income_vip"][0]["fields"].split(",")
+    assert set(requested) == {*store.key, "ann_date", "n_income"}
+
+
+def test_bulk_failure_falls_back_to_per_ticker(store, fake, calls, monkeypatch):
+    monkeypatch.setattr(statement_store, "BULK_THRESHOLD", 2)
+
+    def down(**params):
+        raise ConnectionError("down")
+
+    store._bulk_fetch = down
+    codes = listed_codes(fake, 2)
+    df, errors = store.get_many(codes, period=fake.periods[-1])
+    assert errors == {}
+    assert set(df["ts_code"]) == set(codes)
+    assert len(calls["income"]) == 2
+
+
+def test_empty_input(store):
+    df, errors = store.get_many(["", "  "])
+    assert df.empty and errors == {}
+    assert isinstance(df, pd.DataFrame)
+
+
+def test_invalid_code_rejects_whole_batch(store, fake, calls):
+    with pytest.raises(ValueError):
+        store.get_many([fake.stocks[0]["ts_code"], "../etc"])
+    assert calls == {"income": [], "income_vip": []}
@@ -0,0 +1,20 @@
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# 入口在监听端口前导入的模块，不应加载 pandas 等较重的依赖
+LIGHT_MODULES = ["service", "memo", "metrics", "tracing", "workers"]
+HEAVY_MODULES = ["pandas", "numpy", "pyarrow", "tushare"]
+
+
+def test_entry_modules_defer_heavy_imports():
+    script = (
+        f"import sys\nimport {', '.join(LIGHT_MODULES)}\n"
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    loaded = subprocess.run(
+        [sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True, check=True
+    ).stdout.strip()
+    assert loaded == ""
@@ -0,0 +1,105 @@
+import os
+
+import pytest
+
+from credentials import TOKEN_KEY, TokenSource
+from fake_tushare import serve
+from tushare_client import PooledDataApi, http_session
+
+
+@pytest.fixture
+def env_file(tmp_path, monkeypatch):
+    monkeypatch.delenv(TOKEN_KEY, raising=False)
+    path = tmp_path / ".tushare_mcp" / ".env"
+    path.parent.mkdir()
+    path.write_text(f"{TOKEN_KEY}=first\n")
+    return path
+
+
+def rewrite(path, token, offset=10):
+    """改写 .env 并把修改时间推后，确保 mtime 变化"""
+    path.write_text(f"{TOKEN_KEY}={token}\n")
+    stat = path.stat()
+    os.utime(path, (stat.st_atime, stat.st_mtime + offset))
+
+
+def test_creates_missing_file(tmp_path, monkeypatch):
+    monkeypatch.delenv(TOKEN_KEY, raising=False)
+    source = TokenSource(tmp_path / "new" / ".env")
+    assert source.get() is None
+    assert (tmp_path / "new" / ".env").exists()
+
+
+def test_environment_overrides_startup_file(env_file, monkeypatch):
+    monkeypatch.setenv(TOKEN_KEY, " from-env ")
+    assert TokenSource(env_file).get() == "from-env"
+
+
+def test_file_is_not_reread_within_interval(env_file):
+    source = TokenSource(env_file, recheck_interval=3600)
+    rewrite(env_file, "second")
+    assert source.get() == "first"
+
+
+def test_reloads_and_notifies_on_mtime_change(env_file, monkeypatch):
+    monkeypatch.setenv(TOKEN_KEY, "from-env")
+    source = TokenSource(env_file, recheck_interval=0)
+    seen = []
+    source.subscribe(seen.append)
+    assert source.get() == "from-env"
+
+    # 运行期间修改 .env，以文件中的 token 为准
+    rewrite(env_file, "second")
+    assert source.get() == "second"
+    assert source.get() == "second"
+    assert seen == ["second"]
+
+    # 内容相同只更新了修改时间，不通知
+    rewrite(env_file, "second", offset=20)
+    assert source.get() == "second"
+    assert seen == ["second"]
+
+
+def test_set_writes_file_and_notifies(env_file):
+    source = TokenSource(env_file, recheck_interval=0)
+    seen = []
+    source.subscribe(seen.append)
+    source.set(" third ")
+    assert source.get() == "third"
+    assert seen == ["third"]
+    assert "third" in env_file.read_text()
+    # 新实例（如进程重启）读到写入的 token
+    assert TokenSource(env_file).get() == "third"
+
+
+def test_listener_failure_does_not_break_reload(env_file):
+    source = TokenSource(env_file, recheck_interval=0)
+
+    def broken(token):
+        raise RuntimeError("listener failed")
+
+    source.subscribe(broken)
+    rewrite(env_file, "second")
+    assert source.get() == "second"
+
+
+@pytest.fixture
+def fake_server(fake):
+    server = serve(fake)
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def test_pooled_api_queries_over_shared_session(fake_server, fake):
+    api = PooledDataApi("token", http_url=fake_server)
+    df = api.stock_basic(list_status="L", fields="ts_code,name")
+    assert list(df.columns) == ["ts_code", "name"]
+    assert len(df) == sum(row["list_status"] == "L" for row in fake.stocks)
+    assert api.query("stock_basic", limit=1).shape[0] == 1
+    # 所有客户端共用同一个连接池
+    assert http_session() is http_session()
+
+
+def test_pooled_api_raises_upstream_errors(fake_server):
+    with pytest.raises(Exception, match="不存在"):
+        PooledDataApi("token", http_url=fake_server).query("no_such_api")
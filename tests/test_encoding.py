@@ -0,0 +1,61 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from encoding import COLUMNS, RECORDS, dumps, frame_payload, frame_result, page_result
+from resilience import mark_stale
+
+
+def texts(result):
+    return [json.loads(content.text) for content in result.content]
+
+
+def sample() -> pd.DataFrame:
+    return pd.DataFrame({
+        "ts_code": ["600000.SH", "000001.SZ"],
+        "n_income": [1.5, np.nan],
+        "vol": np.array([10, 20], dtype=np.int64),
+        "name": ["浦发银行", None],
+        "list_date": [pd.Timestamp("2024-01-02"), pd.NaT],
+    })
+
+
+def test_missing_values_become_null():
+    records = json.loads(dumps(frame_payload(sample(), RECORDS)))
+    assert records[1] == {"ts_code": "000001.SZ", "n_income": None, "vol": 20, "name": None, "list_date": None}
+    assert records[0]["list_date"].startswith("2024-01-02")
+    # 数值列保持数值类型，中文不转义
+    assert isinstance(records[0]["vol"], int)
+    assert "浦发银行" in dumps(frame_payload(sample(), RECORDS))
+
+
+def test_pandas_nullable_types():
+    df = pd.DataFrame({"x": pd.array([1, None], dtype="Int64")})
+    assert json.loads(dumps(frame_payload(df))) == [{"x": 1}, {"x": None}]
+
+
+def test_columns_shape_with_extra_fields():
+    result = frame_result(sample(), COLUMNS, errors={"X": "失败"})
+    payload, = texts(result)
+    assert payload["columns"] == list(sample().columns)
+    assert payload["data"][1][1] is None
+    assert payload["errors"] == {"X": "失败"}
+
+
+def test_matches_pandas_to_json():
+    df = sample().drop(columns="list_date")
+    assert texts(frame_result(df))[0] == json.loads(df.to_json(orient="records", force_ascii=False))
+
+
+def test_stale_data_appends_notice():
+    result = frame_result(mark_stale(sample(), 7200))
+    payload, notice = texts(result)
+    assert len(payload) == 2
+    assert notice["stale"] is True and notice["age_seconds"] == 7200
+
+
+def test_page_result():
+    payload, = texts(page_result(sample().head(1), RECORDS, "abc", total=2))
+    assert payload["next_cursor"] == "abc" and payload["total"] == 2
+    assert len(payload["data"]) == 1
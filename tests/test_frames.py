@@ -0,0 +1,19 @@
+import pandas as pd
+
+from frames import paginate, parse_fields, select_fields
+
+
+def test_paginate():
+    df = pd.DataFrame({"x": range(10)})
+    assert paginate(df, 3, 2)["x"].tolist() == [2, 3, 4]
+    assert paginate(df, 0, 8)["x"].tolist() == [8, 9]
+    assert paginate(df, 5, 20).empty
+    assert paginate(df, -1, -5) is df
+
+
+def test_select_fields():
+    df = pd.DataFrame({"ts_code": ["A"], "name": ["甲"], "area": ["上海"]})
+    assert parse_fields(" name, area ,name,") == ["name", "area"]
+    assert list(select_fields(df, "area,missing", keep=["ts_code"]).columns) == ["ts_code", "area"]
+    assert list(select_fields(df, "", default="name").columns) == ["name"]
+    assert select_fields(df, "") is df
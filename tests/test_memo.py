@@ -0,0 +1,118 @@
+import inspect
+
+import pytest
+from fastmcp.tools.tool import ToolResult
+from mcp.types import TextContent
+
+import memo
+from memo import LocalBackend, SqliteBackend, changed, decode_entry, depends, encode_entry, make_key, memoize
+
+
+def tool(ts_code: str, period: str = "", ts_codes=None, limit: int = 10):
+    pass
+
+
+SIGNATURE = inspect.signature(tool)
+
+
+def key(*args, **kwargs):
+    return make_key("http", "tool", "scope", SIGNATURE, args, kwargs)
+
+
+def test_make_key_normalizes_arguments():
+    base = key("600000.SH")
+    assert key(" 600000.sh ") == base
+    assert key("600000.SH", period=None) == base
+    assert key("600000.SH", "", None, 10) == base
+    assert key(ts_code="600000.SH", limit=10) == base
+    assert key("600000.SH", ts_codes=[" a.sh"]) == key("600000.SH", ts_codes=["A.SH"])
+
+
+def test_make_key_distinguishes_arguments_and_scope():
+    base = key("600000.SH")
+    assert key("600000.SH", period="20231231") != base
+    assert key("600000.SH", limit=11) != base
+    assert make_key("stdio", "tool", "scope", SIGNATURE, ("600000.SH",), {}) != base
+    assert make_key("http", "tool", "other", SIGNATURE, ("600000.SH",), {}) != base
+
+
+def test_entry_round_trip():
+    assert decode_entry(encode_entry("文本", {"a": 1})) == ("文本", {"a": 1})
+    assert decode_entry(encode_entry({"rows": [1, 2]}, {})) == ({"rows": [1, 2]}, {})
+    value, deps = decode_entry(encode_entry(ToolResult(content=[TextContent(type="text", text="[1]")]), {"b": 2}))
+    assert [c.text for c in value.content] == ["[1]"]
+    assert deps == {"b": 2}
+
+
+def test_entry_rejects_unknown_values():
+    assert encode_entry(object(), {}) is None
+    # 共享后端中的数据不以 pickle 解析
+    assert decode_entry(b"\x80\x04\x95") is None
+
+
+def test_memoize_invalidates_on_changed():
+    calls = []
+
+    @memoize(lambda: "tenant", "test")
+    def render(ts_code: str) -> str:
+        depends("test-source")
+        calls.append(ts_code)
+        return f"{ts_code}#{len(calls)}"
+
+    assert render("600000.SH") == "600000.SH#1"
+    assert render(" 600000.sh") == "600000.SH#1"
+    changed("test-source")
+    assert render("600000.SH") == "600000.SH#2"
+    assert len(calls) == 2
+
+
+def test_memoize_skips_no_store():
+    calls = []
+
+    @memoize(lambda: "tenant", "test")
+    def failing(ts_code: str) -> str:
+        memo.no_store()
+        calls.append(ts_code)
+        return "查询失败"
+
+    failing("600000.SH")
+    failing("600000.SH")
+    assert len(calls) == 2
+
+
+def test_memoize_without_scope_does_not_cache():
+    calls = []
+
+    @memoize(lambda: None, "test")
+    def render(ts_code: str) -> str:
+        calls.append(ts_code)
+        return ts_code
+
+    render("600000.SH")
+    render("600000.SH")
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize("make_backend", [
+    lambda path: LocalBackend(capacity=2, ttl=60),
+    lambda path: SqliteBackend(str(path / "memo.sqlite"), capacity=2, ttl=60),
+])
+def test_backends_store_and_invalidate(make_backend, tmp_path):
+    store = make_backend(tmp_path)
+    assert store.get("k") is None
+    store.set("k", "文本", {"src": 0})
+    assert store.get("k") == ("文本", {"src": 0})
+    assert store.versions(["src", "other"]) == [0, 0]
+    store.bump(["src"])
+    assert store.versions(["src"]) == [1]
+    store.delete("k")
+    assert store.get("k") is None
+
+
+def test_sqlite_backend_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "memo.sqlite")
+    first, second = SqliteBackend(path, ttl=60), SqliteBackend(path, ttl=60)
+    first.set("k", {"rows": [1]}, {"src": 0})
+    assert second.get("k") == ({"rows": [1]}, {"src": 0})
+    second.bump(["src"])
+    assert first.versions(["src"]) == [1]
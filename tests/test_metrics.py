@@ -0,0 +1,77 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import metrics
+from metrics import FanOut, instrument, record_phase
+from statement_store import StatementStore
+
+CODES = ["600000.SH", "600036.SH", "000001.SZ", "000002.SZ"]
+UPSTREAM = 0.2
+
+
+def slow_fetch(ts_code: str, **params) -> pd.DataFrame:
+    """每次拉取耗时 UPSTREAM 秒并计入上游阶段（与 TushareClient 的记录方式相同）"""
+    time.sleep(UPSTREAM)
+    record_phase("upstream", UPSTREAM)
+    return pd.DataFrame([{"ts_code": ts_code, "ann_date": "20240420", "end_date": "20231231",
+                          "report_type": "1", "update_flag": "1"}])
+
+
+def test_get_many_counts_fan_out_upstream_once(tmp_path):
+    store = StatementStore("income", slow_fetch, "ts_code,ann_date,end_date,report_type,update_flag", root=tmp_path)
+    phases = {}
+    token = metrics._phases.set(phases)
+    try:
+        start = time.perf_counter()
+        df, errors = store.get_many(CODES)
+        elapsed = time.perf_counter() - start
+    finally:
+        metrics._phases.reset(token)
+
+    assert errors == {}
+    assert sorted(df["ts_code"]) == sorted(CODES)
+    # 并发拉取：上游阶段按关键路径计入，不超过扇出的墙钟时间，而不是各线程之和
+    assert UPSTREAM <= phases["upstream"] <= elapsed
+    assert phases["upstream"] < UPSTREAM * len(CODES)
+
+
+def test_fan_out_uses_slowest_thread():
+    barrier = threading.Barrier(2)
+
+    def task(seconds):
+        # 两个任务同时进行，分别落在两个工作线程上
+        barrier.wait(5)
+        record_phase("upstream", seconds)
+        record_phase("rate_limit_wait", 0.1)
+
+    phases = {"serialization": 0.1}
+    token = metrics._phases.set(phases)
+    try:
+        with FanOut() as fan_out, ThreadPoolExecutor(max_workers=2) as pool:
+            for seconds in (0.3, 0.5):
+                pool.submit(contextvars.copy_context().run, fan_out.run, task, seconds)
+    finally:
+        metrics._phases.reset(token)
+    assert phases == {"serialization": 0.1, "upstream": 0.5, "rate_limit_wait": 0.1}
+
+
+def test_fan_out_outside_tool_call_records_nothing():
+    with FanOut() as fan_out:
+        assert fan_out.run(lambda x: x + 1, 1) == 2
+    assert metrics._phases.get() is None
+
+
+def test_instrument_records_phases_in_render():
+    @instrument
+    def sample_tool():
+        record_phase("upstream", 0.01)
+        return "ok"
+
+    assert sample_tool() == "ok"
+    text = metrics.render()
+    assert 'tool="sample_tool"' in text
+    assert 'phase="upstream"' in text
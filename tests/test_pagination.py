@@ -0,0 +1,77 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from frames import decode_cursor, encode_cursor
+
+QUERY = {"tool": "get_stock_basic_info", "ts_code": "", "list_status": "L"}
+ROWS = pd.DataFrame({"ts_code": [f"{i:06d}.SZ" for i in range(1, 8)]})
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor(200, QUERY)
+    assert decode_cursor(cursor, dict(QUERY)) == 200
+
+
+def test_cursor_bound_to_query():
+    cursor = encode_cursor(200, QUERY)
+    with pytest.raises(ValueError):
+        decode_cursor(cursor, {**QUERY, "list_status": "D"})
+
+
+@pytest.mark.parametrize("cursor", ["", "not-a-cursor", "eyJvIjogLTF9"])
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor, QUERY)
+
+
+def fetch_page(start, size):
+    return ROWS.iloc[start:start + size], len(ROWS)
+
+
+class StreamingContext:
+    """带 progressToken 的请求上下文，记录推送的进度通知"""
+
+    def __init__(self):
+        self.request_context = SimpleNamespace(meta=SimpleNamespace(progressToken="p1"))
+        self.messages = []
+
+    async def report_progress(self, progress, total, message):
+        self.messages.append(json.loads(message))
+
+
+def payload(result):
+    return json.loads(result.content[0].text)
+
+
+def test_paged_result_walks_all_pages():
+    from app_http import paged_result
+    seen, cursor = [], ""
+    for _ in range(10):
+        page = payload(asyncio.run(paged_result(None, fetch_page, QUERY, cursor, 3, "records", False)))
+        assert page["total"] == len(ROWS)
+        seen += [row["ts_code"] for row in page["data"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == ROWS["ts_code"].tolist()
+
+
+def test_paged_result_rejects_cursor_from_other_query():
+    from app_http import paged_result
+    cursor = encode_cursor(3, {**QUERY, "list_status": "D"})
+    with pytest.raises(ValueError):
+        asyncio.run(paged_result(None, fetch_page, QUERY, cursor, 3, "records", False))
+
+
+def test_stream_pushes_pages_as_progress():
+    from app_http import paged_result
+    ctx = StreamingContext()
+    summary = payload(asyncio.run(paged_result(ctx, fetch_page, QUERY, "", 3, "columns", True)))
+    assert summary == {"streamed": True, "pages": 3, "rows": len(ROWS)}
+    assert [len(m["data"]["data"]) for m in ctx.messages] == [3, 3, 1]
+    assert ctx.messages[-1]["next_cursor"] is None
+    assert decode_cursor(ctx.messages[0]["next_cursor"], QUERY) == 3
@@ -0,0 +1,115 @@
+import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from prefetch import MAX_ATTEMPTS, PrefetchScheduler, parse_codes
+from statement_store import INCOME_FIELDS, StatementStore
+
+
+class Universe:
+    def __init__(self):
+        self.refreshes = 0
+
+    def refresh(self):
+        self.refreshes += 1
+
+
+@pytest.fixture
+def tenant(fake, fetch, tmp_path):
+    """默认租户替身：报表存储和披露日历来自 fake，hidden 中的报告期暂不返回（模拟尚未披露）"""
+    income = fetch("income")
+    hidden = set()
+
+    def fetch_income(**params):
+        df = income(**params)
+        return df[~df["end_date"].isin(hidden)].reset_index(drop=True)
+
+    client = SimpleNamespace(disclosure_date=fetch("disclosure_date"), index_weight=fetch("index_weight"))
+    return SimpleNamespace(
+        client=client,
+        income_store=StatementStore("income", fetch_income, INCOME_FIELDS, root=tmp_path),
+        universe=Universe(),
+        hidden=hidden,
+    )
+
+
+@pytest.fixture
+def codes(fake):
+    return [row["ts_code"] for row in fake.stocks if row["list_status"] == "L"][:2]
+
+
+def announced(period: str) -> datetime.datetime:
+    """fake 中该报告期的实际披露日"""
+    year = int(period[:4]) + (1 if period.endswith("1231") else 0)
+    month_day = {"0331": "0428", "0630": "0828", "0930": "1028", "1231": "0425"}[period[4:]]
+    return datetime.datetime.strptime(f"{year}{month_day}12", "%Y%m%d%H")
+
+
+def test_parse_codes():
+    assert parse_codes(" 600000.sh,,000001.SZ,600000.SH ") == ["600000.SH", "000001.SZ"]
+
+
+def test_no_tenant_is_a_no_op(codes):
+    scheduler = PrefetchScheduler(lambda: None, codes, [])
+    scheduler.run_once()
+    assert scheduler.status()["runs"] == 0
+
+
+def test_first_run_fills_missing_watchlist(tenant, codes, fake):
+    scheduler = PrefetchScheduler(lambda: tenant, codes, [])
+    now = announced(fake.periods[-1]) - datetime.timedelta(days=30)
+    scheduler.run_once(now)
+    for code in codes:
+        assert tenant.income_store.peek(code) is not None
+    status = scheduler.status()
+    assert status["prefetched"] == len(codes) and status["pending"] == 0
+    assert status["checked_through"] == now.strftime("%Y%m%d")
+
+
+def test_new_disclosure_is_synced(tenant, codes, fake):
+    period = fake.periods[-1]
+    tenant.hidden.add(period)
+    scheduler = PrefetchScheduler(lambda: tenant, codes, [])
+    scheduler.run_once(announced(period) - datetime.timedelta(days=2))
+    assert not (tenant.income_store.peek(codes[0])["end_date"] == period).any()
+
+    tenant.hidden.clear()
+    scheduler.run_once(announced(period))
+    for code in codes:
+        assert (tenant.income_store.peek(code)["end_date"] == period).any()
+    assert scheduler.status()["pending"] == 0
+
+
+def test_delayed_disclosure_is_retried_then_dropped(tenant, codes, fake):
+    period = fake.periods[-1]
+    tenant.hidden.add(period)
+    scheduler = PrefetchScheduler(lambda: tenant, codes[:1], [])
+    scheduler.run_once(announced(period) - datetime.timedelta(days=2))
+    # 披露日历已显示披露，但上游还没有该期数据
+    day = announced(period)
+    for attempt in range(MAX_ATTEMPTS):
+        assert scheduler.status()["pending"] == (0 if attempt == 0 else 1)
+        scheduler.run_once(day)
+    assert scheduler.status()["pending"] == 0
+
+
+def test_nightly_refresh_runs_once_per_day_after_hour(tenant, codes):
+    scheduler = PrefetchScheduler(lambda: tenant, codes, [], nightly_hour=2)
+    start = datetime.datetime(2025, 6, 1, 12)
+    scheduler.run_once(start)
+    # 启动当天不刷新
+    assert tenant.universe.refreshes == 0
+    scheduler.run_once(start + datetime.timedelta(hours=13))
+    assert tenant.universe.refreshes == 0
+    scheduler.run_once(start + datetime.timedelta(hours=15))
+    scheduler.run_once(start + datetime.timedelta(hours=16))
+    assert tenant.universe.refreshes == 1
+
+
+def test_index_constituents_join_watchlist(tenant, fake):
+    scheduler = PrefetchScheduler(lambda: tenant, [], ["000300.SH"])
+    scheduler.run_once(datetime.datetime(2025, 6, 1, 12))
+    listed = [row["ts_code"] for row in fake.stocks if row["list_status"] == "L"]
+    assert scheduler.status()["watchlist"] == len(listed)
+    assert all(tenant.income_store.peek(code) is not None for code in listed)
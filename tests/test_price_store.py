@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from price_store import PriceStore, adjust
+
+
+def frame(closes, factors):
+    closes = np.asarray(closes, dtype=float)
+    pre = np.concatenate([[closes[0]], closes[:-1]])
+    return pd.DataFrame({
+        "open": closes, "high": closes, "low": closes, "close": closes, "pre_close": pre,
+        "change": closes - pre, "adj_factor": factors,
+    })
+
+
+def test_qfq_keeps_latest_prices():
+    df = adjust(frame([10.0, 5.0, 5.5], [1.0, 2.0, 2.0]), "qfq")
+    assert df["close"].tolist() == [5.0, 5.0, 5.5]
+    assert df["change"].iloc[-1] == pytest.approx(0.5)
+
+
+def test_hfq_scales_by_factor():
+    df = adjust(frame([10.0, 5.0], [1.0, 2.0]), "hfq")
+    assert df["close"].tolist() == [10.0, 10.0]
+
+
+def test_missing_factors_are_filled():
+    df = adjust(frame([10.0, 5.0, 5.0], [1.0, np.nan, 2.0]), "qfq")
+    assert df["close"].tolist() == [5.0, 2.5, 5.0]
+
+
+def test_unadjusted_is_unchanged():
+    df = frame([10.0, 5.0], [1.0, 2.0])
+    assert adjust(df.copy(), "").equals(df)
+
+
+def test_all_missing_factors_raise():
+    with pytest.raises(ValueError):
+        adjust(frame([10.0], [np.nan]), "qfq")
+
+
+@pytest.fixture
+def store(fetch, tmp_path):
+    return PriceStore(fetch("daily"), fetch("adj_factor"), root=tmp_path)
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"ts_code": "../600000.SH"},
+    {"ts_code": "600000.SH", "start_date": "2024-01-01"},
+    {"ts_code": "600000.SH", "end_date": "2024"},
+    {"ts_code": "600000.SH", "adj": "bfq"},
+])
+def test_get_rejects_invalid_arguments(store, tmp_path, kwargs):
+    with pytest.raises(ValueError):
+        store.get(**kwargs)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_get_filters_dates_newest_first(store, fake):
+    code = fake.stocks[0]["ts_code"]
+    full = store.get(code)
+    assert not full.empty
+    assert full["trade_date"].is_monotonic_decreasing
+    dates = sorted(full["trade_date"])
+    start, end = dates[10], dates[20]
+    window = store.get(code, start_date=start, end_date=end)
+    assert window["trade_date"].tolist() == sorted(dates[10:21], reverse=True)
+    qfq = store.get(code, adj="qfq")
+    assert qfq["close"].iloc[0] == pytest.approx(full["close"].iloc[0])
@@ -0,0 +1,140 @@
+import time
+
+import pandas as pd
+import pytest
+import requests
+
+import tushare_client
+from resilience import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+    backoff,
+    describe_age,
+    is_transient,
+    stale_age,
+    stale_message,
+)
+from statement_store import INCOME_FIELDS, StatementStore
+from tushare_client import TushareClient
+
+
+def test_opens_after_threshold_failures():
+    breaker = CircuitBreaker(threshold=3, cooldown=60)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_success_resets_failure_count():
+    breaker = CircuitBreaker(threshold=2, cooldown=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+
+
+def test_half_open_allows_single_trial():
+    breaker = CircuitBreaker(threshold=1, cooldown=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.state == HALF_OPEN
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    # 试探失败重新熔断，成功则恢复
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    time.sleep(0.06)
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    breaker.before_call()
+
+
+def test_backoff_is_capped():
+    for attempt in range(10):
+        assert 0 <= backoff(attempt, base=0.5, cap=2) <= 2
+
+
+def test_only_network_errors_are_transient():
+    assert is_transient(requests.ConnectionError())
+    assert is_transient(requests.Timeout())
+    assert not is_transient(Exception("抱歉，您没有访问该接口的权限"))
+
+
+def test_transient_errors_are_retried():
+    class Flaky:
+        calls = 0
+
+        def query(self, api_name, **params):
+            self.calls += 1
+            if self.calls == 1:
+                raise requests.ConnectionError("reset")
+            return pd.DataFrame({"ok": [1]})
+
+    pro = Flaky()
+    client = TushareClient(lambda: pro, {"default": 600}, retries=1)
+    assert client.income(ts_code="600000.SH")["ok"].tolist() == [1]
+    assert pro.calls == 2
+
+
+def test_open_circuit_rejects_without_calling_upstream(monkeypatch):
+    monkeypatch.setattr(tushare_client, "backoff", lambda attempt: 0)
+
+    class Down:
+        calls = 0
+
+        def query(self, api_name, **params):
+            self.calls += 1
+            raise requests.ConnectionError("reset")
+
+    pro = Down()
+    client = TushareClient(lambda: pro, {"default": 600}, retries=0)
+    client.breaker = CircuitBreaker(threshold=2, cooldown=60)
+    for _ in range(2):
+        with pytest.raises(requests.ConnectionError):
+            client.income(ts_code="600000.SH")
+    with pytest.raises(CircuitOpenError):
+        client.income(ts_code="600000.SH")
+    assert pro.calls == 2
+
+
+def test_stale_statements_are_flagged_while_refreshing(fetch, tmp_path):
+    income = fetch("income")
+    calls = []
+
+    def flaky(**params):
+        calls.append(params)
+        if len(calls) > 1:
+            raise requests.ConnectionError("upstream down")
+        return income(**params)
+
+    store = StatementStore("income", flaky, INCOME_FIELDS, root=tmp_path, ttl=0.05)
+    fresh = store.get("600000.SH")
+    assert stale_age(fresh) is None
+    time.sleep(0.1)
+
+    # 过期后立即返回旧数据并标记年龄，后台刷新失败时继续使用旧数据
+    stale = store.get("600000.SH")
+    assert stale_age(stale) >= 0.05
+    assert stale.equals(fresh)
+    deadline = time.monotonic() + 5
+    while len(calls) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(calls) == 2
+    assert store.get("600000.SH").equals(fresh)
+
+
+def test_describe_age():
+    assert describe_age(30) == "30秒"
+    assert describe_age(600) == "10分钟"
+    assert describe_age(3 * 3600) == "3小时"
+    assert describe_age(3 * 86400) == "3天"
+    assert "3小时" in stale_message(3 * 3600)
@@ -0,0 +1,143 @@
+import datetime
+import operator
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from screener import (
+    SCREEN_FIELDS,
+    RatioScreener,
+    compute_ratios,
+    disclosure_closed,
+    parse_conditions,
+    recent_periods,
+)
+from stock_universe import StockUniverse, load_stock_basic
+
+
+def test_parse_conditions():
+    assert parse_conditions("net_margin>20, revenue_yoy >= -5.5 and gross_margin=30") == [
+        ("net_margin", operator.gt, 20.0),
+        ("revenue_yoy", operator.ge, -5.5),
+        ("gross_margin", operator.eq, 30.0),
+    ]
+    assert parse_conditions("") == []
+
+
+@pytest.mark.parametrize("conditions", ["net_margin", "unknown>1", "net_margin>>1", "net_margin>abc"])
+def test_parse_conditions_rejects_invalid(conditions):
+    with pytest.raises(ValueError):
+        parse_conditions(conditions)
+
+
+def test_recent_periods_and_disclosure():
+    today = datetime.date(2024, 5, 15)
+    assert recent_periods(3, today) == ["20240331", "20231231", "20230930"]
+    assert not disclosure_closed("20240331", today)
+    assert not disclosure_closed("20231231", today)
+    assert disclosure_closed("20230930", today)
+    assert disclosure_closed("20231231", datetime.date(2024, 6, 1))
+
+
+def test_compute_ratios():
+    raw = pd.DataFrame([
+        {"ts_code": "A", "end_date": "20231231", "total_revenue": 100.0, "oper_cost": 60.0, "sell_exp": 10.0,
+         "admin_exp": 5.0, "fin_exp": 1.0, "operate_profit": 20.0, "n_income": 15.0, "basic_eps": 0.5},
+        {"ts_code": "A", "end_date": "20221231", "total_revenue": 80.0, "oper_cost": 50.0, "sell_exp": 8.0,
+         "admin_exp": 4.0, "fin_exp": 1.0, "operate_profit": 10.0, "n_income": -5.0, "basic_eps": 0.0},
+        {"ts_code": "B", "end_date": "20231231", "total_revenue": 0.0, "oper_cost": 1.0, "sell_exp": None,
+         "admin_exp": 0.0, "fin_exp": 0.0, "operate_profit": 0.0, "n_income": 0.0, "basic_eps": None},
+    ])
+    ratios = compute_ratios(raw).set_index(["ts_code", "end_date"])
+    a = ratios.loc[("A", "20231231")]
+    assert a["gross_margin"] == pytest.approx(40.0)
+    assert a["net_margin"] == pytest.approx(15.0)
+    assert a["sell_exp_ratio"] == pytest.approx(10.0)
+    assert a["revenue_yoy"] == pytest.approx(25.0)
+    # 上年为负时按绝对值计算增速，上年为 0 时为 NaN
+    assert a["n_income_yoy"] == pytest.approx(400.0)
+    assert np.isnan(a["eps_yoy"])
+    b = ratios.loc[("B", "20231231")]
+    assert np.isnan(b["gross_margin"]) and np.isnan(b["revenue_yoy"])
+
+
+class Pro:
+    """load_stock_basic 所需的 pro 替身"""
+
+    def __init__(self, fetch):
+        self.stock_basic = fetch("stock_basic")
+
+
+def recording(fetch, calls):
+    """记录拉取报告期的 income_vip"""
+    income_vip = fetch("income_vip")
+
+    def bulk_fetch(**params):
+        calls.append(params["period"])
+        return income_vip(**params)
+    return bulk_fetch
+
+
+@pytest.fixture
+def bulk_calls():
+    return []
+
+
+@pytest.fixture
+def screener(fetch, bulk_calls, tmp_path):
+    universe = StockUniverse(lambda: load_stock_basic(Pro(fetch)), ttl=3600)
+    return RatioScreener(recording(fetch, bulk_calls), universe, root=tmp_path, periods=8)
+
+
+def test_table_has_one_row_per_listed_stock_and_period(screener, fake, bulk_calls):
+    table = screener.table()
+    listed = {row["ts_code"] for row in fake.stocks if row["list_status"] == "L"}
+    assert set(table["ts_code"]) == listed
+    assert not table.duplicated(["ts_code", "end_date"]).any()
+    assert sorted(bulk_calls, reverse=True) == recent_periods(8)
+    assert table["name"].notna().all()
+
+
+def test_screen_filters_sorts_and_pages(screener):
+    table = screener.table()
+    period = screener.default_period(table)
+    result = screener.screen("net_margin>0", period=period, limit=0)
+    expected = table[(table["end_date"] == period) & (table["net_margin"] > 0)]
+    assert len(result) == len(expected)
+    assert result["net_margin"].is_monotonic_decreasing
+
+    industry = result["industry"].iloc[0]
+    narrowed = screener.screen("net_margin>0", industry=f"{industry}, 不存在", period=period, limit=0)
+    assert set(narrowed["industry"]) == {industry}
+
+    page = screener.screen(sort_by="total_revenue", ascending=True, period=period, limit=2, offset=1)
+    ordered = table[table["end_date"] == period].sort_values("total_revenue")
+    assert page["ts_code"].tolist() == ordered["ts_code"].iloc[1:3].tolist()
+
+
+def test_screen_rejects_unknown_sort(screener):
+    with pytest.raises(ValueError):
+        screener.screen(sort_by="price")
+
+
+def test_closed_periods_are_read_from_disk(screener, fetch, tmp_path, bulk_calls):
+    screener.table()
+    fetched = len(bulk_calls)
+    universe = StockUniverse(lambda: load_stock_basic(Pro(fetch)), ttl=3600)
+    reopened = RatioScreener(recording(fetch, bulk_calls), universe, root=tmp_path, periods=8)
+    assert len(reopened.table()) == len(screener.table())
+    # 已保存的报告期（不论是否过披露期，均在 ttl 内）不再拉取
+    assert len(bulk_calls) == fetched
+
+
+def test_bulk_fetch_requests_screen_fields(fetch, tmp_path):
+    seen = []
+
+    def bulk_fetch(**params):
+        seen.append(params["fields"])
+        return fetch("income_vip")(**params)
+
+    universe = StockUniverse(lambda: pd.DataFrame(columns=["ts_code", "list_status"]), ttl=3600)
+    RatioScreener(bulk_fetch, universe, root=tmp_path, periods=1)._period_raw(recent_periods(1)[0], False)
+    assert seen == [SCREEN_FIELDS]
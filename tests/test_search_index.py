@@ -0,0 +1,47 @@
+import pandas as pd
+import pytest
+
+from search_index import StockSearchIndex
+
+
+@pytest.fixture
+def index() -> StockSearchIndex:
+    return StockSearchIndex(pd.DataFrame([
+        {"ts_code": "600000.SH", "symbol": "600000", "name": "浦发银行", "cnspell": "pfyh", "industry": "银行", "area": "上海"},
+        {"ts_code": "600036.SH", "symbol": "600036", "name": "招商银行", "cnspell": "zsyh", "industry": "银行", "area": "深圳"},
+        {"ts_code": "000001.SZ", "symbol": "000001", "name": "平安银行", "cnspell": "payh", "industry": "银行", "area": "深圳"},
+        {"ts_code": "001600.SZ", "symbol": "001600", "name": "测试科技", "cnspell": "cskj", "industry": "软件服务", "area": "北京"},
+        {"ts_code": "300600.SZ", "symbol": "300600", "name": "深圳", "cnspell": "sz", "industry": "电子", "area": "广东"},
+    ]))
+
+
+def codes(df: pd.DataFrame):
+    return df["ts_code"].tolist()
+
+
+def test_exact_code_first(index):
+    assert codes(index.search("600000"))[0] == "600000.SH"
+    assert codes(index.search("600036.sh")) == ["600036.SH"]
+
+
+def test_code_prefix_before_substring(index):
+    # 600 开头的代码排在代码中间含 600 的之前；同一档、同一位置按名称长度排序
+    assert codes(index.search("600")) == ["600000.SH", "600036.SH", "300600.SZ", "001600.SZ"]
+
+
+def test_name_before_category(index):
+    # 名称匹配（排序档 2）排在地区匹配（排序档 3）之前；同一档内按代码排序
+    assert codes(index.search("深圳")) == ["300600.SZ", "000001.SZ", "600036.SH"]
+
+
+def test_name_and_pinyin(index):
+    assert codes(index.search("招商")) == ["600036.SH"]
+    assert codes(index.search("PAYH")) == ["000001.SZ"]
+
+
+def test_limit_offset(index):
+    everything = codes(index.search("银行", limit=0))
+    assert len(everything) == 3
+    assert codes(index.search("银行", limit=1, offset=1)) == everything[1:2]
+    assert index.search("").empty
+    assert index.search("不存在").empty
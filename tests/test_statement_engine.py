@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from statement_engine import (
+    DERIVED_COLUMNS,
+    StatementEngine,
+    derive_metrics,
+    filter_periods,
+    latest_revisions,
+    revision_history,
+)
+from statement_store import (
+    BALANCE_FIELDS,
+    CASHFLOW_FIELDS,
+    INCOME_FIELDS,
+    INDICATOR_FIELDS,
+    INDICATOR_KEY,
+    StatementStore,
+)
+
+CODE = "600000.SH"
+
+
+def test_filter_periods():
+    df = pd.DataFrame({
+        "end_date": ["20231231", "20230930", "20230630"],
+        "ann_date": ["20240420", "20231028", "20230828"],
+    })
+    assert filter_periods(df, period="20230930")["ann_date"].tolist() == ["20231028"]
+    assert filter_periods(df, start_date="20231001")["end_date"].tolist() == ["20231231", "20230930"]
+    assert filter_periods(df, end_date="20230901")["end_date"].tolist() == ["20230630"]
+
+
+def test_derive_metrics_uses_average_balances():
+    df = pd.DataFrame([
+        {"ts_code": CODE, "end_date": "20231231", "total_revenue": 200.0, "oper_cost": 150.0, "n_income": 20.0,
+         "n_income_attr_p": 18.0, "total_hldr_eqy_exc_min_int": 100.0, "total_assets": 400.0,
+         "total_liab": 300.0, "n_cashflow_act": 30.0, "c_pay_acq_const_fiolta": 10.0},
+        {"ts_code": CODE, "end_date": "20221231", "total_revenue": 100.0, "oper_cost": 80.0, "n_income": 0.0,
+         "n_income_attr_p": 0.0, "total_hldr_eqy_exc_min_int": 80.0, "total_assets": 400.0,
+         "total_liab": 320.0, "n_cashflow_act": 5.0, "c_pay_acq_const_fiolta": np.nan},
+    ])
+    latest, prior = derive_metrics(df).to_dict("records")
+    assert latest["roe_avg"] == pytest.approx(20.0)
+    assert latest["gross_margin"] == pytest.approx(25.0)
+    assert latest["debt_ratio"] == pytest.approx(75.0)
+    assert latest["fcf"] == pytest.approx(20.0)
+    assert latest["cash_conversion"] == pytest.approx(1.5)
+    # 期初缺失时只用期末值；净利润为 0 时现金转换率为 NaN
+    assert prior["roe_avg"] == pytest.approx(0.0)
+    assert np.isnan(prior["cash_conversion"])
+
+
+@pytest.fixture
+def stores(fetch, tmp_path):
+    root = tmp_path / "statements"
+    return {
+        "income": StatementStore("income", fetch("income"), INCOME_FIELDS, root=root),
+        "balancesheet": StatementStore("balancesheet", fetch("balancesheet"), BALANCE_FIELDS, root=root),
+        "cashflow": StatementStore("cashflow", fetch("cashflow"), CASHFLOW_FIELDS, root=root),
+        "fina_indicator": StatementStore("fina_indicator", fetch("fina_indicator"), INDICATOR_FIELDS, root=root,
+                                         key=INDICATOR_KEY),
+    }
+
+
+def test_frame_joins_all_statements(stores, fake):
+    engine = StatementEngine(stores)
+    df, errors = engine.frame(CODE)
+    assert errors == {}
+    assert set(df["end_date"]) == set(fake.periods)
+    assert not df.duplicated(["ts_code", "end_date"]).any()
+    assert {"total_revenue", "total_assets", "n_cashflow_act", *DERIVED_COLUMNS} <= set(df.columns)
+    assert engine.frame(CODE, period=fake.periods[-1])[0]["end_date"].tolist() == [fake.periods[-1]]
+
+
+def test_frame_reuses_join_until_data_changes(stores):
+    engine = StatementEngine(stores)
+    first, _ = engine.frame(CODE)
+    assert engine.frame(CODE.lower())[0] is first
+
+    # 更正替换了本地数据后重新合并
+    income = stores["income"]
+    original = income._fetch
+
+    def corrected(**params):
+        df = original(**params)
+        df["n_income"] = df["n_income"] * 2
+        return df
+
+    income._fetch = corrected
+    income.sync(CODE)
+    second, _ = engine.frame(CODE)
+    assert second is not first
+    # 增量刷新只重新拉取最近几期，比较最新一期
+    assert second["n_income"].iloc[0] == pytest.approx(2 * first["n_income"].iloc[0])
+
+
+def test_frame_reports_failed_statements(stores):
+    def down(**params):
+        raise ConnectionError("cashflow down")
+
+    stores["cashflow"]._fetch = down
+    df, errors = StatementEngine(stores).frame(CODE)
+    assert list(errors) == ["cashflow"]
+    assert not df.empty and "n_cashflow_act" not in df.columns
+
+
+def test_unknown_statement_and_code(stores):
+    engine = StatementEngine(stores)
+    with pytest.raises(ValueError):
+        engine.statement("dividend", CODE)
+    with pytest.raises(ValueError):
+        engine.frame("../600000.SH")
+
+
+def test_latest_revisions_keeps_one_row_per_period(fetch):
+    df = fetch("income")(ts_code=CODE)
+    assert df.duplicated(["end_date"]).any()
+
+    latest = latest_revisions(df)
+
+    assert not latest.duplicated(["ts_code", "end_date", "report_type"]).any()
+    assert set(latest["end_date"]) == set(df["end_date"])
+    # 更正报告沿用原公告日期，按实际公告日期和 update_flag 取更正后的一条
+    assert (latest["update_flag"] == "1").all()
+
+
+def test_latest_revisions_prefers_later_disclosure_over_update_flag():
+    df = pd.DataFrame([
+        {"ts_code": CODE, "end_date": "20231231", "report_type": "1", "ann_date": "20240420",
+         "f_ann_date": "20240420", "update_flag": "1", "n_income": 1.0},
+        {"ts_code": CODE, "end_date": "20231231", "report_type": "1", "ann_date": "20240601",
+         "f_ann_date": "20240601", "update_flag": "0", "n_income": 2.0},
+    ])
+    assert latest_revisions(df)["n_income"].tolist() == [2.0]
+
+
+def test_revision_history_lists_only_revised_periods(fetch):
+    df = fetch("income")(ts_code=CODE)
+    history = revision_history(df)
+
+    counts = df["end_date"].value_counts()
+    assert set(history["end_date"]) == set(counts[counts > 1].index)
+    # 报告期倒序，同一期内先原始报告后更正报告
+    assert history["end_date"].is_monotonic_decreasing
+    first = history[history["end_date"] == history["end_date"].iloc[0]]
+    assert first["update_flag"].tolist() == ["0", "1"]
+
+
+def test_statement_returns_latest_revision_per_period(stores, fake):
+    df = StatementEngine(stores).statement("income", CODE)
+    assert not df.duplicated(["end_date"]).any()
+    assert len(df) == len(fake.periods)
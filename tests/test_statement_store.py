@@ -0,0 +1,81 @@
+import pytest
+
+from statement_store import INCOME_FIELDS, StatementStore, normalize_code
+
+
+@pytest.mark.parametrize("code", ["600000.SH", " 000001.sz ", "430047.BJ"])
+def test_normalize_code_accepts_valid_codes(code):
+    assert normalize_code(code) == code.strip().upper()
+
+
+@pytest.mark.parametrize("code", ["", "600000", "../600000.SH", "600000.SH/../x", "60000.SH", "600000.HK"])
+def test_normalize_code_rejects_invalid_codes(code):
+    with pytest.raises(ValueError):
+        normalize_code(code)
+
+
+@pytest.fixture
+def store(fetch, tmp_path):
+    calls = []
+    income = fetch("income")
+    # scale 模拟上游数据被更正：同一唯一键、同一公告日期，数值不同
+    state = {"scale": 1.0}
+
+    def call(**params):
+        calls.append(params)
+        df = income(**params)
+        latest = df["end_date"] == df["end_date"].max()
+        df.loc[latest, "n_income"] = df.loc[latest, "n_income"] * state["scale"]
+        return df
+
+    store = StatementStore("income", call, INCOME_FIELDS, root=tmp_path)
+    store.calls = calls
+    store.state = state
+    return store
+
+
+def test_get_fetches_once_and_versions(store, fake):
+    code = fake.stocks[0]["ts_code"]
+    assert store.version(code) == 0
+    df = store.get(code)
+    assert not df.empty
+    assert set(df["ts_code"]) == {code}
+    version = store.version(code)
+    assert version > 0
+    # 未过期时不再访问上游，版本不变
+    store.get(code)
+    assert len(store.calls) == 1
+    assert store.version(code) == version
+    assert "start_date" not in store.calls[0]
+
+
+def test_sync_picks_up_same_date_correction(store, fake):
+    code = fake.stocks[0]["ts_code"]
+    store.state["scale"] = 0.5
+    before = store.get(code)
+    version = store.version(code)
+
+    store.state["scale"] = 1.0
+    after = store.sync(code)
+    latest = after["end_date"].max()
+    assert store.calls[-1]["start_date"] <= after.loc[after["end_date"] == latest, "ann_date"].min()
+    assert len(after) == len(before)
+    assert (after.loc[after["end_date"] == latest, "n_income"].to_numpy()
+            == 2 * before.loc[before["end_date"] == latest, "n_income"].to_numpy()).all()
+    assert store.version(code) > version
+
+    # 再次同步没有变化时版本不变
+    version = store.version(code)
+    store.sync(code)
+    assert store.version(code) == version
+
+
+def test_new_store_reads_persisted_file(store, fake, fetch, tmp_path):
+    code = fake.stocks[0]["ts_code"]
+    expected = store.get(code)
+    calls = []
+    reopened = StatementStore("income", lambda **params: calls.append(params), INCOME_FIELDS, root=tmp_path)
+    # 未过期的本地文件直接读取，不访问上游
+    assert reopened.get(code).equals(expected)
+    assert reopened.peek(code) is not None
+    assert calls == []
@@ -0,0 +1,107 @@
+import time
+
+import pytest
+
+from resilience import stale_age
+from stock_universe import StockUniverse, load_stock_basic
+
+
+class Loader:
+    """以 fake 的 stock_basic 作为上游，记录加载次数，可模拟故障"""
+
+    def __init__(self, fetch):
+        self.stock_basic = fetch("stock_basic")
+        self.calls = 0
+        self.error = None
+
+    def __call__(self):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return load_stock_basic(self)
+
+
+@pytest.fixture
+def loader(fetch):
+    return Loader(fetch)
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+
+def test_load_stock_basic_includes_all_statuses(loader, fake):
+    df = load_stock_basic(loader)
+    assert len(df) == len(fake.stocks)
+    assert set(df["list_status"]) == {row["list_status"] for row in fake.stocks}
+
+
+def test_loads_once_and_serves_from_memory(loader, fake):
+    universe = StockUniverse(loader, ttl=3600)
+    assert not universe.loaded
+    listed = universe.listed()
+    universe.frame()
+    universe.search("银行")
+    assert loader.calls == 1
+    assert (listed["list_status"] == "L").all()
+    code = fake.stocks[1]["ts_code"]
+    assert universe.name_of(code.lower()) == fake.stocks[1]["name"]
+    assert universe.get("999999.SH") is None
+
+
+def test_select_matches_stock_basic_semantics(loader, fake):
+    universe = StockUniverse(loader, ttl=3600)
+    listed = [row for row in fake.stocks if row["list_status"] == "L"]
+    assert len(universe.select()) == len(listed)
+    sse = universe.select(exchange="sse")
+    assert len(sse) == sum(row["exchange"] == "SSE" for row in listed)
+    name = listed[0]["name"]
+    assert universe.select(name=name[:2], fuzzy_name=True)["name"].str.contains(name[:2]).all()
+    # 非模糊匹配时名称须完全相同
+    assert universe.select(name=name[:2]).empty
+    assert (universe.select(name=name)["name"] == name).all()
+    delisted = [row for row in fake.stocks if row["list_status"] == "D"]
+    assert len(universe.select(list_status="D")) == len(delisted)
+
+
+def test_stale_data_is_flagged_and_refreshed_in_background(loader):
+    universe = StockUniverse(loader, ttl=0.05)
+    universe.frame()
+    time.sleep(0.1)
+    df = universe.select()
+    assert stale_age(df) >= 0.05
+    wait_for(lambda: loader.calls == 2)
+
+
+def test_failed_refresh_keeps_old_data(loader):
+    universe = StockUniverse(loader, ttl=3600)
+    before = universe.frame()
+    loader.error = RuntimeError("upstream down")
+    with pytest.raises(RuntimeError):
+        universe.refresh()
+    assert universe.frame() is before
+
+
+def test_persisted_list_is_reused_until_expiry(loader, tmp_path):
+    path = tmp_path / "stock_basic.parquet"
+    StockUniverse(loader, ttl=3600, path=path).frame()
+    assert path.exists()
+    # 新进程（或另一个 worker）直接读取未过期的文件
+    reloaded = StockUniverse(loader, ttl=3600, path=path)
+    assert len(reloaded.frame()) == len(StockUniverse(loader, ttl=3600, path=path).frame())
+    assert loader.calls == 1
+    StockUniverse(loader, ttl=0, path=path).frame()
+    assert loader.calls == 2
+
+
+def test_invalidate_forces_reload(loader):
+    universe = StockUniverse(loader, ttl=3600)
+    universe.frame()
+    universe.invalidate()
+    assert not universe.loaded
+    universe.frame()
+    assert loader.calls == 2
@@ -0,0 +1,112 @@
+import base64
+import json
+
+import pandas as pd
+import pytest
+import requests
+
+import tenants
+import tushare_client
+from tenants import InvalidToken, TenantRegistry, namespace_of, token_from_request
+
+# 上游对这些 token 的响应：无效 token 和网络故障
+BAD = "bad-token"
+DOWN = "down-token"
+
+
+@pytest.fixture
+def upstream(fake, tmp_path, monkeypatch):
+    """以 fake 代替 Tushare 服务端，记录每个 token 的调用次数"""
+    calls = {}
+
+    class FakeApi:
+        def __init__(self, token):
+            self.token = token
+
+        def query(self, api_name, **params):
+            calls[self.token] = calls.get(self.token, 0) + 1
+            if self.token == BAD:
+                raise Exception("您的token不对，请确认。")
+            if self.token == DOWN:
+                raise requests.ConnectionError("connection reset")
+            data = fake.handle(api_name, params, params.get("fields", ""))["data"]
+            return pd.DataFrame(data["items"], columns=data["fields"])
+
+    monkeypatch.setattr(tenants, "PooledDataApi", FakeApi)
+    monkeypatch.setattr(tenants, "DATA_DIR", tmp_path)
+    monkeypatch.setattr(tushare_client, "backoff", lambda attempt: 0)
+    return calls
+
+
+def test_token_from_request():
+    assert token_from_request({"x-tushare-token": " abc "}, {}) == "abc"
+    assert token_from_request({}, {"TUSHARE_TOKEN": "abc"}) == "abc"
+    config = base64.urlsafe_b64encode(json.dumps({"TUSHARE_TOKEN": "abc"}).encode()).decode().rstrip("=")
+    assert token_from_request({}, {"config": config}) == "abc"
+    assert token_from_request({}, {"config": "not base64"}) is None
+    assert token_from_request({"x-tushare-token": "  "}, {}) is None
+
+
+def test_verified_tenant_gets_directory(upstream, tmp_path):
+    registry = TenantRegistry()
+    tenant = registry.get("good")
+    assert tenant.root == tmp_path / "tenants" / namespace_of("good")
+    assert tenant.root.is_dir()
+    assert registry.get("good") is tenant
+    assert upstream["good"] == 1
+
+
+def test_existing_directory_skips_verification(upstream, tmp_path):
+    (tmp_path / "tenants" / namespace_of(BAD)).mkdir(parents=True)
+    registry = TenantRegistry()
+    assert registry.get(BAD).namespace == namespace_of(BAD)
+    assert BAD not in upstream
+
+
+def test_lru_evicts_least_recently_used(upstream):
+    registry = TenantRegistry(capacity=2)
+    first = registry.get("a")
+    registry.get("b")
+    assert registry.get("a") is first
+    registry.get("c")
+    assert registry.cached("a") and registry.cached("c")
+    assert not registry.cached("b")
+    assert len(registry) == 2
+
+
+def test_default_tenant_is_shared_and_never_evicted(upstream, tmp_path):
+    registry = TenantRegistry("default", capacity=1)
+    assert registry.get(None) is registry.default
+    assert registry.get("default") is registry.default
+    assert registry.default.root == tmp_path
+    registry.get("a")
+    registry.get("b")
+    assert registry.cached("default") and registry.cached(None)
+    assert "default" not in upstream
+
+
+def test_rejected_token_is_cached_until_expiry(upstream, tmp_path, monkeypatch):
+    registry = TenantRegistry()
+    with pytest.raises(InvalidToken):
+        registry.get(BAD)
+    assert not (tmp_path / "tenants").exists()
+    with pytest.raises(InvalidToken):
+        registry.get(BAD)
+    assert upstream[BAD] == 1
+
+    monkeypatch.setattr(tenants, "REJECT_TTL", 0.0)
+    with pytest.raises(InvalidToken):
+        registry.get(BAD)
+    assert upstream[BAD] == 2
+
+
+def test_transient_failure_is_not_cached(upstream, tmp_path):
+    registry = TenantRegistry()
+    with pytest.raises(requests.ConnectionError):
+        registry.get(DOWN)
+    calls = upstream[DOWN]
+    with pytest.raises(requests.ConnectionError):
+        registry.get(DOWN)
+    assert upstream[DOWN] > calls
+    assert not (tmp_path / "tenants").exists()
+    assert not registry.cached(DOWN)
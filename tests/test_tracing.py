@@ -0,0 +1,189 @@
+import inspect
+import json
+import time
+
+import pytest
+
+import tracing
+from tracing import Exporter, Profiler, add_span, event, record_exception, span, summarize_args, to_otlp, trace
+
+
+def sample_tool(ts_code: str, token: str = "", fields: str = "", codes: list = None, ctx=None):
+    return ts_code
+
+
+SIGNATURE = inspect.signature(sample_tool)
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT_ID = "00f067aa0ba902b7"
+
+
+def run_tool(args=("600000.SH",), kwargs=None, fail=False) -> tracing.Trace:
+    """模拟一次工具调用：一个服务层 span，其中有排队等待、缓存事件和一次上游调用"""
+    with trace("sample_tool", SIGNATURE, args, kwargs or {}) as current:
+        with span("income_statement"):
+            event("cache", cache="result", result="miss")
+            add_span("rate_limit_wait", 0.01)
+            with span("tushare.income", kind=tracing.KIND_CLIENT, api="income"):
+                time.sleep(0.005)
+                if fail:
+                    try:
+                        raise ValueError("上游返回空数据")
+                    except ValueError as e:
+                        record_exception(e)
+    return current
+
+
+def test_slow_call_prints_span_tree(monkeypatch, capsys):
+    monkeypatch.setattr(tracing, "SLOW_CALL_MS", 0.001)
+    current = run_tool(kwargs={"token": "secret-token"})
+
+    err = capsys.readouterr().err
+    lines = err.strip().splitlines()
+    assert lines[0].startswith("[trace] slow call sample_tool ")
+    assert f"request_id={current.trace_id}" in lines[0]
+    assert '"ts_code": "600000.SH"' in lines[0]
+    assert "secret-token" not in err and '"token": "***"' in lines[0]
+    # 子 span 按层级缩进，属性和缓存事件附在名称之后
+    assert any(line.startswith("[trace]     income_statement ") and "result:miss" in line for line in lines)
+    assert any(line.startswith("[trace]       rate_limit_wait ") for line in lines)
+    assert any(line.startswith("[trace]       tushare.income ") and "api=income" in line for line in lines)
+
+
+def test_fast_call_is_not_logged(monkeypatch, capsys):
+    monkeypatch.setattr(tracing, "SLOW_CALL_MS", 60_000)
+    run_tool()
+    assert "[trace]" not in capsys.readouterr().err
+
+
+def test_summarize_args_truncates_and_hides_token():
+    summary = summarize_args(
+        SIGNATURE,
+        ("600000.SH",),
+        {"token": "abc", "fields": "x" * 100, "codes": [f"{i:06d}.SZ" for i in range(8)], "ctx": object()},
+    )
+    assert summary["ts_code"] == "600000.SH"
+    assert summary["token"] == "***"
+    assert summary["fields"] == "x" * tracing.SUMMARY_CHARS + "...(100)"
+    assert len(summary["codes"]) == tracing.SUMMARY_ITEMS + 1
+    assert summary["codes"][-1] == "...(8)"
+    assert "ctx" not in summary
+
+
+def test_record_exception_marks_call_failed():
+    assert record_exception(ValueError("x")) is None
+    with trace("sample_tool", SIGNATURE, ("600000.SH",), {}) as current:
+        assert record_exception(ValueError("x")) == current.trace_id == tracing.request_id()
+
+    current = run_tool(fail=True)
+    assert current.root.error == "ValueError: 上游返回空数据"
+    failed = next(s for s in current.spans if s.name == "tushare.income")
+    assert any(name == "exception" for _, name, _ in failed.events)
+
+
+def test_spans_outside_a_call_are_noops():
+    with span("orphan") as current:
+        assert current is None
+    add_span("rate_limit_wait", 0.1)
+    event("cache", cache="result", result="hit")
+    assert tracing.request_id() is None
+
+
+def test_max_spans_drops_extra(monkeypatch, capsys):
+    monkeypatch.setattr(tracing, "MAX_SPANS", 3)
+    monkeypatch.setattr(tracing, "SLOW_CALL_MS", 0.001)
+    with trace("sample_tool", SIGNATURE, ("600000.SH",), {}) as current:
+        for i in range(5):
+            with span(f"step{i}"):
+                pass
+    assert len(current.spans) == 3
+    assert current.dropped == 3
+    assert "3 more spans not recorded" in capsys.readouterr().err
+
+
+def test_to_otlp_links_parents_and_status():
+    current = run_tool(fail=True)
+    spans = to_otlp([current])["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    by_name = {s["name"]: s for s in spans}
+
+    root = by_name["tool.sample_tool"]
+    assert "parentSpanId" not in root
+    assert root["kind"] == tracing.KIND_SERVER
+    assert root["status"]["code"] == tracing.STATUS_ERROR
+    service = by_name["income_statement"]
+    assert service["parentSpanId"] == root["spanId"]
+    assert by_name["tushare.income"]["parentSpanId"] == service["spanId"]
+    assert by_name["rate_limit_wait"]["status"] == {"code": tracing.STATUS_OK}
+    assert all(s["traceId"] == current.trace_id for s in spans)
+    assert {"key": "api", "value": {"stringValue": "income"}} in by_name["tushare.income"]["attributes"]
+
+
+def test_exporter_appends_one_line_per_trace(monkeypatch, tmp_path):
+    path = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(tracing, "exporter", Exporter(path=str(path)))
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE", 1.0)
+    first, second = run_tool(), run_tool(("000001.SZ",))
+
+    deadline = time.monotonic() + tracing.EXPORT_INTERVAL + 5
+    while time.monotonic() < deadline and tracing.exporter.status()["exported"] < 2:
+        time.sleep(0.05)
+
+    lines = path.read_text().splitlines()
+    assert len(lines) == 2
+    ids = [json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"][0]["traceId"] for line in lines]
+    assert ids == [first.trace_id, second.trace_id]
+    assert tracing.exporter.status()["file"] == str(path)
+
+
+def test_incoming_traceparent_is_reused(monkeypatch):
+    monkeypatch.setattr(tracing, "_parent_source", None)
+    tracing.set_parent_source(lambda: f"00-{TRACE_ID}-{PARENT_ID}-01")
+    current = run_tool()
+    assert current.trace_id == TRACE_ID
+    assert current.root.parent_id == PARENT_ID
+
+    # 格式不对或不在请求中时生成新的 trace_id
+    tracing.set_parent_source(lambda: "00-bad-header")
+    assert run_tool().trace_id != TRACE_ID
+
+    def outside_request():
+        raise RuntimeError("no request")
+
+    tracing.set_parent_source(outside_request)
+    assert len(run_tool().trace_id) == 32
+
+
+def test_profiler_configure_and_report(tmp_path, capsys):
+    profiler = Profiler(directory=tmp_path)
+    with pytest.raises(ValueError):
+        profiler.configure(1.0, engine="yappi")
+
+    config = profiler.configure(1.0, tools=["sample_tool"])
+    assert config == {"sample": 1.0, "tools": ["sample_tool"], "engine": "cprofile"}
+    assert json.loads((tmp_path / "profiler.json").read_text()) == config
+    assert profiler.sampled("sample_tool")
+    assert not profiler.sampled("other_tool")
+
+    # 其他 worker 读取同一份配置
+    assert Profiler(directory=tmp_path).config() == config
+
+    current = tracing.Trace("tool.sample_tool")
+    current.profile = True
+    token = tracing._current.set(current.root)
+    try:
+        with profiler.run():
+            sum(range(1000))
+    finally:
+        tracing._current.reset(token)
+
+    stem = current.root.attributes["profile"]
+    assert [p["id"] for p in profiler.recent()] == [stem]
+    assert "cumulative" in profiler.report(current.trace_id)
+    assert profiler.report("../etc") is None
+    assert profiler.report("ffff") is None
+
+
+def test_profiler_rejects_missing_pyinstrument(monkeypatch, tmp_path):
+    monkeypatch.setattr(tracing.importlib.util, "find_spec", lambda name: None)
+    with pytest.raises(ImportError):
+        Profiler(directory=tmp_path).configure(1.0, engine="pyinstrument")
+    assert not (tmp_path / "profiler.json").exists()
@@ -0,0 +1,182 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+import tushare_client
+from tushare_client import RateLimitTimeout, TokenBucket, TushareClient, UpstreamRateLimited, background
+
+
+class CountingPro:
+    """记录调用次数的 pro_api 替身，可指定抛出的错误"""
+
+    def __init__(self, error: Exception = None):
+        self.calls = 0
+        self.error = error
+
+    def query(self, api_name, **params):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return pd.DataFrame({"api": [api_name]})
+
+
+def test_bucket_allows_burst_then_queues():
+    bucket = TokenBucket(rate_per_minute=60, burst=2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    # 每秒一个令牌，第三个需要等约一秒，第四个约两秒
+    assert bucket.reserve() == pytest.approx(1.0, abs=0.05)
+    assert bucket.reserve() == pytest.approx(2.0, abs=0.05)
+
+
+def test_bucket_try_take_and_cancel():
+    bucket = TokenBucket(rate_per_minute=60, burst=1)
+    assert bucket.try_take()
+    assert not bucket.try_take()
+    bucket.cancel()
+    assert bucket.try_take()
+
+
+def test_bucket_pause():
+    bucket = TokenBucket(rate_per_minute=600, burst=5)
+    bucket.pause(3)
+    assert bucket.reserve() == pytest.approx(3.1, abs=0.05)
+
+
+def test_queue_longer_than_max_wait_fails_fast():
+    client = TushareClient(CountingPro, {"default": 60}, max_wait=0.5)
+    for _ in range(20):
+        client.bucket("income").reserve()
+    start = time.monotonic()
+    with pytest.raises(RateLimitTimeout):
+        client.income(ts_code="600000.SH")
+    assert time.monotonic() - start < 0.5
+
+
+class LimitedPro(CountingPro):
+    """前 limited 次调用返回上游限流错误"""
+
+    def __init__(self, limited: int):
+        super().__init__()
+        self.limited = limited
+
+    def query(self, api_name, **params):
+        self.calls += 1
+        if self.calls <= self.limited:
+            raise Exception("抱歉，您每分钟最多访问该接口200次")
+        return pd.DataFrame({"api": [api_name]})
+
+
+def test_upstream_rate_limit_requeues_behind_cooldown(monkeypatch):
+    monkeypatch.setattr(tushare_client, "RATE_LIMIT_COOLDOWN", 0.3)
+    pro = LimitedPro(limited=1)
+    client = TushareClient(lambda: pro, {"default": 600}, max_wait=5, retries=0)
+    start = time.monotonic()
+    assert client.income(ts_code="600000.SH")["api"].tolist() == ["income"]
+    assert time.monotonic() - start >= 0.3
+    assert pro.calls == 2
+
+
+def test_upstream_rate_limit_fails_fast_when_cooldown_exceeds_max_wait(monkeypatch):
+    monkeypatch.setattr(tushare_client, "RATE_LIMIT_COOLDOWN", 60)
+    pro = LimitedPro(limited=1)
+    client = TushareClient(lambda: pro, {"default": 600}, max_wait=1, retries=0)
+    start = time.monotonic()
+    with pytest.raises(UpstreamRateLimited):
+        client.income(ts_code="600000.SH")
+    # 冷却期内的调用排队超过 max_wait，同样立即失败，不再请求上游
+    with pytest.raises(RateLimitTimeout):
+        client.income(ts_code="600000.SH")
+    assert time.monotonic() - start < 1
+    assert pro.calls == 1
+
+
+def test_async_upstream_rate_limit_requeues(monkeypatch):
+    monkeypatch.setattr(tushare_client, "RATE_LIMIT_COOLDOWN", 0.2)
+    pro = LimitedPro(limited=1)
+    client = TushareClient(lambda: pro, {"default": 600}, max_wait=5, retries=0)
+    result = asyncio.run(client.aquery("income", ts_code="600000.SH"))
+    assert result["api"].tolist() == ["income"]
+    assert pro.calls == 2
+
+
+def test_cancelled_async_call_returns_reservation():
+    client = TushareClient(CountingPro, {"default": 60}, max_wait=30)
+    bucket = client.bucket("income")
+    # 占满突发容量，下一次预约需要等待约 1 秒
+    while bucket.try_take():
+        pass
+
+    async def cancel_while_queued():
+        task = asyncio.ensure_future(client.aquery("income", ts_code="600000.SH"))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_while_queued())
+    # 归还后下一次预约的等待时间与取消前相同，而不是排在被取消的调用之后
+    assert bucket.reserve() == pytest.approx(1.0, abs=0.1)
+
+
+def test_identical_concurrent_calls_share_one_request():
+    started, release = threading.Event(), threading.Event()
+
+    class SlowPro(CountingPro):
+        def query(self, api_name, **params):
+            self.calls += 1
+            started.set()
+            release.wait(5)
+            return pd.DataFrame({"ts_code": [params["ts_code"]]})
+
+    pro = SlowPro()
+    client = TushareClient(lambda: pro, {"default": 600})
+    with ThreadPoolExecutor(4) as pool:
+        first = pool.submit(client.income, ts_code="600000.SH")
+        started.wait(5)
+        same = [pool.submit(client.income, ts_code="600000.SH") for _ in range(2)]
+        other = pool.submit(client.income, ts_code="000001.SZ")
+        time.sleep(0.1)
+        release.set()
+        results = [f.result() for f in (first, *same)]
+        other.result()
+    assert all(r is results[0] for r in results)
+    assert pro.calls == 2
+
+
+def test_coalesced_callers_share_errors():
+    started, release = threading.Event(), threading.Event()
+
+    class FailingPro(CountingPro):
+        def query(self, api_name, **params):
+            self.calls += 1
+            started.set()
+            release.wait(5)
+            raise ValueError("参数错误")
+
+    pro = FailingPro()
+    client = TushareClient(lambda: pro, {"default": 600})
+    with ThreadPoolExecutor(2) as pool:
+        first = pool.submit(client.income, ts_code="600000.SH")
+        started.wait(5)
+        second = pool.submit(client.income, ts_code="600000.SH")
+        time.sleep(0.1)
+        release.set()
+        for future in (first, second):
+            with pytest.raises(ValueError):
+                future.result()
+    assert pro.calls == 1
+
+
+def test_background_call_gives_up_without_spare_tokens():
+    client = TushareClient(CountingPro, {"default": 60}, max_wait=0.3)
+    for _ in range(20):
+        client.bucket("income").reserve()
+    start = time.monotonic()
+    with background(0.5), pytest.raises(RateLimitTimeout):
+        client.income(ts_code="600000.SH")
+    assert time.monotonic() - start < 1.5
@@ -0,0 +1,47 @@
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+from workers import _worker_count, file_lock, hold_lock, lock_path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def other_process(code: str, path: Path) -> subprocess.Popen:
+    """在另一个进程中对 path 执行 code（workers 已导入）"""
+    script = f"import sys, time\nfrom pathlib import Path\nfrom workers import *\npath = Path({str(path)!r})\n{code}"
+    return subprocess.Popen([sys.executable, "-c", script], cwd=ROOT, stdout=subprocess.PIPE, text=True)
+
+
+def test_worker_count():
+    assert _worker_count("4") == 4
+    assert _worker_count("0") == 1
+    assert _worker_count("many") == 1
+    assert _worker_count("auto") >= 1
+
+
+def test_lock_files_live_beside_data(tmp_path):
+    assert lock_path(tmp_path / "income" / "600000.SH_1.parquet") == tmp_path / "income" / ".locks" / "600000.SH_1.parquet.lock"
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="flock")
+def test_file_lock_excludes_other_processes(tmp_path):
+    path = tmp_path / "data.parquet"
+    with file_lock(path):
+        child = other_process("with file_lock(path):\n    print(time.monotonic())", path)
+        time.sleep(0.3)
+        released = time.monotonic()
+    acquired = float(child.communicate(timeout=10)[0])
+    assert acquired >= released
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="flock")
+def test_hold_lock_admits_one_process(tmp_path):
+    path = tmp_path / "prefetch"
+    assert hold_lock(path)
+    assert hold_lock(path)
+    child = other_process("print(hold_lock(path))", path)
+    assert child.communicate(timeout=10)[0].strip() == "False"
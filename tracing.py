@@ -0,0 +1,627 @@
+"""
+请求追踪
+
+每次工具调用生成一个 trace，trace_id 即请求 ID，调用中的各阶段记录为 span：
+    tool.<工具名>       整个调用（根 span），属性中有参数摘要
+    <服务函数名>        数据服务层的查询，如 stock_name、income_statement（见 traced）
+    tushare.<接口名>    上游调用，子 span 为 rate_limit_wait（排队等待令牌）和 upstream（每次请求）
+    format_* / serialization  文本格式化、结果编码
+缓存查询（hit/miss/stale）和重试记录为所在 span 的事件；异常记录类型、信息和堆栈，
+工具返回的错误信息附带请求 ID（见 record_exception）。
+
+span 的字段与 OpenTelemetry 一致（traceId/spanId/parentSpanId、纳秒时间戳、属性、事件、状态）。
+设置 TUSHARE_TRACE_FILE 后以 OTLP/JSON 格式每个 trace 一行追加到文件，
+设置 TUSHARE_TRACE_ENDPOINT 后批量发送到 OTLP/HTTP 收集器（如 http://127.0.0.1:4318/v1/traces），
+导出在后台线程进行，不增加工具调用的耗时。HTTP 请求带有 W3C traceparent 头时沿用调用方的 trace_id。
+
+耗时超过 TUSHARE_SLOW_CALL_MS 的调用把 span 树和参数摘要打印到 stderr。
+
+采样性能剖析（cProfile；安装了 pyinstrument 时可选用）默认关闭，可通过 TUSHARE_PROFILE_SAMPLE
+或 HTTP 服务的 /admin/profiler 路由在运行时开启（见 Profiler），剖析结果按请求 ID 保存在
+TUSHARE_PROFILE_DIR（默认为数据目录下的 profiles/），多个 worker 共用同一份开关和结果。
+"""
+import contextlib
+import contextvars
+import functools
+import importlib.util
+import inspect
+import io
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import traceback
+import urllib.request
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# OTLP/JSON 追踪文件路径，为空时不写文件
+TRACE_FILE = os.getenv("TUSHARE_TRACE_FILE", "")
+
+# OTLP/HTTP 收集器地址，为空时不发送
+TRACE_ENDPOINT = os.getenv("TUSHARE_TRACE_ENDPOINT", "")
+
+# 导出的 trace 比例（0~1），慢调用和出错的调用总是导出
+TRACE_SAMPLE = float(os.getenv("TUSHARE_TRACE_SAMPLE", "1"))
+
+# 慢调用阈值（毫秒），超过时打印 span 树，0 表示不启用
+SLOW_CALL_MS = float(os.getenv("TUSHARE_SLOW_CALL_MS", "3000"))
+
+# 启动时的性能剖析采样比例（0~1），0 表示不启用；运行时可通过 /admin/profiler 修改
+PROFILE_SAMPLE = float(os.getenv("TUSHARE_PROFILE_SAMPLE", "0"))
+
+SERVICE_NAME = "tushare-mcp"
+
+# 单个 trace 最多记录的 span 数（批量查询逐只拉取时 span 很多）
+MAX_SPANS = 512
+
+# 导出队列长度，满了之后丢弃新的 trace
+EXPORT_QUEUE = 1024
+
+# 发送到收集器的批大小和最长间隔（秒）
+EXPORT_BATCH = 64
+EXPORT_INTERVAL = 2.0
+
+# 参数摘要中字符串和列表的最大长度
+SUMMARY_CHARS = 80
+SUMMARY_ITEMS = 5
+
+# 参数摘要中隐藏取值的参数
+SECRET_PARAMS = ("token",)
+
+# 剖析开关和结果的保存目录，默认为数据目录（TUSHARE_DATA_DIR）下的 profiles/
+PROFILE_DIR = Path(os.getenv(
+    "TUSHARE_PROFILE_DIR",
+    str(Path(os.getenv("TUSHARE_DATA_DIR", str(Path.home() / ".tushare_mcp"))) / "profiles"),
+))
+
+# 保留的剖析结果数量
+PROFILE_KEEP = 200
+
+# OTLP 的 span 类型和状态码
+KIND_INTERNAL, KIND_SERVER, KIND_CLIENT = 1, 2, 3
+STATUS_OK, STATUS_ERROR = 1, 2
+
+
+class Span:
+    """一个阶段的起止时间、属性和事件，字段含义同 OpenTelemetry"""
+
+    __slots__ = ("trace", "span_id", "parent_id", "name", "kind", "start", "end", "attributes", "events", "error")
+
+    def __init__(self, trace: "Trace", name: str, parent_id: str = "", kind: int = KIND_INTERNAL, start: Optional[int] = None):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start = start if start is not None else time.time_ns()
+        self.end = 0
+        self.attributes: Dict[str, Any] = {}
+        self.events: List[tuple] = []
+        self.error = ""
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end or time.time_ns()) - self.start) / 1e6
+
+    def event(self, name: str, **attributes):
+        self.events.append((time.time_ns(), name, attributes))
+
+    def child(self, name: str, kind: int = KIND_INTERNAL, start: Optional[int] = None) -> Optional["Span"]:
+        """新建子 span，超出 MAX_SPANS 时返回 None"""
+        trace = self.trace
+        if len(trace.spans) >= MAX_SPANS:
+            trace.dropped += 1
+            return None
+        span = Span(trace, name, self.span_id, kind, start)
+        trace.spans.append(span)
+        return span
+
+
+class Trace:
+    """一次工具调用的全部 span，第一个为根 span"""
+
+    def __init__(self, name: str, trace_id: str = "", parent_id: str = ""):
+        self.trace_id = trace_id or os.urandom(16).hex()
+        self.root = Span(self, name, parent_id, KIND_SERVER)
+        self.spans: List[Span] = [self.root]
+        self.dropped = 0
+        self.args: Dict[str, Any] = {}
+        self.profile = False
+
+
+# 当前所在的 span，run_blocking 和批量查询通过 copy_context 带入工作线程
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("tushare_span", default=None)
+
+# 返回当前请求 traceparent 头的函数（HTTP 入口设置，见 set_parent_source）
+_parent_source: Optional[Callable[[], Optional[str]]] = None
+
+
+def set_parent_source(source: Callable[[], Optional[str]]):
+    """设置读取调用方 traceparent 的函数，不在 HTTP 请求中时应返回 None 或抛出 RuntimeError"""
+    global _parent_source
+    _parent_source = source
+
+
+def _incoming_parent() -> tuple:
+    """调用方的 (trace_id, parent span_id)，没有或格式不对时为空字符串"""
+    if _parent_source is None:
+        return "", ""
+    try:
+        header = _parent_source()
+    except RuntimeError:
+        return "", ""
+    parts = (header or "").strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or parts[1] == "0" * 32:
+        return "", ""
+    return parts[1].lower(), parts[2].lower()
+
+
+def request_id() -> Optional[str]:
+    """当前工具调用的请求 ID（trace_id），不在工具调用中时为 None"""
+    span = _current.get()
+    return span.trace.trace_id if span is not None else None
+
+
+@contextlib.contextmanager
+def span(name: str, kind: int = KIND_INTERNAL, **attributes) -> Iterator[Optional[Span]]:
+    """在当前 span 下记录一个阶段；不在工具调用中时什么也不做"""
+    parent = _current.get()
+    current = parent.child(name, kind) if parent is not None else None
+    if current is None:
+        yield None
+        return
+    current.attributes.update(attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        _record(current, e)
+        raise
+    finally:
+        _current.reset(token)
+        current.end = time.time_ns()
+
+
+def add_span(name: str, seconds: float, **attributes):
+    """补记一个刚结束、持续了 seconds 秒的阶段（如排队等待令牌）"""
+    parent = _current.get()
+    if parent is None:
+        return
+    end = time.time_ns()
+    current = parent.child(name, start=end - int(seconds * 1e9))
+    if current is not None:
+        current.end = end
+        current.attributes.update(attributes)
+
+
+def annotate(**attributes):
+    """给当前 span 添加属性"""
+    current = _current.get()
+    if current is not None:
+        current.attributes.update(attributes)
+
+
+def event(name: str, **attributes):
+    """给当前 span 添加事件"""
+    current = _current.get()
+    if current is not None:
+        current.event(name, **attributes)
+
+
+def _record(target: Span, e: BaseException):
+    if target.error:
+        return
+    target.error = f"{type(e).__name__}: {e}"
+    target.event(
+        "exception",
+        **{
+            "exception.type": type(e).__name__,
+            "exception.message": str(e),
+            "exception.stacktrace": "".join(traceback.format_exception(type(e), e, e.__traceback__)),
+        },
+    )
+
+
+def record_exception(e: BaseException) -> Optional[str]:
+    """
+    记录工具内部捕获的异常（类型、信息和堆栈），并把整个调用标记为失败
+
+    返回请求 ID，供工具附在错误信息中；不在工具调用中时返回 None。
+    """
+    current = _current.get()
+    if current is None:
+        return None
+    _record(current, e)
+    if current is not current.trace.root:
+        current.trace.root.error = current.trace.root.error or current.error
+    return current.trace.trace_id
+
+
+def traced(func):
+    """以函数名为 span 名称记录同步函数的调用（服务层查询、格式化等）"""
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _current.get() is None:
+            return func(*args, **kwargs)
+        with span(name):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def _summarize(name: str, value: Any) -> Any:
+    if name in SECRET_PARAMS and value:
+        return "***"
+    if isinstance(value, str):
+        return value if len(value) <= SUMMARY_CHARS else value[:SUMMARY_CHARS] + f"...({len(value)})"
+    if isinstance(value, (list, tuple)):
+        head = [_summarize(name, v) for v in value[:SUMMARY_ITEMS]]
+        return head + [f"...({len(value)})"] if len(value) > SUMMARY_ITEMS else head
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    return type(value).__name__
+
+
+def summarize_args(signature: inspect.Signature, args, kwargs) -> Dict[str, Any]:
+    """工具参数摘要：长字符串和列表截断，token 隐藏，其他对象只保留类型名"""
+    try:
+        bound = signature.bind_partial(*args, **kwargs)
+    except TypeError:
+        return {}
+    return {name: _summarize(name, value) for name, value in bound.arguments.items() if name != "ctx"}
+
+
+@contextlib.contextmanager
+def trace(tool: str, signature: inspect.Signature, args, kwargs) -> Iterator[Trace]:
+    """一次工具调用的根 span；结束时按需打印慢调用、导出"""
+    trace_id, parent_id = _incoming_parent()
+    current = Trace(f"tool.{tool}", trace_id, parent_id)
+    current.root.attributes["tool"] = tool
+    # 参数摘要只在打印或导出时使用，先保存原始参数
+    current.args = {"signature": signature, "args": args, "kwargs": kwargs}
+    current.profile = profiler.sampled(tool)
+    token = _current.set(current.root)
+    try:
+        yield current
+    except BaseException as e:
+        _record(current.root, e)
+        raise
+    finally:
+        _current.reset(token)
+        current.root.end = time.time_ns()
+        _finish(current)
+
+
+def _finish(current: Trace):
+    root = current.root
+    slow = SLOW_CALL_MS > 0 and root.duration_ms >= SLOW_CALL_MS
+    export = exporter.enabled and (slow or root.error or random.random() < TRACE_SAMPLE)
+    if not (slow or export):
+        return
+    raw = current.args
+    root.attributes["args"] = json.dumps(summarize_args(raw["signature"], raw["args"], raw["kwargs"]), ensure_ascii=False)
+    if current.dropped:
+        root.attributes["dropped_spans"] = current.dropped
+    if slow:
+        print(format_tree(current), file=sys.stderr)
+    if export:
+        exporter.submit(current)
+
+
+def format_tree(current: Trace) -> str:
+    """慢调用日志：请求 ID、参数摘要和缩进的 span 树（耗时、属性、缓存事件、错误）"""
+    root = current.root
+    children: Dict[str, List[Span]] = {}
+    for item in current.spans[1:]:
+        children.setdefault(item.parent_id, []).append(item)
+
+    lines = [
+        f"[trace] slow call {root.attributes.get('tool', root.name)} {root.duration_ms:.1f}ms "
+        f"request_id={current.trace_id} args={root.attributes.get('args', '{}')}"
+    ]
+
+    def walk(item: Span, depth: int):
+        details = [f"{k}={v}" for k, v in item.attributes.items() if k not in ("args", "tool")]
+        details += [f"{attrs.get('cache')}:{attrs.get('result')}" for _, name, attrs in item.events if name == "cache"]
+        if item.error:
+            details.append(f"error={item.error}")
+        suffix = f" [{', '.join(str(d) for d in details)}]" if details else ""
+        lines.append(f"[trace]   {'  ' * depth}{item.name} {item.duration_ms:.1f}ms{suffix}")
+        for child in sorted(children.get(item.span_id, []), key=lambda s: s.start):
+            walk(child, depth + 1)
+
+    walk(root, 0)
+    if current.dropped:
+        lines.append(f"[trace]   ... {current.dropped} more spans not recorded")
+    return "\n".join(lines)
+
+
+def _value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _attributes(attributes: Dict[str, Any]) -> List[Dict]:
+    return [{"key": k, "value": _value(v)} for k, v in attributes.items()]
+
+
+def to_otlp(traces: List[Trace]) -> Dict:
+    """OTLP/JSON（ExportTraceServiceRequest）格式"""
+    spans = []
+    for current in traces:
+        for item in current.spans:
+            if not item.end:
+                # 超时返回后仍在执行的阶段
+                continue
+            entry = {
+                "traceId": current.trace_id,
+                "spanId": item.span_id,
+                "name": item.name,
+                "kind": item.kind,
+                "startTimeUnixNano": str(item.start),
+                "endTimeUnixNano": str(item.end),
+                "attributes": _attributes(item.attributes),
+                "events": [
+                    {"timeUnixNano": str(at), "name": name, "attributes": _attributes(attrs)}
+                    for at, name, attrs in item.events
+                ],
+                "status": {"code": STATUS_ERROR, "message": item.error} if item.error else {"code": STATUS_OK},
+            }
+            if item.parent_id:
+                entry["parentSpanId"] = item.parent_id
+            spans.append(entry)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": _attributes({"service.name": SERVICE_NAME, "process.pid": os.getpid()})},
+            "scopeSpans": [{"scope": {"name": SERVICE_NAME}, "spans": spans}],
+        }]
+    }
+
+
+class Exporter:
+    """
+    后台导出线程：写入 TRACE_FILE（每个 trace 一行）和/或批量发送到 TRACE_ENDPOINT
+
+    队列满或收集器不可用时丢弃 trace，不影响工具调用。
+    """
+
+    def __init__(self, path: str = TRACE_FILE, endpoint: str = TRACE_ENDPOINT):
+        self.path = path
+        self.endpoint = endpoint
+        self._queue: "queue.Queue[Trace]" = queue.Queue(maxsize=EXPORT_QUEUE)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._failed_at = 0.0
+        self._stats = {"exported": 0, "dropped": 0, "failed": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path or self.endpoint)
+
+    def status(self) -> Dict:
+        return {"file": self.path or None, "endpoint": self.endpoint or None, **self._stats}
+
+    def submit(self, current: Trace):
+        try:
+            self._queue.put_nowait(current)
+        except queue.Full:
+            self._stats["dropped"] += 1
+            return
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="trace-export", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + EXPORT_INTERVAL
+            while len(batch) < EXPORT_BATCH:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._export(batch)
+
+    def _export(self, batch: List[Trace]):
+        try:
+            if self.path:
+                # 每个 trace 一次 write，多个 worker 追加同一文件时行不会交错
+                lines = "".join(json.dumps(to_otlp([t]), ensure_ascii=False) + "\n" for t in batch).encode()
+                fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+                try:
+                    os.write(fd, lines)
+                finally:
+                    os.close(fd)
+            if self.endpoint:
+                request = urllib.request.Request(
+                    self.endpoint,
+                    data=json.dumps(to_otlp(batch)).encode(),
+                    headers={"Content-Type": "application/json"},
+                    method="POST",
+                )
+                urllib.request.urlopen(request, timeout=5).close()
+            self._stats["exported"] += len(batch)
+        except Exception as e:
+            self._stats["failed"] += len(batch)
+            # 每分钟最多提示一次
+            now = time.monotonic()
+            if now - self._failed_at > 60:
+                self._failed_at = now
+                print(f"[trace] export failed, dropping {len(batch)} traces: {e}", file=sys.stderr)
+
+
+class Profiler:
+    """
+    按比例对工具调用做性能剖析
+
+    开关保存在 PROFILE_DIR/profiler.json 中，各 worker 每秒最多检查一次；
+    每次剖析的结果以请求 ID 为文件名保存在同一目录（cProfile 为 .prof，可用 pstats/snakeviz 打开，
+    pyinstrument 为 .txt），超过 PROFILE_KEEP 个时删除最早的。同一时刻只剖析一个调用。
+    """
+
+    ENGINES = ("cprofile", "pyinstrument")
+
+    def __init__(self, directory: Path = PROFILE_DIR, sample: float = PROFILE_SAMPLE):
+        self.directory = directory
+        self._config = {"sample": max(0.0, min(1.0, sample)), "tools": [], "engine": "cprofile"}
+        self._checked_at = 0.0
+        self._mtime = 0.0
+        self._busy = threading.Lock()
+        self._lock = threading.Lock()
+
+    def config(self) -> Dict:
+        self._reload()
+        return dict(self._config)
+
+    def configure(self, sample: float, tools: Optional[List[str]] = None, engine: str = "cprofile") -> Dict:
+        """修改开关并写入共享的配置文件；sample 为 0 时关闭"""
+        if engine not in self.ENGINES:
+            raise ValueError(f"engine 只能为 {' 或 '.join(self.ENGINES)}")
+        if engine == "pyinstrument" and importlib.util.find_spec("pyinstrument") is None:
+            raise ImportError("未安装 pyinstrument，无法使用该剖析引擎")
+        config = {"sample": max(0.0, min(1.0, float(sample))), "tools": list(tools or []), "engine": engine}
+        path = self.directory / "profiler.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(config))
+        os.replace(tmp, path)
+        with self._lock:
+            self._config, self._checked_at = config, 0.0
+        print(f"[trace] profiler {'enabled' if config['sample'] else 'disabled'}: {config}", file=sys.stderr)
+        return config
+
+    def sampled(self, tool: str) -> bool:
+        """本次调用是否剖析"""
+        self._reload()
+        config = self._config
+        if config["sample"] <= 0 or (config["tools"] and tool not in config["tools"]):
+            return False
+        return random.random() < config["sample"]
+
+    def _reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < 1.0:
+            return
+        self._checked_at = now
+        try:
+            path = self.directory / "profiler.json"
+            mtime = path.stat().st_mtime
+            if mtime != self._mtime:
+                config = json.loads(path.read_text())
+                with self._lock:
+                    self._config.update(config)
+                    self._mtime = mtime
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[trace] ignoring invalid profiler config: {e}", file=sys.stderr)
+
+    @contextlib.contextmanager
+    def run(self) -> Iterator[None]:
+        """在当前线程剖析一段执行，当前调用未被抽中或已有剖析在进行时直接执行"""
+        current = _current.get()
+        if current is None or not current.trace.profile or not self._busy.acquire(blocking=False):
+            yield
+            return
+        engine = self._config.get("engine", "cprofile")
+        try:
+            session = self._start(engine)
+        except Exception as e:
+            self._busy.release()
+            print(f"[trace] profiler failed to start: {e}", file=sys.stderr)
+            yield
+            return
+        try:
+            yield
+        finally:
+            try:
+                self._save(current.trace, engine, session)
+            except Exception as e:
+                print(f"[trace] failed to save profile: {e}", file=sys.stderr)
+            finally:
+                self._busy.release()
+
+    def _start(self, engine: str):
+        if engine == "pyinstrument":
+            from pyinstrument import Profiler as Sampler
+            session = Sampler(async_mode="disabled")
+            session.start()
+            return session
+        import cProfile
+        session = cProfile.Profile()
+        session.enable()
+        return session
+
+    def _save(self, current: Trace, engine: str, session):
+        directory = self.directory
+        directory.mkdir(parents=True, exist_ok=True)
+        # 同一次调用可能分几段在线程池中执行，文件名加序号
+        stem = f"{current.trace_id}-{len(list(directory.glob(current.trace_id + '-*')))}"
+        if engine == "pyinstrument":
+            session.stop()
+            (directory / f"{stem}.txt").write_text(session.output_text(unicode=True, color=False))
+        else:
+            session.disable()
+            session.dump_stats(str(directory / f"{stem}.prof"))
+        current.root.attributes["profile"] = stem
+        self._prune(directory)
+
+    def _prune(self, directory: Path):
+        files = sorted(
+            (p for p in directory.iterdir() if p.suffix in (".prof", ".txt")),
+            key=lambda p: p.stat().st_mtime,
+        )
+        for path in files[:-PROFILE_KEEP]:
+            path.unlink(missing_ok=True)
+
+    def recent(self, limit: int = 50) -> List[Dict]:
+        """最近的剖析结果（文件名、大小、时间），新的在前"""
+        try:
+            files = [p for p in self.directory.iterdir() if p.suffix in (".prof", ".txt")]
+        except FileNotFoundError:
+            return []
+        files.sort(key=lambda p: p.stat().st_mtime, reverse=True)
+        return [
+            {"id": p.stem, "engine": "cprofile" if p.suffix == ".prof" else "pyinstrument",
+             "bytes": p.stat().st_size, "at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(p.stat().st_mtime))}
+            for p in files[:limit]
+        ]
+
+    def report(self, profile_id: str, lines: int = 60) -> Optional[str]:
+        """剖析结果的文本报告（cProfile 按累计耗时排序），找不到时为 None；profile_id 为请求 ID 或文件名"""
+        directory = self.directory
+        if not profile_id or not all(c in "0123456789abcdef-" for c in profile_id):
+            return None
+        matches = sorted(directory.glob(f"{profile_id}*")) if directory.exists() else []
+        matches = [p for p in matches if p.suffix in (".prof", ".txt")]
+        if not matches:
+            return None
+        parts = []
+        for path in matches:
+            if path.suffix == ".txt":
+                parts.append(path.read_text())
+                continue
+            import pstats
+            out = io.StringIO()
+            pstats.Stats(str(path), stream=out).sort_stats("cumulative").print_stats(lines)
+            parts.append(out.getvalue())
+        return "\n".join(parts)
+
+
+exporter = Exporter()
+profiler = Profiler()
@@ -0,0 +1,495 @@
+"""
+Tushare 客户端封装：连接复用 + 按接口限流 + 相同请求合并
+
+- PooledDataApi 与 tushare 的 DataApi 用法相同，但通过共享的 requests.Session
+  复用 keep-alive 连接，避免每次调用都重新建立 TCP/TLS 连接；
+- 每个接口（stock_basic、income 等）一个令牌桶，调用前按先来后到预约令牌，
+  超出配额时排队等待而不是直接报错；
+- 参数完全相同且仍在进行中的请求共享同一次上游调用（single-flight）；
+- 上游返回"每分钟最多访问"类限流错误时，暂停该接口 TUSHARE_RATE_LIMIT_COOLDOWN 秒，
+  本次调用重新排到冷却期之后重试一次；需要等待超过 TUSHARE_MAX_RATE_WAIT 时才报错（UpstreamRateLimited），
+  冷却期间的其他调用同样排队；
+- 网络错误、超时和 5xx 按指数退避重试，连续失败后熔断（见 resilience.py），
+  熔断期间直接抛出 CircuitOpenError，不再等待超时；
+- 在 background() 上下文中发起的调用（如预取）最多占用各接口配额的一定比例，
+  且只使用空闲令牌，交互请求排队时让出配额；等待空闲令牌超过 TUSHARE_MAX_RATE_WAIT 时放弃。
+- 多 worker 部署（TUSHARE_WORKERS）时每个进程只使用配额的 1/N，
+  所有 worker 合计不超过配置的速率。
+
+同步调用（client.income(...)）与异步调用（await client.aquery("income", ...)）
+共用同一套令牌桶和合并表。合并后的调用方拿到的是同一个 DataFrame，不要原地修改。
+"""
+import asyncio
+import contextlib
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from contextvars import ContextVar
+from functools import partial
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+import tracing
+from memo import no_store
+from metrics import (
+    CIRCUIT_REJECTIONS,
+    RATE_LIMIT_WAIT,
+    UPSTREAM_DURATION,
+    UPSTREAM_ERRORS,
+    UPSTREAM_IN_FLIGHT,
+    UPSTREAM_RETRIES,
+    record_phase,
+)
+from resilience import CLOSED, RETRIES, CircuitBreaker, CircuitOpenError, backoff, is_transient
+from workers import WORKERS
+
+# 每个接口每分钟调用次数，格式："stock_basic=60,income=200,default=200"
+RATE_LIMITS = os.getenv("TUSHARE_RATE_LIMITS", "")
+DEFAULT_RATE_PER_MINUTE = 200.0
+
+# 令牌桶容量，即允许的瞬时突发调用数
+RATE_BURST = float(os.getenv("TUSHARE_RATE_BURST", "10"))
+
+# 排队等待令牌的最长时间（秒），超过后放弃调用
+MAX_RATE_WAIT = float(os.getenv("TUSHARE_MAX_RATE_WAIT", "60"))
+
+# 上游限流错误的特征文本
+RATE_LIMIT_MARKERS = ("每分钟最多访问", "每小时最多访问", "最多访问该接口")
+
+# 上游 token 无效或无权限的错误特征文本
+AUTH_ERROR_MARKERS = ("token不对", "token无效", "没有访问该接口的权限")
+
+# 命中上游限流后暂停该接口的秒数，应小于 TUSHARE_MAX_RATE_WAIT，否则冷却期间的调用都会直接报错
+RATE_LIMIT_COOLDOWN = float(os.getenv("TUSHARE_RATE_LIMIT_COOLDOWN", "20"))
+
+# 与 Tushare 服务端保持的最大连接数
+HTTP_POOL_SIZE = int(os.getenv("TUSHARE_HTTP_POOL_SIZE", "16"))
+
+# 单次 HTTP 请求超时（秒），与 tushare SDK 默认值一致
+HTTP_TIMEOUT = float(os.getenv("TUSHARE_HTTP_TIMEOUT", "30"))
+
+# Tushare 接口地址（与 tushare SDK 一致，压测时可指向本地模拟服务）
+TUSHARE_HTTP_URL = os.getenv("TUSHARE_HTTP_URL", "http://api.waditu.com/dataapi")
+
+# 当前上下文中的调用是否属于后台任务，值为可占用的配额比例
+_background_share: ContextVar[Optional[float]] = ContextVar("tushare_background_share", default=None)
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def http_session() -> requests.Session:
+    """进程内共享的 HTTP 会话（连接池）"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+
+class PooledDataApi:
+    """
+    与 tushare.pro.client.DataApi 接口一致的客户端，复用 http_session() 的连接
+
+    参数:
+        token: Tushare API token
+        timeout: 单次请求超时（秒）
+    """
+
+    def __init__(self, token: str, timeout: float = HTTP_TIMEOUT, http_url: str = TUSHARE_HTTP_URL):
+        self._token = token
+        self._timeout = timeout
+        self._http_url = http_url
+
+    def query(self, api_name: str, fields: str = "", **kwargs) -> pd.DataFrame:
+        req_params = {
+            "api_name": api_name,
+            "token": self._token,
+            "params": kwargs,
+            "fields": fields,
+        }
+        res = http_session().post(f"{self._http_url}/{api_name}", json=req_params, timeout=self._timeout)
+        if res.status_code >= 500:
+            # 服务端错误交给 TushareClient 重试
+            res.raise_for_status()
+        if not res:
+            return pd.DataFrame()
+        result = json.loads(res.text)
+        if result["code"] != 0:
+            raise Exception(result["msg"])
+        data = result["data"]
+        return pd.DataFrame(data["items"], columns=data["fields"])
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return partial(self.query, name)
+
+
+class RateLimitTimeout(Exception):
+    """排队等待令牌超时"""
+
+
+class UpstreamRateLimited(RateLimitTimeout):
+    """上游返回限流错误，该接口进入冷却"""
+
+
+def is_auth_error(exc: BaseException) -> bool:
+    """上游因 token 无效或积分不足拒绝调用（而不是网络或限流等暂时性故障）"""
+    return any(marker in str(exc) for marker in AUTH_ERROR_MARKERS)
+
+
+def parse_rate_limits(spec: str) -> Dict[str, float]:
+    """解析 "api=次数/分钟" 列表，忽略格式不正确的项"""
+    limits = {}
+    for item in spec.split(","):
+        api_name, sep, value = item.partition("=")
+        if not sep:
+            continue
+        try:
+            limits[api_name.strip()] = float(value)
+        except ValueError:
+            print(f"[client] ignoring invalid rate limit: {item!r}", file=sys.stderr)
+    return limits
+
+
+def _summary(params: Dict) -> str:
+    """追踪中记录的请求参数，fields 只记字段数"""
+    shown = {k: (f"{len(str(v).split(','))} fields" if k == "fields" else v) for k, v in params.items()}
+    return json.dumps(shown, ensure_ascii=False, default=str)
+
+
+class TokenBucket:
+    """
+    令牌桶，按预约方式排队
+
+    reserve() 立即占用下一个可用令牌并返回需要等待的秒数，
+    因此调用方按调用顺序依次获得令牌，同步和异步调用方都适用。
+    """
+
+    def __init__(self, rate_per_minute: float, burst: float = RATE_BURST):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1.0, burst)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1.0
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def try_take(self) -> bool:
+        """有空闲令牌时取走一个并返回 True，否则不排队直接返回 False"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1.0:
+                return False
+            self._tokens -= 1.0
+            return True
+
+    def cancel(self):
+        """归还一个预约但未使用的令牌"""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + 1.0)
+
+    def pause(self, seconds: float):
+        """清空令牌并在 seconds 秒内不再发放"""
+        with self._lock:
+            self._tokens = min(self._tokens, 0.0) - seconds * self.rate
+            self._updated = time.monotonic()
+
+
+@contextlib.contextmanager
+def background(share: float):
+    """
+    在此上下文中（当前线程）发起的同步调用属于后台任务
+
+    每个接口的后台调用不超过配额的 share（0~1），并且只取用主令牌桶中的空闲令牌，
+    有交互请求排队时等待，不会推迟交互请求。
+    """
+    token = _background_share.set(min(1.0, max(0.01, share)))
+    try:
+        yield
+    finally:
+        _background_share.reset(token)
+
+
+class TushareClient:
+    """
+    对 pro_api 的限流封装，可直接替代 pro 使用：client.stock_basic(...)
+
+    参数:
+        pro_factory: 返回 tushare pro_api 实例的函数，首次调用时创建
+        rate_limits: 接口名到每分钟调用次数的映射，"default" 为其余接口的默认值
+        retries: 暂时性故障的重试次数
+    """
+
+    def __init__(
+        self,
+        pro_factory: Callable[[], Any],
+        rate_limits: Optional[Dict[str, float]] = None,
+        max_wait: float = MAX_RATE_WAIT,
+        retries: int = RETRIES,
+    ):
+        self._pro_factory = pro_factory
+        self._pro = None
+        self._limits = parse_rate_limits(RATE_LIMITS) if rate_limits is None else dict(rate_limits)
+        self._max_wait = max_wait
+        self._retries = max(0, retries)
+        self.breaker = CircuitBreaker()
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._background_buckets: Dict[Tuple[str, float], TokenBucket] = {}
+        self._inflight: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def pro(self):
+        if self._pro is None:
+            self._pro = self._pro_factory()
+        return self._pro
+
+    def reset(self):
+        """丢弃缓存的 pro_api 实例（例如更换 token 之后）"""
+        self._pro = None
+
+    def rate(self, api_name: str) -> float:
+        """本进程的接口每分钟调用次数上限（多 worker 时为配额的 1/N）"""
+        return self._limits.get(api_name, self._limits.get("default", DEFAULT_RATE_PER_MINUTE)) / WORKERS
+
+    def bucket(self, api_name: str) -> TokenBucket:
+        with self._lock:
+            bucket = self._buckets.get(api_name)
+            if bucket is None:
+                bucket = self._buckets[api_name] = TokenBucket(self.rate(api_name), RATE_BURST / WORKERS)
+            return bucket
+
+    def background_bucket(self, api_name: str, share: float) -> TokenBucket:
+        """后台调用的令牌桶，速率为配额的 share，不允许突发"""
+        with self._lock:
+            bucket = self._background_buckets.get((api_name, share))
+            if bucket is None:
+                bucket = self._background_buckets[(api_name, share)] = TokenBucket(self.rate(api_name) * share, burst=1.0)
+            return bucket
+
+    def __getattr__(self, api_name: str):
+        if api_name.startswith("_"):
+            raise AttributeError(api_name)
+        return lambda **params: self.query(api_name, **params)
+
+    def query(self, api_name: str, **params):
+        """同步调用，排队等待令牌，相同请求合并"""
+        with tracing.span(f"tushare.{api_name}", tracing.KIND_CLIENT, params=_summary(params)):
+            future, owner = self._join(api_name, params)
+            if not owner:
+                # 等待合并的请求，这段时间计入上游耗时
+                tracing.annotate(coalesced=True)
+                start = time.perf_counter()
+                try:
+                    return future.result()
+                except Exception:
+                    no_store()
+                    raise
+                finally:
+                    record_phase("upstream", time.perf_counter() - start)
+            try:
+                self._wait_for_token(api_name)
+                try:
+                    result = self._call(api_name, params)
+                except UpstreamRateLimited as e:
+                    # 排到冷却期之后重试一次；后台调用不重试，下一轮再拉取
+                    if _background_share.get() is not None:
+                        raise
+                    wait = self._requeue(api_name, e)
+                    time.sleep(wait)
+                    record_phase("rate_limit_wait", wait)
+                    result = self._call(api_name, params)
+                future.set_result(result)
+            except BaseException as e:
+                no_store()
+                future.set_exception(e)
+            finally:
+                self._leave(api_name, params)
+            return future.result()
+
+    async def aquery(self, api_name: str, **params):
+        """异步调用，等待令牌时不阻塞事件循环，上游请求在线程池中执行"""
+        with tracing.span(f"tushare.{api_name}", tracing.KIND_CLIENT, params=_summary(params)):
+            future, owner = self._join(api_name, params)
+            if not owner:
+                tracing.annotate(coalesced=True)
+                try:
+                    return await asyncio.wrap_future(future)
+                except Exception:
+                    no_store()
+                    raise
+            try:
+                await self._asleep(api_name, self._reserve(api_name))
+                loop = asyncio.get_running_loop()
+                # 带上当前上下文，上游耗时和追踪计入本次调用
+                call = contextvars.copy_context().run
+                try:
+                    result = await loop.run_in_executor(None, call, self._call, api_name, params)
+                except UpstreamRateLimited as e:
+                    await self._asleep(api_name, self._requeue(api_name, e))
+                    result = await loop.run_in_executor(None, call, self._call, api_name, params)
+                future.set_result(result)
+            except BaseException as e:
+                no_store()
+                future.set_exception(e)
+            finally:
+                self._leave(api_name, params)
+            return future.result()
+
+    def _key(self, api_name: str, params: Dict) -> Tuple:
+        return (api_name, tuple(sorted((k, repr(v)) for k, v in params.items())))
+
+    def _join(self, api_name: str, params: Dict) -> Tuple[Future, bool]:
+        """返回 (future, 是否由本调用方负责发起上游请求)"""
+        key = self._key(api_name, params)
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future, False
+            future = self._inflight[key] = Future()
+            return future, True
+
+    def _leave(self, api_name: str, params: Dict):
+        with self._lock:
+            self._inflight.pop(self._key(api_name, params), None)
+
+    def _reserve(self, api_name: str) -> float:
+        bucket = self.bucket(api_name)
+        wait = bucket.reserve()
+        if wait > self._max_wait:
+            bucket.cancel()
+            raise RateLimitTimeout(f"{api_name} 调用排队超过 {self._max_wait:.0f} 秒，请稍后重试")
+        RATE_LIMIT_WAIT.observe(wait, api=api_name)
+        return wait
+
+    def _requeue(self, api_name: str, limited: UpstreamRateLimited) -> float:
+        """上游限流后重新预约冷却期之后的令牌，返回需要等待的秒数；超过 max_wait 时抛出 limited"""
+        try:
+            return self._reserve(api_name)
+        except RateLimitTimeout:
+            raise limited from None
+
+    async def _asleep(self, api_name: str, wait: float):
+        """异步等待预约的令牌；等待期间被取消（客户端断开、工具超时）时归还令牌"""
+        if not wait:
+            return
+        try:
+            await asyncio.sleep(wait)
+        except asyncio.CancelledError:
+            self.bucket(api_name).cancel()
+            raise
+        record_phase("rate_limit_wait", wait)
+
+    def _wait_for_token(self, api_name: str):
+        share = _background_share.get()
+        if share is not None:
+            self._wait_for_spare_token(api_name, share)
+            return
+        wait = self._reserve(api_name)
+        if wait:
+            time.sleep(wait)
+            record_phase("rate_limit_wait", wait)
+
+    def _wait_for_spare_token(self, api_name: str, share: float):
+        """
+        后台调用：先受 share 比例的配额约束，再等待主令牌桶出现空闲令牌
+
+        交互请求持续占满配额时，等待超过 max_wait 秒后放弃（抛出 RateLimitTimeout），
+        后台任务下一轮再试，不会一直占着线程。
+        """
+        deadline = time.monotonic() + self._max_wait
+        spare = self.background_bucket(api_name, share)
+        wait = spare.reserve()
+        if wait > self._max_wait:
+            spare.cancel()
+            raise RateLimitTimeout(f"{api_name} 后台调用排队超过 {self._max_wait:.0f} 秒，放弃本次拉取")
+        if wait:
+            time.sleep(wait)
+        bucket = self.bucket(api_name)
+        while not bucket.try_take():
+            if time.monotonic() >= deadline:
+                raise RateLimitTimeout(f"{api_name} 在 {self._max_wait:.0f} 秒内没有空闲配额，放弃后台拉取")
+            time.sleep(1.0 / bucket.rate)
+
+    def _query(self, api_name: str, params: Dict):
+        """上游请求，暂时性故障按指数退避重试，熔断期间直接失败"""
+        attempt = 0
+        while True:
+            try:
+                self.breaker.before_call()
+            except CircuitOpenError:
+                CIRCUIT_REJECTIONS.inc(api=api_name)
+                raise
+            try:
+                result = self._request(api_name, params)
+            except Exception as e:
+                if not is_transient(e):
+                    # 业务错误说明上游可达，不计入熔断
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                if attempt >= self._retries or self.breaker.state != CLOSED:
+                    raise
+                delay = backoff(attempt)
+                attempt += 1
+                UPSTREAM_RETRIES.inc(api=api_name)
+                tracing.event("retry", attempt=attempt, delay=round(delay, 3), error=str(e))
+                print(f"[client] {api_name} failed ({e}), retry {attempt} in {delay:.2f}s", file=sys.stderr)
+                time.sleep(delay)
+                record_phase("upstream", delay)
+                continue
+            self.breaker.record_success()
+            return result
+
+    def _request(self, api_name: str, params: Dict):
+        """一次上游请求，记录耗时和错误"""
+        UPSTREAM_IN_FLIGHT.inc(api=api_name)
+        start = time.perf_counter()
+        try:
+            result = self.pro.query(api_name, **params)
+            tracing.annotate(rows=len(result) if result is not None else 0)
+            return result
+        except Exception:
+            UPSTREAM_ERRORS.inc(api=api_name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            UPSTREAM_IN_FLIGHT.dec(api=api_name)
+            UPSTREAM_DURATION.observe(elapsed, api=api_name)
+            record_phase("upstream", elapsed)
+
+    def _call(self, api_name: str, params: Dict):
+        try:
+            return self._query(api_name, params)
+        except Exception as e:
+            if not any(marker in str(e) for marker in RATE_LIMIT_MARKERS):
+                raise
+            # 上游限流：暂停该接口一段时间，由调用方决定是否排到冷却期之后重试
+            print(f"[client] {api_name} hit upstream rate limit, cooling down: {e}", file=sys.stderr)
+            self.bucket(api_name).pause(RATE_LIMIT_COOLDOWN)
+            raise UpstreamRateLimited(
+                f"{api_name} 触发 Tushare 限流，该接口暂停 {RATE_LIMIT_COOLDOWN:.0f} 秒，请稍后重试"
+            ) from e
@@ -0,0 +1,76 @@
+"""
+后台预热
+
+服务启动时只做最少的工作（注册工具、监听端口），
+较重的模块导入和 Tushare 连通性探测放到后台线程依次执行，
+/health 通过 WarmUp.status() 报告进度，不阻塞冷启动。
+"""
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+PENDING = "pending"
+RUNNING = "running"
+READY = "ready"
+FAILED = "failed"
+
+
+class WarmUp:
+    """
+    在后台线程中按顺序执行预热步骤
+
+    单个步骤失败只记录错误，不影响后续步骤；
+    标记为 required 的步骤失败时整体状态为 failed。
+    """
+
+    def __init__(self):
+        self.state = PENDING
+        self._steps: Dict[str, Dict] = {}
+        self._started_at: Optional[float] = None
+        self._finished_at: Optional[float] = None
+        self._done = threading.Event()
+
+    @property
+    def ready(self) -> bool:
+        return self.state == READY
+
+    def start(self, steps: List[Tuple[str, Callable[[], object], bool]]):
+        """steps: [(名称, 无参函数, 是否必需), ...]"""
+        if self._started_at is not None:
+            return
+        self._started_at = time.monotonic()
+        self.state = RUNNING
+        for name, _, _ in steps:
+            self._steps[name] = {"state": PENDING}
+        threading.Thread(target=self._run, args=(steps,), name="warmup", daemon=True).start()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """等待预热结束，返回是否已结束"""
+        return self._done.wait(timeout)
+
+    def status(self) -> Dict:
+        elapsed = None
+        if self._started_at is not None:
+            elapsed = round((self._finished_at or time.monotonic()) - self._started_at, 3)
+        return {"state": self.state, "elapsed": elapsed, "steps": {k: dict(v) for k, v in self._steps.items()}}
+
+    def _run(self, steps):
+        failed = False
+        for name, func, required in steps:
+            step = self._steps[name]
+            step["state"] = RUNNING
+            start = time.monotonic()
+            try:
+                func()
+                step["state"] = READY
+            except Exception as e:
+                step["state"] = FAILED
+                step["error"] = str(e)
+                failed = failed or required
+                print(f"[init] warm-up step {name} failed: {e}", file=sys.stderr)
+            step["seconds"] = round(time.monotonic() - start, 3)
+        self._finished_at = time.monotonic()
+        self.state = FAILED if failed else READY
+        print(f"[init] warm-up {self.state} in {self._finished_at - self._started_at:.2f}s", file=sys.stderr)
+        self._done.set()
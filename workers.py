@@ -0,0 +1,107 @@
+"""
+多 worker 部署的进程间协调
+
+HTTP 服务默认单进程运行，pandas 转换和 JSON 编码受 GIL 限制只能用满一个核。
+设置 TUSHARE_WORKERS=N（或 auto，取 CPU 核数）后由 uvicorn 启动 N 个 worker 进程
+共同监听同一端口：
+- MCP 改用无状态 streamable-HTTP，每个请求自带完整上下文，不依赖进程内的会话，
+  请求落到任意 worker 都能处理，不需要会话粘滞；
+- TUSHARE_DATA_DIR 下的报表、行情、比率表和股票列表文件是所有 worker 共享的缓存：
+  拉取同一份数据前先取得该文件的锁（file_lock），一个 worker 拉取并写盘，
+  等锁的 worker 随后直接读盘；内存中的数据早于磁盘文件时重新读盘；
+- 工具输出缓存（memo）保存在 DATA_DIR 下的 SQLite 文件中，各 worker 共用；
+- 每个 worker 的限流速率为配置值的 1/N，合计不超过 Tushare 的频次配额；
+- 财报季预取只在取得 leader 锁（hold_lock）的一个 worker 中运行。
+
+文件锁基于 flock，不支持的平台（Windows）上不加锁，行为与单进程相同。
+"""
+import contextlib
+import os
+import sys
+from pathlib import Path
+from typing import Dict, Iterator
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def _worker_count(value: str) -> int:
+    value = value.strip().lower()
+    if value == "auto":
+        return os.cpu_count() or 1
+    try:
+        return max(1, int(value))
+    except ValueError:
+        print(f"[init] ignoring invalid TUSHARE_WORKERS: {value!r}", file=sys.stderr)
+        return 1
+
+
+# HTTP 服务的 worker 进程数，auto 表示 CPU 核数；1 为单进程
+WORKERS = _worker_count(os.getenv("TUSHARE_WORKERS", "1"))
+
+# 使用无状态 streamable-HTTP（多 worker 时默认开启；多副本部署在负载均衡之后时也可单独开启）
+STATELESS_HTTP = os.getenv("TUSHARE_STATELESS_HTTP", "1" if WORKERS > 1 else "0") == "1"
+
+# 进程退出前一直持有的锁：锁文件路径 → 文件描述符
+_held: Dict[str, int] = {}
+
+
+def lock_path(path: Path) -> Path:
+    """path 对应的锁文件：同目录 .locks/ 下的 <文件名>.lock"""
+    return path.parent / ".locks" / f"{path.name}.lock"
+
+
+def _open(path: Path):
+    target = lock_path(path)
+    try:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        return os.open(target, os.O_RDWR | os.O_CREAT, 0o644)
+    except OSError as e:
+        print(f"[store] cannot open lock file {target}, continuing without it: {e}", file=sys.stderr)
+        return None
+
+
+@contextlib.contextmanager
+def file_lock(path: Path) -> Iterator[None]:
+    """
+    跨进程互斥地处理 path 对应的数据（拉取、写盘）
+
+    同一进程内的线程互斥仍由调用方的线程锁负责，这里只在进程之间互斥；
+    锁文件无法创建或平台不支持 flock 时不加锁。
+    """
+    fd = _open(path) if fcntl is not None else None
+    if fd is None:
+        yield
+        return
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        # 关闭文件描述符即释放锁
+        os.close(fd)
+
+
+def hold_lock(path: Path) -> bool:
+    """
+    不等待地取得 path 对应的锁并持有到进程退出，取得（或已持有）时返回 True
+
+    用于只应在一个 worker 中运行的后台任务；持有锁的进程退出后，
+    下一个尝试的进程取得锁。平台不支持 flock 时总是返回 True。
+    """
+    if fcntl is None:
+        return True
+    key = str(lock_path(path))
+    if key in _held:
+        return True
+    fd = _open(path)
+    if fd is None:
+        return True
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return False
+    _held[key] = fd
+    return True